@@ -8,6 +8,10 @@ python manage.py migrate
 echo "Collecting static files..."
 python manage.py collectstatic --noinput
 
+# Generate the OpenAPI schema served as a static file
+echo "Generating OpenAPI schema..."
+python manage.py generate_schema
+
 # Create superuser if it doesn't exist
 echo "Creating superuser..."
 DJANGO_SUPERUSER_USERNAME=admin \
@@ -15,6 +19,15 @@ DJANGO_SUPERUSER_EMAIL=admin@gmail.com \
 DJANGO_SUPERUSER_PASSWORD=password \
 python manage.py createsuperuser --noinput
 
+# Prepare a clean directory for metrics shared by gunicorn workers
+export PROMETHEUS_MULTIPROC_DIR=/tmp/prometheus
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+# Share throttling buckets between gunicorn workers through shared memory
+export THROTTLE_BUCKET_DIR=/dev/shm/libapi-throttle
+rm -rf "$THROTTLE_BUCKET_DIR"
+
 # Start gunicorn
 echo "Starting gunicorn..."
-exec gunicorn --bind 0.0.0.0:8000 --workers 4 libapi.wsgi:application
\ No newline at end of file
+exec gunicorn --bind 0.0.0.0:8000 --workers 4 --preload libapi.wsgi:application
\ No newline at end of file
@@ -0,0 +1,12 @@
+from prometheus_client import multiprocess
+
+
+def child_exit(server, worker):
+    # Drop live gauges of the exited worker from the shared metrics directory
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_worker_init(worker):
+    # Warm the availability index when the worker starts instead of in its first lookup
+    from library.availability import availability_index
+    availability_index.warm_in_background()
@@ -0,0 +1,75 @@
+"""
+OpenAPI schema for the Library API.
+
+The schema only depends on the code, so it is rendered once per process and
+served from memory with a content hash ETag. The ``generate_schema``
+management command writes the same documents to SCHEMA_ROOT at build time,
+where WhiteNoise serves them without reaching Django at all.
+
+Schema generation and its validators are slow to import and never needed to
+serve API requests, so they are only imported on first use.
+"""
+
+import hashlib
+import threading
+
+from django.http import HttpResponse
+from django.views.decorators.http import condition
+from drf_yasg import openapi
+from rest_framework import permissions
+
+api_info = openapi.Info(
+    title="Library API",
+    default_version='v1',
+    description="Library management API",
+)
+
+SCHEMA_FORMATS = {
+    '.json': 'application/json',
+    '.yaml': 'application/yaml',
+}
+
+_rendered = {}
+_ui_views = {}
+_lock = threading.Lock()
+
+
+def render_schema(format):
+    from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+    from drf_yasg.generators import OpenAPISchemaGenerator
+
+    codec_class = OpenAPICodecJson if format == '.json' else OpenAPICodecYaml
+    schema = OpenAPISchemaGenerator(api_info).get_schema(request=None, public=True)
+    return codec_class(validators=[]).encode(schema)
+
+
+def get_rendered_schema(format):
+    with _lock:
+        if format not in _rendered:
+            content = render_schema(format)
+            _rendered[format] = (content, hashlib.sha256(content).hexdigest())
+        return _rendered[format]
+
+
+@condition(etag_func=lambda request, format: get_rendered_schema(format)[1])
+def cached_schema_view(request, format):
+    content, _ = get_rendered_schema(format)
+    response = HttpResponse(content, content_type=SCHEMA_FORMATS[format])
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+
+def schema_ui_view(renderer):
+    def view(request, *args, **kwargs):
+        if renderer not in _ui_views:
+            from drf_yasg.views import get_schema_view
+
+            schema_view = get_schema_view(
+                api_info,
+                public=True,
+                permission_classes=(permissions.AllowAny,),
+            )
+            _ui_views[renderer] = schema_view.with_ui(renderer, cache_timeout=0)
+        return _ui_views[renderer](request, *args, **kwargs)
+
+    return view
@@ -16,24 +16,16 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, re_path, include
-from rest_framework import permissions
-from drf_yasg.views import get_schema_view
-from drf_yasg import openapi
 
-schema_view = get_schema_view(
-    openapi.Info(
-        title="Library API",
-        default_version='v1',
-        description="Library management API",
-    ),
-    public=True,
-    permission_classes=(permissions.AllowAny,),
-)
+from library.metrics import metrics_view
+
+from .schema import cached_schema_view, schema_ui_view
 
 urlpatterns = [
     path("admin/", admin.site.urls),
     path('', include('library.urls')),
-    re_path(r'^swagger(?P<format>\.json|\.yaml)$', schema_view.without_ui(cache_timeout=0), name='schema-json'),
-    path('swagger/', schema_view.with_ui('swagger', cache_timeout=0), name='schema-swagger-ui'),
-    path('redoc/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
+    path('metrics', metrics_view, name='metrics'),
+    re_path(r'^swagger(?P<format>\.json|\.yaml)$', cached_schema_view, name='schema-json'),
+    path('swagger/', schema_ui_view('swagger'), name='schema-swagger-ui'),
+    path('redoc/', schema_ui_view('redoc'), name='schema-redoc'),
 ]
@@ -10,7 +10,13 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 import os
 
 from django.core.wsgi import get_wsgi_application
+from django.urls import get_resolver
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "libapi.settings")
 
 application = get_wsgi_application()
+
+# Import the URLconf along with the views, serializers and filters it pulls in,
+# so that workers forked by gunicorn --preload are ready to serve right away.
+# This does not open database connections, which must not be shared across forks.
+get_resolver().url_patterns
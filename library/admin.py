@@ -1,21 +1,96 @@
 from django.contrib import admin
-from .models import Book, Reader, Checkout
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+from .models import Book, Reader, Checkout, Hold, Job, SlowQuery
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that takes the row count of unfiltered changelists of large
+    PostgreSQL tables from the planner statistics instead of COUNT(*).
+    """
+    estimate_threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    [queryset.model._meta.db_table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= self.estimate_threshold:
+                return int(row[0])
+        return super().count
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 @admin.register(Book)
-class BookAdmin(admin.ModelAdmin):
-    list_display = ('serial_number', 'title', 'author', 'active_checkout')
-    search_fields = ('serial_number', 'title', 'author')
+class BookAdmin(LargeTableAdmin):
+    list_display = ('serial_number', 'title', 'author', 'is_available', 'current_reader_card_number')
+    list_filter = ('branch',)
+    search_fields = ('=serial_number', '^title', '^author')
+    # Maintained by checkouts and returns
+    readonly_fields = (
+        'active_checkout', 'current_reader', 'current_reader_card_number',
+        'current_reader_name', 'current_checked_out_at'
+    )
+
+    @admin.display(boolean=True, ordering='active_checkout')
+    def is_available(self, obj):
+        return obj.active_checkout_id is None
 
 
 @admin.register(Reader)
-class ReaderAdmin(admin.ModelAdmin):
+class ReaderAdmin(LargeTableAdmin):
     list_display = ('card_number', 'name', 'created_at')
-    search_fields = ('card_number', 'name')
+    list_filter = ('branch',)
+    search_fields = ('=card_number', '^name')
+    date_hierarchy = 'created_at'
 
 
 @admin.register(Checkout)
-class CheckoutAdmin(admin.ModelAdmin):
-    list_display = ('book', 'reader', 'checked_out_at', 'returned_at')
-    list_filter = ('checked_out_at', 'returned_at')
-    search_fields = ('book__title', 'reader__card_number')
+class CheckoutAdmin(LargeTableAdmin):
+    list_display = ('book', 'reader', 'checked_out_at', 'due_at', 'returned_at')
+    list_filter = ('branch', 'returned_at')
+    list_select_related = ('book', 'reader')
+    search_fields = ('=book__serial_number', '=reader__card_number')
+    autocomplete_fields = ('book', 'reader')
+    date_hierarchy = 'checked_out_at'
+
+
+@admin.register(Hold)
+class HoldAdmin(LargeTableAdmin):
+    list_display = ('book', 'reader', 'status', 'created_at', 'ready_at')
+    list_filter = ('status',)
+    list_select_related = ('book', 'reader')
+    search_fields = ('=book__serial_number', '=reader__card_number')
+    autocomplete_fields = ('book', 'reader')
+    date_hierarchy = 'created_at'
+
+
+@admin.register(Job)
+class JobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'branch', 'status', 'progress', 'total', 'attempts', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    readonly_fields = (
+        'status', 'progress', 'total', 'result', 'error', 'attempts', 'worker',
+        'started_at', 'heartbeat_at', 'finished_at'
+    )
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ('fingerprint', 'view', 'duration_ms', 'database', 'created_at')
+    list_filter = ('view', 'database')
+    search_fields = ('=fingerprint',)
+    date_hierarchy = 'created_at'
@@ -0,0 +1,195 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+from .branches import get_branch_databases
+from .events import get_broker
+from .models import Book
+
+
+logger = logging.getLogger(__name__)
+
+SERIAL_SPACE = 10 ** 6
+
+
+class AvailabilityIndex:
+    """
+    Per-process bitmaps of book availability keyed by branch and numeric serial number.
+
+    Each branch has two bitmaps: one marking serials that exist and one marking
+    serials that are currently available. The index is warmed when a gunicorn
+    worker starts (see gunicorn.conf.py), or by the first lookup if it has not
+    been warmed yet. It is updated in place by signal handlers after commit,
+    and by the availability events of the events broker, which relays the
+    checkouts and returns of other worker processes when it is PostgresBroker.
+    Once it is older than AVAILABILITY_INDEX_TTL seconds, lookups keep
+    answering from it while a background thread re-warms it, a backstop for
+    changes no event was published for, such as books created or deleted by
+    other processes.
+
+    Only one thread warms at a time. Updates made while a warm scans the books
+    are recorded and reapplied to its snapshot before it replaces the index.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Held while warming, so that concurrent lookups do not scan the books in parallel
+        self._warm_lock = threading.Lock()
+        self._branches = None
+        self._warmed_at = None
+        self._generation = 0
+        self._pending = None
+        self._refreshing = False
+        self._listening = False
+
+    def warm(self):
+        with self._warm_lock:
+            self._warm()
+
+    def _warm(self):
+        self._listen()
+        while True:
+            with self._lock:
+                generation = self._generation
+                self._pending = []
+            try:
+                branches = self._scan()
+                with self._lock:
+                    # Invalidated during the scan, which may have read the books before the change
+                    if self._generation != generation:
+                        continue
+                    for branch, serial_number, is_available in self._pending:
+                        self._apply(branches, branch, serial_number, is_available)
+                    self._branches = branches
+                    self._warmed_at = time.monotonic()
+                    return
+            finally:
+                with self._lock:
+                    self._pending = None
+
+    def warm_in_background(self):
+        """Starts a warm in a background thread, unless one is already running."""
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._background_warm, name='availability-warm', daemon=True).start()
+
+    def _listen(self):
+        # Subscribed before the first scan, so that no event is missed after it
+        with self._lock:
+            if self._listening:
+                return
+            self._listening = True
+        get_broker().add_listener(self._on_event)
+
+    def _on_event(self, event):
+        if event.get('type') == 'availability':
+            self.update(event['branch'], event['serial_number'], event['is_available'])
+
+    def _background_warm(self):
+        try:
+            self.warm()
+        except Exception:
+            logger.exception('Could not warm the availability index')
+        finally:
+            with self._lock:
+                self._refreshing = False
+            connections.close_all()
+
+    def _scan(self):
+        metrics.AVAILABILITY_INDEX_WARMS.inc()
+        # Serial numbers are only unique within a branch, so each has its own bitmaps
+        branches = {}
+        for database in get_branch_databases():
+            rows = Book.objects.using(database).values_list('branch', 'serial_number', 'active_checkout_id')
+            for branch, serial_number, active_checkout_id in rows.iterator(chunk_size=10000):
+                self._apply(branches, branch, serial_number, active_checkout_id is None)
+        return branches
+
+    def invalidate(self):
+        with self._lock:
+            self._branches = None
+            self._warmed_at = None
+            self._generation += 1
+
+    def is_stale(self):
+        if self._warmed_at is None:
+            return True
+        return time.monotonic() - self._warmed_at > settings.AVAILABILITY_INDEX_TTL
+
+    def lookup(self, branch, serial_numbers):
+        metrics.AVAILABILITY_INDEX_LOOKUPS.inc(len(serial_numbers))
+        if self._branches is None:
+            with self._warm_lock:
+                # Warmed by another thread while this one waited
+                if self._branches is None:
+                    self._warm()
+        elif self.is_stale():
+            self.warm_in_background()
+        with self._lock:
+            known, available = (self._branches or {}).get(branch) or self._new_bitmaps()
+        result = {}
+        for serial_number in serial_numbers:
+            position = self._position(serial_number)
+            if position is None or not self._get(known, position):
+                result[serial_number] = None
+            else:
+                result[serial_number] = self._get(available, position)
+        return result
+
+    def update(self, branch, serial_number, is_available):
+        self._record(branch, serial_number, is_available)
+
+    def remove(self, branch, serial_number):
+        self._record(branch, serial_number, None)
+
+    def _record(self, branch, serial_number, is_available):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((branch, serial_number, is_available))
+            if self._branches is not None:
+                self._apply(self._branches, branch, serial_number, is_available)
+
+    def _apply(self, branches, branch, serial_number, is_available):
+        """Marks a serial as available or not, or as missing when is_available is None."""
+        position = self._position(serial_number)
+        if position is None:
+            return
+        if is_available is None:
+            if branch in branches:
+                known, available = branches[branch]
+                self._set(known, position, False)
+                self._set(available, position, False)
+            return
+        known, available = branches.setdefault(branch, self._new_bitmaps())
+        self._set(known, position, True)
+        self._set(available, position, is_available)
+
+    @staticmethod
+    def _new_bitmaps():
+        return bytearray(SERIAL_SPACE // 8), bytearray(SERIAL_SPACE // 8)
+
+    @staticmethod
+    def _position(serial_number):
+        if not serial_number.isdigit() or len(serial_number) != 6:
+            return None
+        return int(serial_number)
+
+    @staticmethod
+    def _get(bitmap, position):
+        return bool(bitmap[position >> 3] & (1 << (position & 7)))
+
+    @staticmethod
+    def _set(bitmap, position, value):
+        if value:
+            bitmap[position >> 3] |= 1 << (position & 7)
+        else:
+            bitmap[position >> 3] &= ~(1 << (position & 7)) & 0xFF
+
+
+availability_index = AvailabilityIndex()
@@ -0,0 +1,174 @@
+"""
+Batch requests.
+
+POST /batch/ carries a list of API calls, which are dispatched in-process to
+the viewsets as if each had been sent with the headers of the batch request,
+and answered together in the same order.
+
+Consecutive reads (GET) do not depend on each other and run concurrently, up
+to BATCH_MAX_WORKERS at a time: one share runs in the request's thread on its
+database connection, the others on pool threads that close their connections
+when they finish. A write runs alone, after the reads before it and before
+the reads after it, so reads always see the effects of earlier writes. Inside
+a transaction, whose uncommitted rows other connections cannot see, every
+sub-request runs in the request's thread.
+
+Sub-requests do not pass through the middleware: they use the user and
+session of the batch request and its branch, unless they ask for another
+one. Each sub-request is still authenticated, permission-checked and
+throttled by its viewset.
+"""
+
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from io import BytesIO
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connections
+from django.urls import Resolver404, resolve
+from rest_framework import status
+from rest_framework.response import Response
+
+from .branches import get_current_branch, get_request_branch, use_branch
+
+logger = logging.getLogger(__name__)
+
+# Request data of the batch itself, which must not be passed on to every sub-request
+EXCLUDED_META = {'CONTENT_TYPE', 'CONTENT_LENGTH', 'HTTP_IDEMPOTENCY_KEY', 'HTTP_X_PROFILE', 'wsgi.input'}
+RETURNED_HEADERS = ('Location', 'Retry-After', 'Idempotent-Replayed')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=max(settings.BATCH_MAX_WORKERS - 1, 1),
+                thread_name_prefix='batch'
+            )
+        return _executor
+
+
+def run_batch(request, sub_requests):
+    """Dispatches the sub-requests and returns their responses in the same order."""
+    responses = [None] * len(sub_requests)
+    reads = []
+    for index, sub_request in enumerate(sub_requests):
+        if sub_request['method'] == 'GET':
+            reads.append(index)
+            continue
+        for read_index, response in run_reads(request, sub_requests, reads):
+            responses[read_index] = response
+        reads = []
+        responses[index] = dispatch(request, sub_request)
+    for read_index, response in run_reads(request, sub_requests, reads):
+        responses[read_index] = response
+    return responses
+
+
+def run_reads(request, sub_requests, indexes):
+    workers = min(settings.BATCH_MAX_WORKERS, len(indexes))
+    in_transaction = any(connections[alias].in_atomic_block for alias in connections)
+    if workers <= 1 or in_transaction:
+        return run_chunk(request, sub_requests, indexes)
+
+    # Every worker takes every workers-th read; the first one is this thread
+    chunks = [indexes[offset::workers] for offset in range(workers)]
+    futures = [
+        get_executor().submit(copy_context().run, run_pooled_chunk, request, sub_requests, chunk)
+        for chunk in chunks[1:]
+    ]
+    results = run_chunk(request, sub_requests, chunks[0])
+    for future in futures:
+        results.extend(future.result())
+    return results
+
+
+def run_chunk(request, sub_requests, indexes):
+    return [(index, dispatch(request, sub_requests[index])) for index in indexes]
+
+
+def run_pooled_chunk(request, sub_requests, indexes):
+    try:
+        return run_chunk(request, sub_requests, indexes)
+    finally:
+        # Pool threads outlive the request, so they must not keep connections open
+        connections.close_all()
+
+
+def dispatch(request, sub_request):
+    """Runs one sub-request through its view and returns its status, headers and body."""
+    path, _, query_string = sub_request['path'].partition('?')
+    try:
+        match = resolve(path)
+    except Resolver404:
+        return error_response(status.HTTP_404_NOT_FOUND, 'Not found')
+    if not getattr(match.func, 'actions', None):
+        return error_response(status.HTTP_400_BAD_REQUEST, 'Only API resources can be batched')
+    if match.url_name == 'batch-list':
+        return error_response(status.HTTP_400_BAD_REQUEST, 'Batch requests cannot be nested')
+
+    http_request = build_request(request, sub_request, path, query_string)
+    http_request.resolver_match = match
+    branch = get_request_branch(http_request, default=get_current_branch())
+    if branch not in settings.LIBRARY_BRANCHES:
+        return error_response(status.HTTP_400_BAD_REQUEST, f'Unknown branch: {branch}')
+
+    try:
+        with use_branch(branch):
+            response = match.func(http_request, *match.args, **match.kwargs)
+    except Exception:
+        logger.exception('Batch sub-request %s %s failed', sub_request['method'], sub_request['path'])
+        return error_response(status.HTTP_500_INTERNAL_SERVER_ERROR, 'Internal server error')
+
+    try:
+        if isinstance(response, Response):
+            body = response.data
+        elif response.streaming:
+            return error_response(status.HTTP_501_NOT_IMPLEMENTED, 'Streaming responses cannot be batched')
+        elif response.get('Content-Type', '').startswith('application/json'):
+            body = json.loads(response.content)
+        else:
+            body = response.content.decode(response.charset, errors='replace')
+        return {
+            'status': response.status_code,
+            'headers': {name: response[name] for name in RETURNED_HEADERS if name in response},
+            'body': body,
+        }
+    finally:
+        response.close()
+
+
+def build_request(request, sub_request, path, query_string):
+    body = b'' if sub_request.get('body') is None else json.dumps(sub_request['body']).encode()
+    environ = {key: value for key, value in request.META.items() if key not in EXCLUDED_META}
+    environ.setdefault('wsgi.url_scheme', request.scheme)
+    environ.update({
+        'REQUEST_METHOD': sub_request['method'],
+        'PATH_INFO': path,
+        'QUERY_STRING': query_string,
+        'CONTENT_TYPE': 'application/json',
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.input': BytesIO(body),
+    })
+    for name, value in sub_request['headers'].items():
+        environ[f"HTTP_{name.upper().replace('-', '_')}"] = value
+
+    http_request = WSGIRequest(environ)
+    # What the session and authentication middleware would have set
+    http_request.user = request._request.user
+    if hasattr(request._request, 'session'):
+        http_request.session = request._request.session
+    http_request._dont_enforce_csrf_checks = getattr(request._request, '_dont_enforce_csrf_checks', False)
+    return http_request
+
+
+def error_response(status_code, message):
+    return {'status': status_code, 'headers': {}, 'body': {'error': message}}
@@ -0,0 +1,121 @@
+"""
+Library branches.
+
+Books, readers, checkouts and the rows hanging off them (holds, related books,
+the change log) belong to a branch. BranchMiddleware takes the branch of every request from
+the X-Branch header or the branch query parameter, and the branch-scoped
+viewsets only see that branch's rows. BRANCH_DATABASES can place a branch on
+its own database alias: BranchRouter sends queries on branch data made during
+the request to the database of the current branch. Serial and card numbers
+are unique within a branch only, so the change feed and the availability
+index are kept per branch.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+BRANCH_HEADER = 'X-Branch'
+BRANCH_PARAM = 'branch'
+
+# Models whose rows live in the database of their branch
+BRANCH_MODELS = {
+    'library.book', 'library.reader', 'library.checkout', 'library.hold', 'library.bookrelation',
+    'library.change'
+}
+
+_current_branch = ContextVar('current_branch', default=None)
+
+
+def get_current_branch():
+    return _current_branch.get() or settings.DEFAULT_BRANCH
+
+
+@contextmanager
+def use_branch(branch):
+    """Routes branch data queries made inside the block to the branch's database."""
+    token = _current_branch.set(branch)
+    try:
+        yield
+    finally:
+        _current_branch.reset(token)
+
+
+def get_request_branch(request, default=None):
+    """Branch requested by the X-Branch header or the branch parameter, else default."""
+    return (
+        request.headers.get(BRANCH_HEADER)
+        or request.GET.get(BRANCH_PARAM)
+        or default
+        or settings.DEFAULT_BRANCH
+    )
+
+
+def iter_branches(branch=None):
+    """
+    Yields the given branch, or every branch in LIBRARY_BRANCHES, with branch data
+    queries made during each step routed to its database. Used by commands, which
+    run outside a request and would otherwise only see the default branch.
+    """
+    for current in [branch] if branch else settings.LIBRARY_BRANCHES:
+        with use_branch(current):
+            yield current
+
+
+def get_branch_database(branch):
+    return settings.BRANCH_DATABASES.get(branch, DEFAULT_DB_ALIAS)
+
+
+def get_branch_databases():
+    """Database aliases holding branch data, the default database first."""
+    return list(dict.fromkeys([DEFAULT_DB_ALIAS, *settings.BRANCH_DATABASES.values()]))
+
+
+class BranchRouter:
+    """
+    Routes branch data to the database of the current branch. Rows that were
+    loaded from or are related to an object of a known database stay there.
+    """
+
+    def db_for_read(self, model, **hints):
+        return self._database(model, hints)
+
+    def db_for_write(self, model, **hints):
+        return self._database(model, hints)
+
+    def _database(self, model, hints):
+        if model._meta.label_lower not in BRANCH_MODELS:
+            return None
+        instance = hints.get('instance')
+        if instance is not None and instance._state.db:
+            return instance._state.db
+        return get_branch_database(getattr(instance, 'branch', None) or get_current_branch())
+
+
+class BranchScopedMixin:
+    """Limits the viewset's queryset to the branch of the request."""
+    branch_lookup = 'branch'
+
+    @property
+    def branch(self):
+        return get_current_branch()
+
+    @property
+    def branch_db(self):
+        return get_branch_database(self.branch)
+
+    def get_queryset(self):
+        return super().get_queryset().filter(**{self.branch_lookup: self.branch})
+
+
+class CurrentBranchDefault:
+    """Serializer field default set to the branch of the request."""
+    requires_context = True
+
+    def __call__(self, serializer_field):
+        return get_current_branch()
+
+    def __repr__(self):
+        return f'{self.__class__.__name__}()'
@@ -0,0 +1,185 @@
+"""
+Publish/subscribe of book availability events for the server-sent events stream.
+
+Events are published after the transaction that produced them commits, from any
+thread, and delivered to asyncio subscribers on their own event loop, and to
+listeners, such as the availability index, on the delivering thread. The
+broker is selected with the EVENTS_BROKER setting: InMemoryBroker delivers
+events within one process, PostgresBroker relays them through LISTEN/NOTIFY so
+subscribers connected to any worker receive them.
+"""
+
+import asyncio
+import json
+import logging
+import select
+import threading
+import time
+from collections import defaultdict
+from contextlib import closing
+
+from django.conf import settings
+from django.db import connection
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    def __init__(self, loop, max_pending):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_pending)
+
+    async def get(self):
+        return await self.queue.get()
+
+    def deliver(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # A subscriber that stopped reading must not hold the others back
+            logger.warning('Dropping event for a slow subscriber')
+
+
+class InMemoryBroker:
+    def __init__(self, max_pending=100):
+        self.max_pending = max_pending
+        self._lock = threading.Lock()
+        self._subscriptions = defaultdict(set)
+        self._listeners = []
+
+    def subscribe(self):
+        subscription = Subscription(asyncio.get_running_loop(), self.max_pending)
+        with self._lock:
+            self._subscriptions[subscription.loop].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.loop)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.loop]
+
+    def add_listener(self, callback):
+        """Calls callback(event) for every event, on the thread that delivers it."""
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def publish(self, event):
+        self.deliver(event)
+
+    def deliver(self, event):
+        with self._lock:
+            by_loop = {loop: list(subscriptions) for loop, subscriptions in self._subscriptions.items()}
+            listeners = list(self._listeners)
+        for listener in listeners:
+            try:
+                listener(event)
+            except Exception:
+                logger.exception('Event listener failed')
+        # One wake-up per event loop, which then fans out to its subscribers
+        for loop, subscriptions in by_loop.items():
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self._fan_out, subscriptions, event)
+
+    @staticmethod
+    def _fan_out(subscriptions, event):
+        for subscription in subscriptions:
+            subscription.deliver(event)
+
+
+class PostgresBroker(InMemoryBroker):
+    channel = 'library_events'
+
+    def __init__(self, max_pending=100):
+        super().__init__(max_pending)
+        self._listener = None
+
+    def subscribe(self):
+        self._ensure_listener()
+        return super().subscribe()
+
+    def add_listener(self, callback):
+        self._ensure_listener()
+        super().add_listener(callback)
+
+    def publish(self, event):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel, json.dumps(event)])
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(target=self._listen, daemon=True)
+                self._listener.start()
+
+    def _listen(self):
+        # Reconnects after any failure, backing off up to a minute, so losing the
+        # database connection does not silently end the delivery of events
+        delay = 1
+        while True:
+            try:
+                with closing(self._connect()) as listen_connection:
+                    delay = 1
+                    self._relay(listen_connection)
+            except Exception:
+                logger.exception('Event listener failed, reconnecting in %d seconds', delay)
+            time.sleep(delay)
+            delay = min(delay * 2, 60)
+
+    def _connect(self):
+        import psycopg2
+
+        db = settings.DATABASES['default']
+        listen_connection = psycopg2.connect(
+            dbname=db['NAME'],
+            user=db['USER'],
+            password=db['PASSWORD'],
+            host=db['HOST'],
+            port=db['PORT'] or None,
+        )
+        listen_connection.autocommit = True
+        with listen_connection.cursor() as cursor:
+            cursor.execute(f'LISTEN {self.channel}')
+        return listen_connection
+
+    def _relay(self, listen_connection):
+        while True:
+            if select.select([listen_connection], [], [], 60) == ([], [], []):
+                continue
+            listen_connection.poll()
+            while listen_connection.notifies:
+                notification = listen_connection.notifies.pop(0)
+                self.deliver(json.loads(notification.payload))
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            _broker = import_string(settings.EVENTS_BROKER)()
+        return _broker
+
+
+def publish_availability(branch, serial_number, is_available):
+    get_broker().publish({
+        'type': 'availability',
+        'branch': branch,
+        'serial_number': serial_number,
+        'is_available': is_available,
+    })
@@ -0,0 +1,120 @@
+"""
+Bulk factories for test datasets.
+
+Rows are inserted with bulk_create in batches, so datasets of hundreds of
+thousands of rows take seconds instead of minutes. Serial and card numbers are
+sequential six digit numbers, and titles, authors and names cycle through fixed
+word lists so that filters match a predictable share of the rows. Signals are
+not sent for bulk inserts, so the availability index is invalidated instead.
+"""
+
+from collections import namedtuple
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from .availability import availability_index
+from .models import Book, Reader, Checkout
+
+BATCH_SIZE = 5000
+
+TOPICS = ['History', 'Science', 'Poetry', 'Travel', 'Cooking', 'Music', 'Art', 'Nature', 'Biography', 'Mystery']
+
+Library = namedtuple('Library', ['books', 'readers', 'checkouts'])
+
+
+def create_books(count, start=100000, branch='main'):
+    """Creates books with serial numbers start, start + 1, ...; the title topic cycles every 10 books."""
+    books = Book.objects.bulk_create(
+        (
+            Book(
+                branch=branch,
+                serial_number=f'{start + i:06d}',
+                title=f'{TOPICS[i % len(TOPICS)]} volume {i}',
+                author=f'Author {i % 1000}'
+            )
+            for i in range(count)
+        ),
+        batch_size=BATCH_SIZE
+    )
+    availability_index.invalidate()
+    return books
+
+
+def create_readers(count, start=100000, branch='main'):
+    return Reader.objects.bulk_create(
+        (Reader(branch=branch, card_number=f'{start + i:06d}', name=f'Reader {i}') for i in range(count)),
+        batch_size=BATCH_SIZE
+    )
+
+
+def create_loans(books, readers, active=True, checked_out_at=None):
+    """
+    Creates one loan of every book, spread over the readers round-robin.
+
+    Active loans become the books' active checkouts; otherwise the loans are
+    returned a week after they started.
+    """
+    checked_out_at = checked_out_at or timezone.now() - timedelta(days=7)
+    due_at = checked_out_at + timedelta(days=settings.LOAN_PERIOD_DAYS)
+    returned_at = None if active else checked_out_at + timedelta(days=7)
+    checkouts = Checkout.objects.bulk_create(
+        (
+            Checkout(
+                branch=book.branch,
+                book=book,
+                reader=readers[i % len(readers)],
+                due_at=due_at,
+                returned_at=returned_at
+            )
+            for i, book in enumerate(books)
+        ),
+        batch_size=BATCH_SIZE
+    )
+    # auto_now_add overrides checked_out_at on insert, so it is set afterwards
+    update_in_batches(Checkout.objects.all(), checkouts, checked_out_at=checked_out_at)
+    for checkout in checkouts:
+        checkout.checked_out_at = checked_out_at
+
+    if active:
+        update_in_batches(
+            Book.objects.all(),
+            books,
+            active_checkout=Subquery(
+                Checkout.objects.filter(
+                    book=OuterRef('pk'), returned_at__isnull=True
+                ).order_by('-id').values('id')[:1]
+            )
+        )
+        book_ids = [book.id for book in books]
+        for offset in range(0, len(book_ids), BATCH_SIZE):
+            Book.refresh_current_reader(Book.objects.filter(id__in=book_ids[offset:offset + BATCH_SIZE]))
+        for book, checkout in zip(books, checkouts):
+            book.set_active_checkout(checkout)
+        availability_index.invalidate()
+    return checkouts
+
+
+def update_in_batches(queryset, objects, **values):
+    ids = [obj.id for obj in objects]
+    for offset in range(0, len(ids), BATCH_SIZE):
+        queryset.filter(id__in=ids[offset:offset + BATCH_SIZE]).update(**values)
+
+
+def create_library(books=0, readers=0, active_loans=0, returned_loans=0, start=100000):
+    """
+    Creates a dataset of books and readers. The first active_loans books are
+    checked out and the following returned_loans books have a returned loan.
+    """
+    created_books = create_books(books, start)
+    created_readers = create_readers(readers, start)
+    checkouts = []
+    if active_loans:
+        checkouts += create_loans(created_books[:active_loans], created_readers)
+    if returned_loans:
+        checkouts += create_loans(
+            created_books[active_loans:active_loans + returned_loans], created_readers, active=False
+        )
+    return Library(created_books, created_readers, checkouts)
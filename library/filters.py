@@ -1,16 +1,133 @@
+import copy
+import threading
+from collections import OrderedDict
+
 import django_filters
-from .models import Book, Reader, Checkout
+from django.conf import settings
+from django.http import QueryDict
+from django.utils import timezone
+from .models import Book, Reader, Checkout, Hold
+
+
+class CachedFilterSet(django_filters.FilterSet):
+    """
+    FilterSet that avoids rebuilding and re-validating its form for repeated queries.
+
+    The form class is built once per FilterSet class, filters are copied
+    shallowly instead of deeply, and the cleaned values of valid filter
+    parameters are kept in a process-wide LRU keyed by the normalized
+    parameters, so a repeated query is filtered without a form.
+    """
+    cache_enabled = True
+
+    _form_classes = {}
+    _cleaned_data = OrderedDict()
+    _lock = threading.Lock()
+
+    def __init__(self, data=None, queryset=None, *, request=None, prefix=None):
+        if not self.cache_enabled:
+            super().__init__(data, queryset, request=request, prefix=prefix)
+            return
+
+        if queryset is None:
+            queryset = self._meta.model._default_manager.all()
+
+        self.is_bound = data is not None
+        self.data = data or QueryDict()
+        self.queryset = queryset
+        self.request = request
+        self.form_prefix = prefix
+
+        # Filters are not mutated per request, only bound to this filterset
+        self.filters = OrderedDict(
+            (name, copy.copy(filter_)) for name, filter_ in self.base_filters.items()
+        )
+        for filter_ in self.filters.values():
+            filter_.model = queryset.model
+            filter_.parent = self
+            if filter_.method is not None:
+                # Re-binds the method wrapper, which points at the filter it was created for
+                filter_.method = filter_.method
+
+    @classmethod
+    def clear_cache(cls):
+        with cls._lock:
+            cls._form_classes.clear()
+            cls._cleaned_data.clear()
+
+    def get_form_class(self):
+        if not self.cache_enabled:
+            return super().get_form_class()
+        form_class = self._form_classes.get(type(self))
+        if form_class is None:
+            form_class = super().get_form_class()
+            self._form_classes[type(self)] = form_class
+        return form_class
+
+    def is_valid(self):
+        if self.is_bound and self.get_cached_cleaned_data() is not None:
+            return True
+        return super().is_valid()
+
+    @property
+    def errors(self):
+        if self.get_cached_cleaned_data() is not None:
+            return {}
+        return super().errors
+
+    def filter_queryset(self, queryset):
+        cleaned_data = self.get_cached_cleaned_data()
+        if cleaned_data is None:
+            cleaned_data = self.form.cleaned_data
+            if self.cache_enabled and not self.form.errors:
+                self.store_cleaned_data(cleaned_data)
+
+        for name, value in cleaned_data.items():
+            queryset = self.filters[name].filter(queryset, value)
+        return queryset
 
+    def get_cache_key(self):
+        if not hasattr(self, '_cache_key'):
+            params = []
+            for key in sorted(self.data):
+                if any(key == name or key.startswith(name + '_') for name in self.filters):
+                    values = self.data.getlist(key) if hasattr(self.data, 'getlist') else [self.data[key]]
+                    params.append((key, tuple(values)))
+            self._cache_key = (type(self), tuple(params))
+        return self._cache_key
 
-class BookFilter(django_filters.FilterSet):
+    def get_cached_cleaned_data(self):
+        if not self.cache_enabled:
+            return None
+        key = self.get_cache_key()
+        with self._lock:
+            cleaned_data = self._cleaned_data.get(key)
+            if cleaned_data is not None:
+                self._cleaned_data.move_to_end(key)
+        return cleaned_data
+
+    def store_cleaned_data(self, cleaned_data):
+        key = self.get_cache_key()
+        with self._lock:
+            self._cleaned_data[key] = dict(cleaned_data)
+            while len(self._cleaned_data) > settings.FILTER_CACHE_SIZE:
+                self._cleaned_data.popitem(last=False)
+
+
+class CharInFilter(django_filters.BaseInFilter, django_filters.CharFilter):
+    pass
+
+
+class BookFilter(CachedFilterSet):
+    serial_number__in = CharInFilter(field_name='serial_number', lookup_expr='in')
     title = django_filters.CharFilter(lookup_expr='icontains')
     author = django_filters.CharFilter(lookup_expr='icontains')
     is_available = django_filters.BooleanFilter(method='filter_is_available')
-    current_reader = django_filters.NumberFilter(field_name='active_checkout__reader__id')
+    current_reader = django_filters.NumberFilter(field_name='current_reader')
 
     class Meta:
         model = Book
-        fields = ['title', 'author', 'is_available', 'current_reader']
+        fields = ['serial_number__in', 'title', 'author', 'is_available', 'current_reader']
 
     def filter_is_available(self, queryset, name, value):
         if value is True:
@@ -20,26 +137,46 @@ class BookFilter(django_filters.FilterSet):
         return queryset
 
 
-class ReaderFilter(django_filters.FilterSet):
+class ReaderFilter(CachedFilterSet):
+    card_number__in = CharInFilter(field_name='card_number', lookup_expr='in')
     name = django_filters.CharFilter(lookup_expr='icontains')
 
     class Meta:
         model = Reader
-        fields = ['name']
+        fields = ['card_number__in', 'name']
 
 
-class CheckoutFilter(django_filters.FilterSet):
+class CheckoutFilter(CachedFilterSet):
     book = django_filters.CharFilter(field_name='book__serial_number')
     reader = django_filters.CharFilter(field_name='reader__card_number')
     is_active = django_filters.BooleanFilter(method='filter_is_active')
+    overdue = django_filters.BooleanFilter(method='filter_overdue')
 
     class Meta:
         model = Checkout
-        fields = ['book', 'reader', 'is_active']
+        fields = ['book', 'reader', 'is_active', 'overdue']
 
     def filter_is_active(self, queryset, name, value):
         if value is True:
             return queryset.filter(returned_at__isnull=True)
         elif value is False:
             return queryset.filter(returned_at__isnull=False)
-        return queryset
\ No newline at end of file
+        return queryset
+
+    def filter_overdue(self, queryset, name, value):
+        overdue = {'returned_at__isnull': True, 'due_at__lt': timezone.now()}
+        if value is True:
+            return queryset.filter(**overdue)
+        elif value is False:
+            return queryset.exclude(**overdue)
+        return queryset
+
+
+class HoldFilter(CachedFilterSet):
+    book = django_filters.CharFilter(field_name='book__serial_number')
+    reader = django_filters.CharFilter(field_name='reader__card_number')
+    status = django_filters.ChoiceFilter(choices=Hold.STATUS_CHOICES)
+
+    class Meta:
+        model = Hold
+        fields = ['book', 'reader', 'status']
@@ -0,0 +1,164 @@
+"""
+Idempotency-Key support for write actions.
+
+Keys are scoped to the client that sent them: the authenticated user, or the
+client address of anonymous requests. The first request with a given key
+claims it by inserting an in-flight row, runs the view and stores its
+response. Retries with the same key replay the stored response without running
+the view again; retries arriving while the first request is still running
+wait for its result. The claim is a lease of IDEMPOTENCY_CLAIM_LEASE seconds:
+a retry arriving after it ran out takes the key over, since the request
+holding it can no longer be running.
+"""
+
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+
+from .branches import get_current_branch
+from .models import IdempotencyKey
+
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+POLL_INTERVAL = 0.05
+
+
+def idempotent(view_method):
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if not key:
+            return view_method(self, request, *args, **kwargs)
+
+        if len(key) > IdempotencyKey._meta.get_field('key').max_length:
+            return Response(
+                {'error': 'Idempotency key is too long'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        client = get_client(request)
+        fingerprint = get_fingerprint(request)
+        while True:
+            record, created = claim_key(client, key, fingerprint)
+            if created:
+                return run_and_store(record, view_method, self, request, *args, **kwargs)
+
+            if record.fingerprint != fingerprint:
+                return Response(
+                    {'error': 'Idempotency key was already used for a different request'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+
+            record = wait_for_response(record)
+            if record is None or (record.status_code is None and is_lease_expired(record)):
+                # The first request failed and released the key or stopped without
+                # answering, so this one takes over
+                continue
+            if record.status_code is None:
+                return Response(
+                    {'error': 'A request with this idempotency key is still in progress'},
+                    status=status.HTTP_409_CONFLICT
+                )
+
+            response = Response(record.response_body, status=record.status_code)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+    return wrapper
+
+
+def get_client(request):
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f'address:{BaseThrottle().get_ident(request)}'[:100]
+
+
+def get_fingerprint(request):
+    # The parsed data rather than the raw body, which may already have been read and
+    # differs between encodings of the same form, e.g. by its multipart boundary
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.path.encode())
+    digest.update(get_current_branch().encode())
+    digest.update(json.dumps(data, sort_keys=True, separators=(',', ':'), default=str).encode())
+    return digest.hexdigest()
+
+
+def is_lease_expired(record, now=None):
+    now = now or timezone.now()
+    return record.claimed_at <= now - timedelta(seconds=settings.IDEMPOTENCY_CLAIM_LEASE)
+
+
+def claim_key(client, key, fingerprint):
+    now = timezone.now()
+    record = IdempotencyKey.objects.filter(client=client, key=key).first()
+    if record is not None:
+        if record.expires_at <= now:
+            IdempotencyKey.objects.filter(pk=record.pk, expires_at__lte=now).delete()
+        elif (record.status_code is None and record.fingerprint == fingerprint
+                and is_lease_expired(record, now)):
+            # Only one retry wins the update, the others see the new lease
+            taken_over = IdempotencyKey.objects.filter(
+                pk=record.pk, status_code__isnull=True, claimed_at=record.claimed_at
+            ).update(claimed_at=now)
+            if taken_over:
+                record.claimed_at = now
+                return record, True
+            return claim_key(client, key, fingerprint)
+        else:
+            return record, False
+
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(
+                client=client,
+                key=key,
+                fingerprint=fingerprint,
+                claimed_at=now,
+                expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+            )
+        return record, True
+    except IntegrityError:
+        # Another request claimed the key in the meantime
+        return claim_key(client, key, fingerprint)
+
+
+def run_and_store(record, view_method, *args, **kwargs):
+    # Writes are limited to the lease this request holds, which a retry may have taken over
+    claim = IdempotencyKey.objects.filter(pk=record.pk, claimed_at=record.claimed_at, status_code__isnull=True)
+    try:
+        response = view_method(*args, **kwargs)
+    except Exception:
+        claim.delete()
+        raise
+
+    if response.status_code >= 500:
+        # Server errors are not final, let the client retry them
+        claim.delete()
+    else:
+        claim.update(status_code=response.status_code, response_body=response.data)
+    return response
+
+
+def wait_for_response(record):
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+    while record.status_code is None and time.monotonic() < deadline:
+        time.sleep(POLL_INTERVAL)
+        try:
+            record.refresh_from_db()
+        except IdempotencyKey.DoesNotExist:
+            return None
+    return record
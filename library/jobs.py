@@ -0,0 +1,454 @@
+"""
+Background jobs.
+
+Heavy operations are queued as Job rows and run by the run_jobs worker in a
+pool of processes, off the request workers. Handlers are registered with
+@register under a job kind; they receive the job, whose params were validated
+by the kind's params serializer when it was queued, and a progress callback.
+Their return value is stored as the job's result.
+
+Workers claim queued jobs in FIFO order with SELECT ... FOR UPDATE SKIP
+LOCKED, so any number of workers can share the queue. The concurrency of a
+kind limits how many of its jobs run at once across all workers. Running jobs
+are kept alive by heartbeats, sent by a thread of their worker while they run
+and with every progress report; jobs of a worker that stopped sending them are
+requeued, up to JOBS_MAX_ATTEMPTS attempts.
+"""
+
+import csv
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+import traceback
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.db import DatabaseError, close_old_connections, connection, connections, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from rest_framework import serializers
+
+from .branches import use_branch
+from .models import Book, Job
+from .overdue import expire_ready_holds, overdue_checkouts, sweep_overdue
+from .recommendations import build_relations, record_checkout
+from .slow_queries import capture_plan
+
+logger = logging.getLogger(__name__)
+
+JobHandler = namedtuple('JobHandler', ['function', 'params_serializer', 'concurrency', 'public'])
+
+HANDLERS = {}
+
+# Key of the PostgreSQL advisory lock serializing claims, so that two workers
+# cannot both start the last allowed job of a kind
+CLAIM_LOCK_KEY = 0x6a6f6273
+
+
+def register(kind, params_serializer=serializers.Serializer, concurrency=None, public=True):
+    """
+    Registers the decorated function as the handler of a job kind. Only public
+    kinds can be queued through the API; the others are queued by the code and
+    their jobs are deleted once they succeed.
+    """
+    def decorator(function):
+        HANDLERS[kind] = JobHandler(function, params_serializer, concurrency, public)
+        return function
+    return decorator
+
+
+def get_public_kinds():
+    return sorted(kind for kind, handler in HANDLERS.items() if handler.public)
+
+
+def enqueue(kind, params=None, branch=None):
+    """Validates the params of a job and queues it; raises ValidationError on invalid params."""
+    serializer = HANDLERS[kind].params_serializer(data=params or {})
+    serializer.is_valid(raise_exception=True)
+    return Job.objects.create(
+        kind=kind,
+        params=serializer.validated_data,
+        branch=branch or settings.DEFAULT_BRANCH
+    )
+
+
+class ProgressReporter:
+    """Progress callback of a running job; writes at most every JOBS_PROGRESS_INTERVAL seconds."""
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.last_write = None
+
+    def __call__(self, done, total=None):
+        now = time.monotonic()
+        if (total is None and self.last_write is not None
+                and now - self.last_write < settings.JOBS_PROGRESS_INTERVAL):
+            return
+        self.last_write = now
+        fields = {'progress': done, 'heartbeat_at': timezone.now()}
+        if total is not None:
+            fields['total'] = total
+        Job.objects.filter(id=self.job_id).update(**fields)
+
+
+def export_path(job):
+    return Path(settings.JOBS_OUTPUT_DIR) / f'job-{job.id}.csv'
+
+
+class SweepOverdueParamsSerializer(serializers.Serializer):
+    batch_size = serializers.IntegerField(min_value=1, max_value=10000, default=1000)
+
+
+@register('sweep_overdue', SweepOverdueParamsSerializer, concurrency=1)
+def run_sweep_overdue(job, progress):
+    progress(0, overdue_checkouts().filter(overdue_notified_at__isnull=True).count())
+    processed = sweep_overdue(batch_size=job.params['batch_size'], progress=progress)
+    return {'processed': processed, 'expired_holds': expire_ready_holds()}
+
+
+class BuildRecommendationsParamsSerializer(serializers.Serializer):
+    top_k = serializers.IntegerField(min_value=1, max_value=100, required=False)
+    chunk_size = serializers.IntegerField(min_value=100, max_value=100000, default=10000)
+
+
+@register('build_recommendations', BuildRecommendationsParamsSerializer, concurrency=1)
+def run_build_recommendations(job, progress):
+    stored = build_relations(top_k=job.params.get('top_k'), chunk_size=job.params['chunk_size'], progress=progress)
+    return {'stored': stored}
+
+
+class RecordCheckoutParamsSerializer(serializers.Serializer):
+    checkout_id = serializers.IntegerField()
+
+
+@register('record_checkout', RecordCheckoutParamsSerializer, public=False)
+def run_record_checkout(job, progress):
+    progress(0, 1)
+    record_checkout(job.params['checkout_id'])
+    return {}
+
+
+class ExplainSlowQueryParamsSerializer(serializers.Serializer):
+    slow_query_id = serializers.IntegerField()
+
+
+@register('explain_slow_query', ExplainSlowQueryParamsSerializer, concurrency=1, public=False)
+def run_explain_slow_query(job, progress):
+    progress(0, 1)
+    capture_plan(job.params['slow_query_id'])
+    return {}
+
+
+class RefreshCurrentReaderParamsSerializer(serializers.Serializer):
+    batch_size = serializers.IntegerField(min_value=1, max_value=10000, default=1000)
+
+
+@register('refresh_current_reader', RefreshCurrentReaderParamsSerializer, concurrency=1)
+def run_refresh_current_reader(job, progress):
+    books = Book.objects.filter(branch=job.branch)
+    total = books.count()
+    progress(0, total)
+    refreshed = 0
+    last_id = 0
+    while True:
+        ids = list(
+            books.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:job.params['batch_size']]
+        )
+        if not ids:
+            break
+        Book.refresh_current_reader(Book.objects.filter(id__in=ids))
+        refreshed += len(ids)
+        last_id = ids[-1]
+        progress(refreshed)
+    return {'books': refreshed}
+
+
+class FakeDataParamsSerializer(serializers.Serializer):
+    readers = serializers.IntegerField(min_value=0, max_value=100000, default=10)
+    books = serializers.IntegerField(min_value=0, max_value=100000, default=20)
+    checkouts = serializers.IntegerField(min_value=0, max_value=100000, default=15)
+
+
+@register('add_fake_data', FakeDataParamsSerializer, concurrency=1)
+def run_add_fake_data(job, progress):
+    call_command('add_fake_data', stdout=StringIO(), progress=progress, **job.params)
+    return dict(job.params)
+
+
+class ExportBooksParamsSerializer(serializers.Serializer):
+    is_available = serializers.BooleanField(allow_null=True, default=None)
+
+
+@register('export_books', ExportBooksParamsSerializer, concurrency=2)
+def run_export_books(job, progress):
+    books = Book.objects.filter(branch=job.branch).order_by('id')
+    if job.params.get('is_available') is not None:
+        books = books.filter(active_checkout__isnull=job.params['is_available'])
+    progress(0, books.count())
+
+    path = export_path(job)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    rows = 0
+    with open(path, 'w', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow(['serial_number', 'title', 'author', 'is_available', 'current_reader_card_number'])
+        for serial_number, title, author, active_checkout_id, card_number in books.values_list(
+            'serial_number', 'title', 'author', 'active_checkout_id', 'current_reader_card_number'
+        ).iterator(chunk_size=2000):
+            writer.writerow([serial_number, title, author, active_checkout_id is None, card_number])
+            rows += 1
+            if rows % 2000 == 0:
+                progress(rows)
+    return {'rows': rows}
+
+
+def claim_jobs(limit, worker):
+    """Marks up to limit queued jobs as running on the worker and returns their ids."""
+    if limit <= 0:
+        return []
+
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT pg_advisory_xact_lock(%s)', [CLAIM_LOCK_KEY])
+
+        running = dict(
+            Job.objects.filter(status=Job.RUNNING).values_list('kind').annotate(count=Count('id'))
+        )
+        # Jobs of kinds at their concurrency limit are skipped, so look further down the queue
+        candidates = (
+            Job.objects.select_for_update(skip_locked=True)
+            .filter(status=Job.QUEUED)
+            .order_by('created_at', 'id')
+            .values_list('id', 'kind')[:limit * 10]
+        )
+        claimed = []
+        for job_id, kind in candidates:
+            handler = HANDLERS.get(kind)
+            if handler is not None and handler.concurrency is not None \
+                    and running.get(kind, 0) >= handler.concurrency:
+                continue
+            claimed.append(job_id)
+            running[kind] = running.get(kind, 0) + 1
+            if len(claimed) == limit:
+                break
+
+        now = timezone.now()
+        Job.objects.filter(id__in=claimed).update(
+            status=Job.RUNNING,
+            worker=worker,
+            attempts=F('attempts') + 1,
+            started_at=now,
+            heartbeat_at=now
+        )
+    return claimed
+
+
+def execute_job(job_id):
+    """Runs a claimed job and records its outcome; returns whether it succeeded."""
+    close_old_connections()
+    try:
+        job = Job.objects.get(id=job_id)
+        try:
+            handler = HANDLERS.get(job.kind)
+            if handler is None:
+                raise LookupError(f'Unknown job kind: {job.kind}')
+            with use_branch(job.branch):
+                result = handler.function(job, ProgressReporter(job.id))
+        except Exception:
+            logger.exception('Job %s (%s) failed', job.id, job.kind)
+            fail_job(job.id, traceback.format_exc())
+            return False
+
+        if not handler.public:
+            Job.objects.filter(id=job.id, status=Job.RUNNING).delete()
+            return True
+        Job.objects.filter(id=job.id, status=Job.RUNNING).update(
+            status=Job.SUCCEEDED,
+            result=result,
+            progress=Coalesce(F('total'), F('progress')),
+            finished_at=timezone.now()
+        )
+        return True
+    finally:
+        close_old_connections()
+
+
+def fail_job(job_id, error):
+    Job.objects.filter(id=job_id, status=Job.RUNNING).update(
+        status=Job.FAILED,
+        error=error,
+        finished_at=timezone.now()
+    )
+
+
+def heartbeat(job_ids):
+    Job.objects.filter(id__in=job_ids, status=Job.RUNNING).update(heartbeat_at=timezone.now())
+
+
+def requeue_stale_jobs(now=None):
+    """Requeues running jobs whose worker stopped sending heartbeats; returns their number."""
+    now = now or timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        heartbeat_at__lt=now - timedelta(seconds=settings.JOBS_STALE_AFTER)
+    )
+    stale.filter(attempts__gte=settings.JOBS_MAX_ATTEMPTS).update(
+        status=Job.FAILED,
+        error='Worker stopped responding',
+        finished_at=now
+    )
+    return stale.update(status=Job.QUEUED, worker='', started_at=None, heartbeat_at=None)
+
+
+class HeartbeatThread(threading.Thread):
+    """Sends heartbeats for the jobs a worker is running every JOBS_HEARTBEAT_INTERVAL seconds."""
+
+    def __init__(self):
+        super().__init__(name='job-heartbeat', daemon=True)
+        self.job_ids = set()
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def add(self, job_id):
+        with self.lock:
+            self.job_ids.add(job_id)
+
+    def discard(self, job_id):
+        with self.lock:
+            self.job_ids.discard(job_id)
+
+    def run(self):
+        try:
+            while not self.stopped.wait(settings.JOBS_HEARTBEAT_INTERVAL):
+                with self.lock:
+                    job_ids = list(self.job_ids)
+                if not job_ids:
+                    continue
+                try:
+                    heartbeat(job_ids)
+                except DatabaseError:
+                    logger.exception('Could not send job heartbeats')
+                    close_old_connections()
+        finally:
+            connections.close_all()
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+class Worker:
+    """
+    Claims queued jobs and runs them in a pool of processes, or one at a time
+    in the current process when processes is 0.
+    """
+
+    def __init__(self, processes=None, poll_interval=None):
+        self.processes = settings.JOBS_WORKER_PROCESSES if processes is None else processes
+        self.poll_interval = settings.JOBS_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.name = f'{socket.gethostname()}:{os.getpid()}'
+        self.stopping = False
+        self.executor = None
+
+    def stop(self):
+        """Stops claiming jobs; the running ones are finished first."""
+        self.stopping = True
+
+    def run(self, once=False):
+        """Processes jobs until stopped, or until the queue is empty when once is set."""
+        if self.processes == 0:
+            self.run_inline(once)
+            return
+
+        in_flight = {}
+        last_requeue = 0
+        heartbeats = HeartbeatThread()
+        heartbeats.start()
+        self.executor = self.start_executor()
+        try:
+            while in_flight or not self.stopping:
+                if time.monotonic() - last_requeue >= settings.JOBS_HEARTBEAT_INTERVAL:
+                    requeue_stale_jobs()
+                    last_requeue = time.monotonic()
+
+                if not self.stopping:
+                    for job_id in claim_jobs(self.processes - len(in_flight), self.name):
+                        in_flight[self.executor.submit(execute_job, job_id)] = job_id
+                        heartbeats.add(job_id)
+
+                if not in_flight:
+                    if once:
+                        break
+                    time.sleep(self.poll_interval)
+                    continue
+
+                done, _ = wait(in_flight, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    job_id = in_flight.pop(future)
+                    heartbeats.discard(job_id)
+                    try:
+                        future.result()
+                    except Exception:
+                        # A process of the pool died, which fails every job running in it
+                        logger.exception('Worker process running job %s failed', job_id)
+                        fail_job(job_id, traceback.format_exc())
+                        broken = True
+                if broken and not in_flight:
+                    self.executor.shutdown()
+                    self.executor = self.start_executor()
+        finally:
+            self.executor.shutdown()
+            heartbeats.stop()
+
+    def run_inline(self, once):
+        last_requeue = 0
+        # Jobs run in this thread, so heartbeats have to come from another one
+        heartbeats = HeartbeatThread()
+        heartbeats.start()
+        try:
+            while not self.stopping:
+                if time.monotonic() - last_requeue >= settings.JOBS_HEARTBEAT_INTERVAL:
+                    requeue_stale_jobs()
+                    last_requeue = time.monotonic()
+
+                claimed = claim_jobs(1, self.name)
+                for job_id in claimed:
+                    heartbeats.add(job_id)
+                    try:
+                        execute_job(job_id)
+                    finally:
+                        heartbeats.discard(job_id)
+                if not claimed:
+                    if once:
+                        break
+                    time.sleep(self.poll_interval)
+        finally:
+            heartbeats.stop()
+
+    def start_executor(self):
+        options = {}
+        # Recycles processes so memory held by large jobs is given back; Python 3.10
+        # cannot recycle them, so its processes live as long as the worker
+        if sys.version_info >= (3, 11):
+            options['max_tasks_per_child'] = settings.JOBS_MAX_TASKS_PER_CHILD
+        return ProcessPoolExecutor(
+            max_workers=self.processes,
+            # Spawned processes share no database connections with the worker; they set
+            # Django up before unpickling the first job, which imports this module
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+            **options
+        )
@@ -1,5 +1,6 @@
 import random
 from datetime import timedelta
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from django.utils import timezone
 from faker import Faker
@@ -8,6 +9,8 @@ from library.models import Book, Reader, Checkout
 
 class Command(BaseCommand):
     help = 'Adds fake data to the database for testing purposes'
+    # Callback called with the number of rows created so far, passed by the add_fake_data job
+    stealth_options = ('progress',)
 
     def __init__(self):
         super().__init__()
@@ -15,6 +18,7 @@ class Command(BaseCommand):
         self.created_readers = []
         self.created_books = []
         self.created_checkouts = []
+        self.progress = None
 
     def add_arguments(self, parser):
         parser.add_argument(
@@ -40,6 +44,9 @@ class Command(BaseCommand):
         readers_count = options['readers']
         books_count = options['books']
         checkouts_count = options['checkouts']
+        self.progress = options.get('progress')
+        if self.progress:
+            self.progress(0, readers_count + books_count + checkouts_count)
         
         self.generate_readers(readers_count)
         self.generate_books(books_count)
@@ -59,6 +66,7 @@ class Command(BaseCommand):
         for _ in range(count):
             reader = self.create_single_reader()
             self.created_readers.append(reader)
+            self.report_progress()
 
     def create_single_reader(self):
         card_number = self.fake.unique.numerify(text='######')
@@ -73,6 +81,7 @@ class Command(BaseCommand):
         for _ in range(count):
             book = self.create_single_book()
             self.created_books.append(book)
+            self.report_progress()
 
     def create_single_book(self):
         serial_number = self.fake.unique.numerify(text='######')
@@ -110,18 +119,25 @@ class Command(BaseCommand):
                 checkout = self.create_historical_checkout(reader)
             
             self.created_checkouts.append(checkout)
+            self.report_progress()
+
+    def report_progress(self):
+        if self.progress:
+            self.progress(len(self.created_readers) + len(self.created_books) + len(self.created_checkouts))
 
     def create_active_checkout(self, book, reader):
-        checkout = Checkout.objects.create(
+        checkout_date = self.fake.date_time_between(
+            start_date='-30d',
+            end_date='now',
+            tzinfo=timezone.get_current_timezone()
+        )
+        checkout = self.create_checkout(
             book=book,
             reader=reader,
-            checked_out_at=self.fake.date_time_between(
-                start_date='-30d',
-                end_date='now',
-                tzinfo=timezone.get_current_timezone()
-            )
+            checked_out_at=checkout_date,
+            due_at=checkout_date + timedelta(days=settings.LOAN_PERIOD_DAYS)
         )
-        book.active_checkout = checkout
+        book.set_active_checkout(checkout)
         book.save()
         return checkout
 
@@ -134,9 +150,17 @@ class Command(BaseCommand):
         )
         return_date = checkout_date + timedelta(days=random.randint(1, 14))
         
-        return Checkout.objects.create(
+        return self.create_checkout(
             book=book,
             reader=reader,
             checked_out_at=checkout_date,
-            returned_at=return_date
-        )
\ No newline at end of file
+            returned_at=return_date,
+            due_at=checkout_date + timedelta(days=settings.LOAN_PERIOD_DAYS)
+        )
+
+    def create_checkout(self, checked_out_at, **fields):
+        checkout = Checkout.objects.create(**fields)
+        # auto_now_add overrides checked_out_at on insert, so it is set afterwards
+        Checkout.objects.filter(pk=checkout.pk).update(checked_out_at=checked_out_at)
+        checkout.checked_out_at = checked_out_at
+        return checkout
\ No newline at end of file
@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+
+from library.events import InMemoryBroker
+
+
+class Command(BaseCommand):
+    help = 'Measures memory and delivery latency of idle availability event subscribers'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--subscribers',
+            type=int,
+            default=5000,
+            help='Number of idle subscribers to connect (default: 5000)'
+        )
+        parser.add_argument(
+            '--events',
+            type=int,
+            default=20,
+            help='Number of events to publish (default: 20)'
+        )
+
+    def handle(self, *args, **options):
+        result = asyncio.run(self.run(options['subscribers'], options['events']))
+        memory, latencies = result
+
+        latencies.sort()
+        self.stdout.write(
+            f"Subscribers: {options['subscribers']}\n"
+            f"Memory per subscriber: {memory / options['subscribers']:.0f} bytes\n"
+            f"Delivery to all subscribers: median {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+            f"max {latencies[-1] * 1000:.1f} ms"
+        )
+        self.stdout.write(self.style.SUCCESS('Benchmark finished.'))
+
+    async def run(self, subscribers_count, events_count):
+        broker = InMemoryBroker()
+
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        subscriptions = [broker.subscribe() for _ in range(subscribers_count)]
+        waiters = [asyncio.ensure_future(subscription.get()) for subscription in subscriptions]
+        await asyncio.sleep(0)
+        memory = tracemalloc.get_traced_memory()[0] - baseline
+        tracemalloc.stop()
+
+        latencies = []
+        for i in range(events_count):
+            started = time.perf_counter()
+            # Events are published from request threads, not from the event loop
+            publisher = threading.Thread(
+                target=broker.publish,
+                args=({'type': 'availability', 'branch': 'main', 'serial_number': f'{i:06d}', 'is_available': True},)
+            )
+            publisher.start()
+            await asyncio.gather(*waiters)
+            latencies.append(time.perf_counter() - started)
+            publisher.join()
+            waiters = [asyncio.ensure_future(subscription.get()) for subscription in subscriptions]
+
+        for waiter in waiters:
+            waiter.cancel()
+        for subscription in subscriptions:
+            broker.unsubscribe(subscription)
+        return memory, latencies
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.http import QueryDict
+
+from library.filters import (
+    CachedFilterSet, BookFilter, ReaderFilter, CheckoutFilter, HoldFilter
+)
+from library.models import Book, Reader, Checkout, Hold
+
+
+SCENARIOS = [
+    ('books', BookFilter, Book.objects.all(), 'title=history&is_available=true&page=2'),
+    ('books by serial', BookFilter, Book.objects.all(), 'serial_number__in=123456,234567,345678'),
+    ('readers', ReaderFilter, Reader.objects.all(), 'name=smith'),
+    ('checkouts', CheckoutFilter, Checkout.objects.all(), 'reader=111111&is_active=true&overdue=false'),
+    ('holds', HoldFilter, Hold.objects.all(), 'book=123456&status=waiting'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Compares per-request filter overhead with and without the filter cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--iterations',
+            type=int,
+            default=5000,
+            help='Number of simulated requests per scenario (default: 5000)'
+        )
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        self.stdout.write(f'{"scenario":<18}{"uncached":>14}{"cached":>14}{"speedup":>10}')
+
+        for name, filterset_class, queryset, query_string in SCENARIOS:
+            data = QueryDict(query_string)
+            uncached = self.measure(filterset_class, queryset, data, iterations, cache_enabled=False)
+            cached = self.measure(filterset_class, queryset, data, iterations, cache_enabled=True)
+            self.stdout.write(
+                f'{name:<18}{uncached * 1e6:>11.1f} us{cached * 1e6:>11.1f} us{uncached / cached:>9.1f}x'
+            )
+
+        self.stdout.write(self.style.SUCCESS('Benchmark finished.'))
+
+    def measure(self, filterset_class, queryset, data, iterations, cache_enabled):
+        CachedFilterSet.clear_cache()
+        original = CachedFilterSet.cache_enabled
+        CachedFilterSet.cache_enabled = cache_enabled
+        try:
+            started = time.perf_counter()
+            for _ in range(iterations):
+                # Mirrors DjangoFilterBackend.filter_queryset, without running the query
+                filterset = filterset_class(data, queryset)
+                filterset.is_valid()
+                filterset.qs
+            return (time.perf_counter() - started) / iterations
+        finally:
+            CachedFilterSet.cache_enabled = original
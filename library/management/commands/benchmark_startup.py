@@ -0,0 +1,111 @@
+import os
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+WORKER_STARTUP = (
+    "from libapi.wsgi import application\n"
+    "from django.urls import get_resolver\n"
+    "get_resolver().url_patterns\n"
+)
+
+LAZY_MODULES = (
+    'faker',
+    'drf_yasg.codecs',
+    'drf_yasg.generators',
+    'swagger_spec_validator',
+)
+
+
+class Command(BaseCommand):
+    help = 'Measures the import time of a gunicorn worker starting up'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='Number of cold starts to measure, the fastest one is reported (default: 3)'
+        )
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=15,
+            help='Number of modules to list (default: 15)'
+        )
+        parser.add_argument(
+            '--budget-ms',
+            type=float,
+            default=None,
+            help='Fail if the cold start takes longer than this many milliseconds'
+        )
+
+    def handle(self, *args, **options):
+        runs = [self.measure_startup() for _ in range(max(options['repeat'], 1))]
+        elapsed, imports = min(runs, key=lambda run: run[0])
+
+        self.stdout.write(f'Cold start: {elapsed * 1000:.1f} ms, {len(imports)} modules imported\n')
+        self.report_packages(imports)
+        self.report_modules(imports, options['top'])
+
+        loaded_lazy_modules = [
+            name for name in imports
+            if any(name == lazy or name.startswith(lazy + '.') for lazy in LAZY_MODULES)
+        ]
+        if loaded_lazy_modules:
+            raise CommandError(
+                'Modules that should be imported lazily were loaded on startup: '
+                + ', '.join(sorted(loaded_lazy_modules))
+            )
+
+        budget_ms = options['budget_ms']
+        if budget_ms is not None and elapsed * 1000 > budget_ms:
+            raise CommandError(
+                f'Cold start took {elapsed * 1000:.1f} ms, over the budget of {budget_ms:.1f} ms'
+            )
+        self.stdout.write(self.style.SUCCESS('Startup is within budget.'))
+
+    def measure_startup(self):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'libapi.settings'
+        ))
+        started = time.perf_counter()
+        process = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', WORKER_STARTUP],
+            cwd=settings.BASE_DIR,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        elapsed = time.perf_counter() - started
+        if process.returncode != 0:
+            raise CommandError(f'Worker startup failed:\n{process.stderr}')
+        return elapsed, self.parse_importtime(process.stderr)
+
+    def parse_importtime(self, output):
+        imports = {}
+        for line in output.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            self_us, cumulative_us, name = line[len('import time:'):].split('|')
+            imports[name.strip()] = (int(self_us), int(cumulative_us))
+        return imports
+
+    def report_packages(self, imports):
+        packages = defaultdict(int)
+        for name, (self_us, _) in imports.items():
+            packages[name.split('.')[0]] += self_us
+
+        self.stdout.write('Import time by package:')
+        for package, self_us in sorted(packages.items(), key=lambda item: -item[1])[:10]:
+            self.stdout.write(f'  {self_us / 1000:8.1f} ms  {package}')
+
+    def report_modules(self, imports, top):
+        self.stdout.write('\nSlowest modules (self time):')
+        for name, (self_us, cumulative_us) in sorted(imports.items(), key=lambda item: -item[1][0])[:top]:
+            self.stdout.write(f'  {self_us / 1000:8.1f} ms  (cumulative {cumulative_us / 1000:8.1f} ms)  {name}')
@@ -0,0 +1,38 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from library.branches import iter_branches
+from library.recommendations import build_relations
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds related books from checkout co-occurrence (suitable for a nightly cron job)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top-k',
+            type=int,
+            default=settings.RECOMMENDATIONS_TOP_K,
+            help=f'Number of related books kept per book (default: {settings.RECOMMENDATIONS_TOP_K})'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=10000,
+            help='Number of checkouts fetched from the database at a time (default: 10000)'
+        )
+        parser.add_argument(
+            '--branch',
+            choices=settings.LIBRARY_BRANCHES,
+            help='Only process this branch (default: every branch in LIBRARY_BRANCHES)'
+        )
+
+    def handle(self, *args, **options):
+        for branch in iter_branches(options['branch']):
+            started = time.perf_counter()
+            stored = build_relations(top_k=options['top_k'], chunk_size=options['chunk_size'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Stored {stored} book relations in branch {branch} in {time.perf_counter() - started:.1f} s.'
+            ))
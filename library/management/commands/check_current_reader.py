@@ -0,0 +1,78 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import F, Q
+
+from library.branches import iter_branches
+from library.models import Book
+
+
+class Command(BaseCommand):
+    help = "Checks that the current reader columns of books match their active checkouts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Recompute the columns of inconsistent books'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of books fixed per update (default: 1000)'
+        )
+        parser.add_argument(
+            '--branch',
+            choices=settings.LIBRARY_BRANCHES,
+            help='Only process this branch (default: every branch in LIBRARY_BRANCHES)'
+        )
+
+    def handle(self, *args, **options):
+        unfixed = []
+        for branch in iter_branches(options['branch']):
+            if not self.check_branch(branch, options):
+                unfixed.append(branch)
+        if unfixed:
+            raise CommandError(
+                f"Current reader columns are inconsistent in {', '.join(unfixed)}; run with --fix to repair them"
+            )
+
+    def check_branch(self, branch, options):
+        """Reports and optionally fixes the books of a branch; returns False if inconsistencies remain."""
+        inconsistent = list(
+            Book.objects.filter(self.inconsistent_condition(), branch=branch)
+            .order_by('id')
+            .values_list('id', 'serial_number')
+        )
+        if not inconsistent:
+            self.stdout.write(self.style.SUCCESS(f'Current reader columns are consistent in branch {branch}.'))
+            return True
+
+        serial_numbers = ', '.join(serial_number for _, serial_number in inconsistent[:20])
+        self.stdout.write(f'{len(inconsistent)} books are inconsistent in branch {branch}: {serial_numbers}')
+        if not options['fix']:
+            return False
+
+        ids = [book_id for book_id, _ in inconsistent]
+        batch_size = options['batch_size']
+        for offset in range(0, len(ids), batch_size):
+            Book.refresh_current_reader(Book.objects.filter(id__in=ids[offset:offset + batch_size]))
+        self.stdout.write(self.style.SUCCESS(f'Fixed {len(ids)} books in branch {branch}.'))
+        return True
+
+    def inconsistent_condition(self):
+        available = Q(active_checkout__isnull=True) & (
+            Q(current_reader__isnull=False)
+            | ~Q(current_reader_card_number='')
+            | ~Q(current_reader_name='')
+            | Q(current_checked_out_at__isnull=False)
+        )
+        borrowed = Q(active_checkout__isnull=False) & (
+            Q(current_reader__isnull=True)
+            | Q(current_checked_out_at__isnull=True)
+            | ~Q(current_reader=F('active_checkout__reader'))
+            | ~Q(current_reader_card_number=F('active_checkout__reader__card_number'))
+            | ~Q(current_reader_name=F('active_checkout__reader__name'))
+            | ~Q(current_checked_out_at=F('active_checkout__checked_out_at'))
+        )
+        return available | borrowed
@@ -1,15 +1,17 @@
 from django.core.management.base import BaseCommand
-from library.models import Book, Reader, Checkout
+from library.models import Book, Reader, Checkout, Hold, Change
 
 
 class Command(BaseCommand):
-    help = 'Clears all data from the database (books, readers, checkouts)'
+    help = 'Clears all data from the database (books, readers, checkouts, holds, change log)'
 
     def handle(self, *args, **options):
         self.stdout.write('Deleting all data...')
         
+        Hold.objects.all().delete()
         Checkout.objects.all().delete()
         Book.objects.all().delete()
         Reader.objects.all().delete()
+        Change.objects.all().delete()
         
         self.stdout.write(self.style.SUCCESS('All data has been deleted.'))
\ No newline at end of file
@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from libapi.schema import SCHEMA_FORMATS, render_schema
+
+
+class Command(BaseCommand):
+    help = 'Generates the OpenAPI schema files served by WhiteNoise'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--output-dir',
+            default=None,
+            help='Directory to write the schema files to (default: SCHEMA_ROOT)'
+        )
+
+    def handle(self, *args, **options):
+        output_dir = options['output_dir'] or settings.SCHEMA_ROOT
+        output_dir = settings.BASE_DIR / output_dir
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+        for format in SCHEMA_FORMATS:
+            path = output_dir / f'swagger{format}'
+            path.write_bytes(render_schema(format))
+            self.stdout.write(f'Written {path}')
+
+        self.stdout.write(self.style.SUCCESS('OpenAPI schema has been generated.'))
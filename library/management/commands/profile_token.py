@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from library.models import RequestProfile
+from library.profiling import PROFILE_HEADER, make_token
+
+
+class Command(BaseCommand):
+    help = 'Prints a signed header that makes the API profile the requests carrying it'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--mode',
+            choices=[RequestProfile.CPROFILE, RequestProfile.SAMPLING],
+            default=RequestProfile.CPROFILE,
+            help='Profiler to run (default: cprofile)'
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{PROFILE_HEADER}: {make_token(options["mode"])}')
+        self.stderr.write(
+            f'The header is valid for {settings.PROFILING_TOKEN_MAX_AGE} seconds '
+            'and only has an effect when PROFILING_ENABLED=1.'
+        )
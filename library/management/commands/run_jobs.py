@@ -0,0 +1,40 @@
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from library.jobs import Worker
+
+
+class Command(BaseCommand):
+    help = 'Runs queued background jobs in a pool of worker processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes',
+            type=int,
+            default=settings.JOBS_WORKER_PROCESSES,
+            help=f'Number of jobs run at once; 0 runs them one at a time in this process '
+                 f'(default: {settings.JOBS_WORKER_PROCESSES})'
+        )
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Exit when the queue is empty instead of waiting for new jobs'
+        )
+
+    def handle(self, *args, **options):
+        worker = Worker(processes=options['processes'])
+
+        def stop(signum, frame):
+            self.stdout.write('Stopping after the running jobs finish...')
+            worker.stop()
+
+        previous = {signum: signal.signal(signum, stop) for signum in (signal.SIGTERM, signal.SIGINT)}
+        self.stdout.write(f'Worker {worker.name} started with {worker.processes} processes.')
+        try:
+            worker.run(once=options['once'])
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS('Worker stopped.'))
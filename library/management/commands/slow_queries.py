@@ -0,0 +1,109 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Avg, Count, Max, Sum
+from django.utils import timezone
+
+from library.models import SlowQuery
+
+ORDERINGS = {
+    'total': '-total_ms',
+    'count': '-count',
+    'max': '-max_ms',
+}
+
+
+class Command(BaseCommand):
+    help = 'Reports slow queries grouped by fingerprint, or the details and plan of one fingerprint'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours',
+            type=int,
+            default=24,
+            help='Only report queries from the last N hours (default: 24)'
+        )
+        parser.add_argument(
+            '--limit',
+            type=int,
+            default=20,
+            help='Number of fingerprints to report (default: 20)'
+        )
+        parser.add_argument(
+            '--order-by',
+            choices=sorted(ORDERINGS),
+            default='total',
+            help='Rank fingerprints by total time, number of occurrences or longest duration (default: total)'
+        )
+        parser.add_argument(
+            '--fingerprint',
+            help='Show the latest occurrence and captured plan of this fingerprint'
+        )
+
+    def handle(self, *args, **options):
+        queries = SlowQuery.objects.filter(created_at__gte=timezone.now() - timedelta(hours=options['hours']))
+        if options['fingerprint']:
+            self.show_fingerprint(queries.filter(fingerprint=options['fingerprint']))
+            return
+
+        groups = list(
+            queries.values('fingerprint')
+            .annotate(
+                count=Count('id'),
+                total_ms=Sum('duration_ms'),
+                avg_ms=Avg('duration_ms'),
+                max_ms=Max('duration_ms'),
+                last_seen=Max('created_at')
+            )
+            .order_by(ORDERINGS[options['order_by']], 'fingerprint')[:options['limit']]
+        )
+        if not groups:
+            self.stdout.write(self.style.SUCCESS('No slow queries recorded.'))
+            return
+
+        fingerprints = [group['fingerprint'] for group in groups]
+        views = defaultdict(list)
+        for row in (
+            queries.filter(fingerprint__in=fingerprints)
+            .values('fingerprint', 'view')
+            .annotate(count=Count('id'))
+            .order_by('-count', 'view')
+        ):
+            views[row['fingerprint']].append(f"{row['view'] or '-'} ({row['count']})")
+        sql = {}
+        for query in queries.filter(fingerprint__in=fingerprints).order_by('id').only('fingerprint', 'sql'):
+            sql[query.fingerprint] = query.sql
+
+        self.stdout.write(
+            f'{"fingerprint":<18}{"count":>7}{"total ms":>12}{"avg ms":>10}{"max ms":>10}  last seen'
+        )
+        for group in groups:
+            self.stdout.write(
+                f"{group['fingerprint']:<18}{group['count']:>7}{group['total_ms']:>12.0f}"
+                f"{group['avg_ms']:>10.0f}{group['max_ms']:>10.0f}  {group['last_seen']:%Y-%m-%d %H:%M}"
+            )
+            self.stdout.write(f"  views: {', '.join(views[group['fingerprint']])}")
+            self.stdout.write(f"  {sql[group['fingerprint']][:200]}")
+
+    def show_fingerprint(self, queries):
+        latest = queries.order_by('-id').first()
+        if latest is None:
+            raise CommandError('No slow queries recorded with this fingerprint')
+        with_plan = queries.exclude(plan='').order_by('-id').first()
+
+        self.stdout.write(
+            f'Occurrences: {queries.count()}\n'
+            f'Latest: {latest.duration_ms:.0f} ms on {latest.created_at:%Y-%m-%d %H:%M:%S}, '
+            f'{latest.method} {latest.path} ({latest.view or "-"}) on database {latest.database}\n'
+            f'Query parameters: {latest.query_params}\n'
+            f'SQL: {latest.sql}\n'
+            f'Bound parameters: {latest.params}'
+        )
+        if with_plan is None:
+            self.stdout.write('No plan captured.')
+        else:
+            self.stdout.write(
+                f'Plan captured on {with_plan.created_at:%Y-%m-%d %H:%M:%S} ({with_plan.duration_ms:.0f} ms):\n'
+                f'{with_plan.plan}'
+            )
@@ -0,0 +1,42 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from library.branches import iter_branches
+from library.overdue import expire_ready_holds, sweep_overdue
+
+
+class Command(BaseCommand):
+    help = 'Marks overdue loans that have not been processed yet and expires uncollected holds (suitable for cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of loans processed per batch (default: 1000)'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count overdue loans without marking them'
+        )
+        parser.add_argument(
+            '--branch',
+            choices=settings.LIBRARY_BRANCHES,
+            help='Only process this branch (default: every branch in LIBRARY_BRANCHES)'
+        )
+
+    def handle(self, *args, **options):
+        for branch in iter_branches(options['branch']):
+            processed = sweep_overdue(
+                batch_size=options['batch_size'],
+                dry_run=options['dry_run'],
+                progress=lambda count: self.stdout.write(f'Processed {count} overdue loans...')
+            )
+
+            action = 'Found' if options['dry_run'] else 'Marked'
+            self.stdout.write(self.style.SUCCESS(f'{action} {processed} overdue loans in branch {branch}.'))
+            if not options['dry_run']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Expired {expire_ready_holds()} uncollected holds in branch {branch}.'
+                ))
@@ -0,0 +1,127 @@
+"""
+Prometheus metrics for the Library API.
+
+When PROMETHEUS_MULTIPROC_DIR is set, prometheus_client keeps the values in
+per-process files inside that directory and the /metrics view aggregates them,
+so every gunicorn worker reports into the same set of series. The view only
+answers the addresses listed in METRICS_ALLOWED_IPS.
+"""
+
+import ipaddress
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse, JsonResponse
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram,
+    generate_latest, multiprocess
+)
+from prometheus_client.core import GaugeMetricFamily
+
+
+REQUEST_LATENCY = Histogram(
+    'libapi_request_duration_seconds',
+    'Time spent handling a request',
+    ['route', 'method'],
+)
+REQUESTS = Counter(
+    'libapi_requests_total',
+    'Handled requests',
+    ['route', 'method', 'status'],
+)
+DB_QUERIES = Histogram(
+    'libapi_db_queries_per_request',
+    'Number of database queries executed by a request',
+    ['route'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+DB_TIME = Histogram(
+    'libapi_db_duration_seconds',
+    'Time spent in database queries by a request',
+    ['route'],
+)
+PAGE_NUMBER = Histogram(
+    'libapi_page_number',
+    'Page number requested from paginated list endpoints',
+    ['route'],
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 500),
+)
+AVAILABILITY_INDEX_LOOKUPS = Counter(
+    'libapi_availability_index_lookups_total',
+    'Serial numbers looked up in the availability index',
+)
+AVAILABILITY_INDEX_WARMS = Counter(
+    'libapi_availability_index_warms_total',
+    'Availability index rebuilds from the database',
+)
+REJECTED_REQUESTS = Counter(
+    'libapi_rejected_requests_total',
+    'Requests rejected by throttling or load shedding',
+    ['reason', 'scope'],
+)
+CHECKOUTS = Counter(
+    'libapi_checkouts_total',
+    'Books checked out',
+)
+RETURNS = Counter(
+    'libapi_returns_total',
+    'Books returned',
+)
+
+
+class ActiveLoansCollector:
+    """
+    Reports the number of active loans, counted on every branch database at
+    most once every METRICS_ACTIVE_LOANS_TTL seconds in each process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = None
+        self._counted_at = None
+
+    def count(self):
+        from .branches import get_branch_databases
+        from .models import Book
+
+        with self._lock:
+            if self._counted_at is None or time.monotonic() - self._counted_at >= settings.METRICS_ACTIVE_LOANS_TTL:
+                self._value = sum(
+                    Book.objects.using(database).filter(active_checkout__isnull=False).count()
+                    for database in get_branch_databases()
+                )
+                self._counted_at = time.monotonic()
+            return self._value
+
+    def collect(self):
+        yield GaugeMetricFamily('libapi_active_loans', 'Books currently checked out', value=self.count())
+
+
+active_loans = ActiveLoansCollector()
+business_registry = CollectorRegistry()
+business_registry.register(active_loans)
+
+
+def is_allowed(request):
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in settings.METRICS_ALLOWED_IPS)
+
+
+def metrics_view(request):
+    if not is_allowed(request):
+        return JsonResponse({'error': 'Metrics are not available from this address'}, status=403)
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    output = generate_latest(registry)
+    output += generate_latest(business_registry)
+
+    return HttpResponse(output, content_type=CONTENT_TYPE_LATEST)
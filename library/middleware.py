@@ -0,0 +1,173 @@
+import threading
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import JsonResponse
+
+from . import metrics, profiling, slow_queries
+from .branches import get_request_branch, use_branch
+from .jobs import enqueue
+
+
+class MetricsMiddleware:
+    """Records latency, database usage and pagination depth for every request."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = {'count': 0, 'duration': 0.0}
+
+        def record_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries['count'] += 1
+                queries['duration'] += time.perf_counter() - started
+
+        started = time.perf_counter()
+        # Every alias, so that queries on branch databases count as well
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(record_query))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        route = (match.url_name or match.view_name) if match else 'unmatched'
+        if route == 'metrics':
+            return response
+
+        metrics.REQUEST_LATENCY.labels(route, request.method).observe(duration)
+        metrics.REQUESTS.labels(route, request.method, response.status_code).inc()
+        metrics.DB_QUERIES.labels(route).observe(queries['count'])
+        metrics.DB_TIME.labels(route).observe(queries['duration'])
+
+        page = request.GET.get('page')
+        if page and page.isdigit():
+            metrics.PAGE_NUMBER.labels(route).observe(int(page))
+
+        return response
+
+
+class SlowQueryMiddleware:
+    """
+    Logs and stores the queries of a request that are slower than
+    SLOW_QUERY_THRESHOLD_MS (see library.slow_queries).
+
+    The queries are stored after the view has returned and their plans are
+    captured by jobs; the middleware is removed from the stack when no
+    threshold is set.
+    """
+
+    def __init__(self, get_response):
+        if settings.SLOW_QUERY_THRESHOLD_MS is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with slow_queries.capture(settings.SLOW_QUERY_THRESHOLD_MS) as captured:
+            response = self.get_response(request)
+        if captured:
+            for slow_query in slow_queries.record(request, captured):
+                enqueue('explain_slow_query', {'slow_query_id': slow_query.id})
+        return response
+
+
+class LoadSheddingMiddleware:
+    """
+    Rejects requests with 503 when the worker is overloaded, before any work is done.
+
+    A request is shed when it waited in the proxy queue for longer than
+    LOAD_SHEDDING_MAX_QUEUE_MS (measured from the X-Request-Start header set by
+    the proxy), or when LOAD_SHEDDING_MAX_IN_FLIGHT requests are already being
+    handled by this process.
+    """
+
+    def __init__(self, get_response):
+        if settings.LOAD_SHEDDING_MAX_QUEUE_MS is None and settings.LOAD_SHEDDING_MAX_IN_FLIGHT is None:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, request):
+        queue_ms = self.get_queue_ms(request)
+        max_queue_ms = settings.LOAD_SHEDDING_MAX_QUEUE_MS
+        if queue_ms is not None and max_queue_ms is not None and queue_ms > max_queue_ms:
+            return self.shed('queue_time')
+
+        max_in_flight = settings.LOAD_SHEDDING_MAX_IN_FLIGHT
+        with self.lock:
+            if max_in_flight is not None and self.in_flight >= max_in_flight:
+                overloaded = True
+            else:
+                overloaded = False
+                self.in_flight += 1
+        if overloaded:
+            return self.shed('in_flight')
+
+        try:
+            return self.get_response(request)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def get_queue_ms(self, request):
+        # Accepts "t=<seconds>" as well as millisecond and microsecond timestamps
+        value = request.headers.get('X-Request-Start', '').removeprefix('t=')
+        try:
+            started = float(value)
+        except ValueError:
+            return None
+        while started > 1e11:
+            started /= 1000
+        return (time.time() - started) * 1000
+
+    def shed(self, reason):
+        metrics.REJECTED_REQUESTS.labels(reason, '').inc()
+        response = JsonResponse(
+            {'error': 'Server is overloaded, please retry later'},
+            status=503
+        )
+        response['Retry-After'] = str(settings.LOAD_SHEDDING_RETRY_AFTER)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Captures a cProfile or sampling profile of requests that carry a signed
+    X-Profile header or are picked by PROFILING_SAMPLE_RATE.
+
+    The middleware is removed from the stack entirely unless PROFILING_ENABLED
+    is set, so it costs nothing when profiling is off.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mode = profiling.get_requested_mode(request)
+        if mode is None:
+            return self.get_response(request)
+        return profiling.profile_request(request, self.get_response, mode)
+
+
+class BranchMiddleware:
+    """Runs the request in the branch given by the X-Branch header or the branch parameter."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        branch = get_request_branch(request)
+        if branch not in settings.LIBRARY_BRANCHES:
+            return JsonResponse({'error': f'Unknown branch: {branch}'}, status=400)
+        with use_branch(branch):
+            return self.get_response(request)
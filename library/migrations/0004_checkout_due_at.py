@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+import library.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_due_at(apps, schema_editor):
+    Checkout = apps.get_model('library', 'Checkout')
+    Checkout.objects.update(
+        due_at=models.ExpressionWrapper(
+            models.F('checked_out_at') + timedelta(days=settings.LOAN_PERIOD_DAYS),
+            output_field=models.DateTimeField()
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0003_hold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='checkout',
+            name='due_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(backfill_due_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='checkout',
+            name='due_at',
+            field=models.DateTimeField(default=library.models.default_due_at),
+        ),
+        migrations.AddField(
+            model_name='checkout',
+            name='overdue_notified_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='checkout',
+            index=models.Index(condition=models.Q(('returned_at__isnull', True)), fields=['due_at', 'id'], name='checkout_active_due_idx'),
+        ),
+    ]
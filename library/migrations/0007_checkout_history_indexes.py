@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0006_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='checkout',
+            index=models.Index(fields=['book', 'checked_out_at'], include=('reader', 'due_at', 'returned_at'), name='checkout_book_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='checkout',
+            index=models.Index(fields=['reader', 'checked_out_at'], include=('book', 'due_at', 'returned_at'), name='checkout_reader_history_idx'),
+        ),
+        migrations.AlterField(
+            model_name='checkout',
+            name='book',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='checkouts', to='library.book'),
+        ),
+        migrations.AlterField(
+            model_name='checkout',
+            name='reader',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='checkouts', to='library.reader'),
+        ),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:21
+
+from django.db import migrations
+
+
+class PostgresRunSQL(migrations.RunSQL):
+    """
+    Operator classes only exist on PostgreSQL; other databases skip the index.
+    The indexes are not part of the model state, so that table rebuilds on
+    other databases never try to recreate them.
+    """
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if schema_editor.connection.vendor == 'postgresql':
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0007_checkout_history_indexes'),
+    ]
+
+    operations = [
+        PostgresRunSQL(
+            'CREATE INDEX book_title_prefix_idx ON library_book (UPPER(title) text_pattern_ops)',
+            'DROP INDEX book_title_prefix_idx',
+            state_operations=[],
+        ),
+        PostgresRunSQL(
+            'CREATE INDEX book_author_prefix_idx ON library_book (UPPER(author) text_pattern_ops)',
+            'DROP INDEX book_author_prefix_idx',
+            state_operations=[],
+        ),
+        PostgresRunSQL(
+            'CREATE INDEX reader_name_prefix_idx ON library_reader (UPPER(name) text_pattern_ops)',
+            'DROP INDEX reader_name_prefix_idx',
+            state_operations=[],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RequestProfile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.TextField()),
+                ('route', models.CharField(blank=True, max_length=100)),
+                ('query_params', models.JSONField(default=dict)),
+                ('status_code', models.PositiveSmallIntegerField()),
+                ('duration_ms', models.FloatField()),
+                ('mode', models.CharField(choices=[('cprofile', 'cProfile'), ('sampling', 'Sampling')], max_length=10)),
+                ('sql', models.JSONField(default=list)),
+                ('data', models.BinaryField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_current_reader(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    Checkout = apps.get_model('library', 'Checkout')
+    active_checkout = Checkout.objects.filter(id=models.OuterRef('active_checkout'))
+    Book.objects.filter(active_checkout__isnull=False).update(
+        current_reader=models.Subquery(active_checkout.values('reader')[:1]),
+        current_reader_card_number=models.Subquery(active_checkout.values('reader__card_number')[:1]),
+        current_reader_name=models.Subquery(active_checkout.values('reader__name')[:1]),
+        current_checked_out_at=models.Subquery(active_checkout.values('checked_out_at')[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_requestprofile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='current_checked_out_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='current_reader',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='current_books', to='library.reader'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='current_reader_card_number',
+            field=models.CharField(blank=True, max_length=6),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='current_reader_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(backfill_current_reader, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0010_book_current_reader'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookRelation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField()),
+                ('book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='relations', to='library.book')),
+                ('related_book', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='library.book')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['book', '-score'], name='book_relation_rank_idx')],
+                'constraints': [models.UniqueConstraint(fields=('book', 'related_book'), name='unique_book_relation')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_bookrelation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='branch',
+            field=models.CharField(default='main', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='checkout',
+            name='branch',
+            field=models.CharField(default='main', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='reader',
+            name='branch',
+            field=models.CharField(default='main', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['branch', '-created_at'], name='book_branch_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='checkout',
+            index=models.Index(fields=['branch', '-checked_out_at'], name='checkout_branch_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reader',
+            index=models.Index(fields=['branch', '-created_at'], name='reader_branch_created_idx'),
+        ),
+    ]
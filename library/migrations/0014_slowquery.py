@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0013_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=16)),
+                ('sql', models.TextField()),
+                ('params', models.JSONField(default=list)),
+                ('database', models.CharField(max_length=50)),
+                ('duration_ms', models.FloatField()),
+                ('method', models.CharField(max_length=10)),
+                ('path', models.TextField()),
+                ('view', models.CharField(blank=True, max_length=100)),
+                ('query_params', models.JSONField(default=dict)),
+                ('plan', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['fingerprint', '-created_at'], name='slow_query_fingerprint_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0014_slowquery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='change',
+            name='branch',
+            field=models.CharField(default='main', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='book',
+            name='serial_number',
+            field=models.CharField(max_length=6),
+        ),
+        migrations.AlterField(
+            model_name='reader',
+            name='card_number',
+            field=models.CharField(max_length=6),
+        ),
+        migrations.AddIndex(
+            model_name='change',
+            index=models.Index(fields=['branch', 'id'], name='change_branch_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='book',
+            constraint=models.UniqueConstraint(fields=('branch', 'serial_number'), name='unique_book_serial_number'),
+        ),
+        migrations.AddConstraint(
+            model_name='reader',
+            constraint=models.UniqueConstraint(fields=('branch', 'card_number'), name='unique_reader_card_number'),
+        ),
+    ]
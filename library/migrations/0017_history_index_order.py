@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0016_idempotency_key_lease'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='checkout',
+            name='checkout_book_history_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='checkout',
+            name='checkout_reader_history_idx',
+        ),
+        migrations.AddIndex(
+            model_name='checkout',
+            index=models.Index(fields=['book', 'checked_out_at', 'id'], include=('reader', 'due_at', 'returned_at'), name='checkout_book_history_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='checkout',
+            index=models.Index(fields=['reader', 'checked_out_at', 'id'], include=('book', 'due_at', 'returned_at'), name='checkout_reader_history_idx'),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0017_history_index_order'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='checkout',
+            name='checkout_active_due_idx',
+        ),
+        migrations.AddIndex(
+            model_name='checkout',
+            index=models.Index(condition=models.Q(('overdue_notified_at__isnull', True), ('returned_at__isnull', True)), fields=['due_at', 'id'], name='checkout_active_due_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='checkout',
+            index=models.Index(condition=models.Q(('returned_at__isnull', True)), fields=['due_at'], name='checkout_overdue_idx'),
+        ),
+    ]
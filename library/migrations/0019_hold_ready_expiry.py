@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0018_pending_overdue_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='hold',
+            name='status',
+            field=models.CharField(choices=[('waiting', 'Waiting'), ('ready', 'Ready for pickup'), ('fulfilled', 'Fulfilled'), ('cancelled', 'Cancelled'), ('expired', 'Expired')], default='waiting', max_length=10),
+        ),
+        migrations.AddIndex(
+            model_name='hold',
+            index=models.Index(condition=models.Q(('status', 'ready')), fields=['ready_at', 'id'], name='hold_ready_idx'),
+        ),
+    ]
@@ -1,8 +1,21 @@
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from rest_framework.utils.encoders import JSONEncoder
+
+
+def default_due_at():
+    return timezone.now() + timedelta(days=settings.LOAN_PERIOD_DAYS)
 
 
 class Book(models.Model):
-    serial_number = models.CharField(max_length=6, unique=True)
+    branch = models.CharField(max_length=20, default='main')
+    # Unique within a branch, see Meta.constraints
+    serial_number = models.CharField(max_length=6)
     title = models.CharField(max_length=255)
     author = models.CharField(max_length=255)
     active_checkout = models.OneToOneField(
@@ -12,19 +25,376 @@ class Book(models.Model):
         blank=True,
         related_name='active_for_book'
     )
+    # Copies of the active checkout's reader and date, maintained by
+    # set_active_checkout() and refresh_current_reader() so that book lists
+    # do not join checkouts and readers
+    current_reader = models.ForeignKey(
+        'Reader',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='current_books'
+    )
+    current_reader_card_number = models.CharField(max_length=6, blank=True)
+    current_reader_name = models.CharField(max_length=255, blank=True)
+    current_checked_out_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            # Book lists of a branch, newest first
+            models.Index(fields=['branch', '-created_at'], name='book_branch_created_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['branch', 'serial_number'], name='unique_book_serial_number'),
+        ]
+        # UPPER() text_pattern_ops indexes for the case-insensitive prefix search of
+        # the admin exist on PostgreSQL only and are managed by migration 0008
+
+    def __str__(self):
+        return f'{self.serial_number} {self.title}'
+
+    def set_active_checkout(self, checkout):
+        """Sets the active checkout (or None) along with the current reader columns; the caller saves."""
+        self.active_checkout = checkout
+        reader = checkout.reader if checkout else None
+        self.current_reader = reader
+        self.current_reader_card_number = reader.card_number if reader else ''
+        self.current_reader_name = reader.name if reader else ''
+        self.current_checked_out_at = checkout.checked_out_at if checkout else None
+
+    @staticmethod
+    def refresh_current_reader(queryset):
+        """Recomputes the current reader columns of the books in queryset from their active checkouts."""
+        active_checkout = Checkout.objects.filter(id=OuterRef('active_checkout'))
+        return queryset.update(
+            current_reader=Subquery(active_checkout.values('reader')[:1]),
+            current_reader_card_number=Coalesce(
+                Subquery(active_checkout.values('reader__card_number')[:1]), Value('')
+            ),
+            current_reader_name=Coalesce(Subquery(active_checkout.values('reader__name')[:1]), Value('')),
+            current_checked_out_at=Subquery(active_checkout.values('checked_out_at')[:1]),
+        )
+
 
 class Reader(models.Model):
-    card_number = models.CharField(max_length=6, unique=True)
+    branch = models.CharField(max_length=20, default='main')
+    # Unique within a branch, see Meta.constraints
+    card_number = models.CharField(max_length=6)
     name = models.CharField(max_length=255, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['branch', '-created_at'], name='reader_branch_created_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['branch', 'card_number'], name='unique_reader_card_number'),
+        ]
+
+    def __str__(self):
+        return f'{self.card_number} {self.name}'.strip()
+
 
 class Checkout(models.Model):
-    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='checkouts')
-    reader = models.ForeignKey(Reader, on_delete=models.CASCADE, related_name='checkouts')
+    branch = models.CharField(max_length=20, default='main')
+    # Lookups by book or reader are served by the history indexes below
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='checkouts', db_index=False)
+    reader = models.ForeignKey(Reader, on_delete=models.CASCADE, related_name='checkouts', db_index=False)
     checked_out_at = models.DateTimeField(auto_now_add=True)
     returned_at = models.DateTimeField(null=True, blank=True)
+    due_at = models.DateTimeField(default=default_due_at)
+    overdue_notified_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Active loans not processed by the overdue sweep yet, in the order the
+            # sweep walks them, so each run only touches pending loans
+            models.Index(
+                fields=['due_at', 'id'],
+                condition=models.Q(returned_at__isnull=True, overdue_notified_at__isnull=True),
+                name='checkout_active_due_idx'
+            ),
+            # Active loans ordered by due date, used by the overdue filter
+            models.Index(
+                fields=['due_at'],
+                condition=models.Q(returned_at__isnull=True),
+                name='checkout_overdue_idx'
+            ),
+            # Checkout lists of a branch, newest first
+            models.Index(fields=['branch', '-checked_out_at'], name='checkout_branch_idx'),
+            # Loan history of a book or reader, newest first. The key matches the
+            # history ordering and the included columns hold the rest of a history
+            # row, so PostgreSQL reads history pages with an index-only scan
+            models.Index(
+                fields=['book', 'checked_out_at', 'id'],
+                include=['reader', 'due_at', 'returned_at'],
+                name='checkout_book_history_idx'
+            ),
+            models.Index(
+                fields=['reader', 'checked_out_at', 'id'],
+                include=['book', 'due_at', 'returned_at'],
+                name='checkout_reader_history_idx'
+            ),
+        ]
+
+    @property
+    def is_overdue(self):
+        return self.returned_at is None and self.due_at < timezone.now()
+
+
+class Hold(models.Model):
+    WAITING = 'waiting'
+    READY = 'ready'
+    FULFILLED = 'fulfilled'
+    CANCELLED = 'cancelled'
+    EXPIRED = 'expired'
+    STATUS_CHOICES = [
+        (WAITING, 'Waiting'),
+        (READY, 'Ready for pickup'),
+        (FULFILLED, 'Fulfilled'),
+        (CANCELLED, 'Cancelled'),
+        (EXPIRED, 'Expired'),
+    ]
+    OPEN_STATUSES = [WAITING, READY]
+
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='holds')
+    reader = models.ForeignKey(Reader, on_delete=models.CASCADE, related_name='holds')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=WAITING)
+    created_at = models.DateTimeField(auto_now_add=True)
+    ready_at = models.DateTimeField(null=True, blank=True)
+    closed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # FIFO queue of waiting holds per book, used to promote the next hold
+            models.Index(
+                fields=['book', 'created_at', 'id'],
+                condition=models.Q(status='waiting'),
+                name='hold_queue_idx'
+            ),
+            # Ready holds by the time they became ready, used to expire uncollected ones
+            models.Index(
+                fields=['ready_at', 'id'],
+                condition=models.Q(status='ready'),
+                name='hold_ready_idx'
+            ),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['book', 'reader'],
+                condition=models.Q(status__in=['waiting', 'ready']),
+                name='unique_open_hold'
+            ),
+        ]
+
+    @classmethod
+    def promote_next(cls, book):
+        """Marks the oldest waiting hold on the book as ready. Must run inside a transaction."""
+        hold = (
+            cls.objects.using(book._state.db).select_for_update()
+            .filter(book=book, status=cls.WAITING)
+            .order_by('created_at', 'id')
+            .first()
+        )
+        if hold is not None:
+            hold.status = cls.READY
+            hold.ready_at = timezone.now()
+            hold.save(update_fields=['status', 'ready_at'])
+        return hold
+
+    @staticmethod
+    def ready_deadline(now=None):
+        """Holds that became ready before this time were not picked up in time."""
+        return (now or timezone.now()) - timedelta(days=settings.HOLD_READY_DAYS)
+
+    def is_expired(self, now=None):
+        return self.status == self.READY and self.ready_at < self.ready_deadline(now)
+
+    def expire(self, now=None):
+        """
+        Closes a ready hold that was not picked up in time and reserves the book
+        for the next hold, which is returned. Must run inside a transaction.
+        """
+        self.status = self.EXPIRED
+        self.closed_at = now or timezone.now()
+        self.save(update_fields=['status', 'closed_at'])
+        return Hold.promote_next(self.book)
+
+
+class Change(models.Model):
+    BOOK = 'book'
+    READER = 'reader'
+    ENTITY_CHOICES = [
+        (BOOK, 'Book'),
+        (READER, 'Reader'),
+    ]
+
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    CHECKED_OUT = 'checked_out'
+    RETURNED = 'returned'
+    ACTION_CHOICES = [
+        (CREATED, 'Created'),
+        (UPDATED, 'Updated'),
+        (DELETED, 'Deleted'),
+        (CHECKED_OUT, 'Checked out'),
+        (RETURNED, 'Returned'),
+    ]
+
+    # Written in the transaction of the change, on the database of its branch
+    branch = models.CharField(max_length=20, default='main')
+    entity = models.CharField(max_length=10, choices=ENTITY_CHOICES)
+    key = models.CharField(max_length=6)
+    action = models.CharField(max_length=16, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Change feed of a branch, read in id order from a cursor
+            models.Index(fields=['branch', 'id'], name='change_branch_idx'),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    # Keys are chosen by clients, so each client (user or address) has its own
+    client = models.CharField(max_length=100, default='')
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    # Both stay empty while the first request with this key is in flight
+    status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True, encoder=JSONEncoder)
+    # Start of the in-flight request's lease, after which a retry may take the key over
+    claimed_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['client', 'key'], name='unique_idempotency_key'),
+        ]
+
+
+class LogQuerySet(models.QuerySet):
+    def keep_latest(self, limit):
+        """Deletes all but the latest limit rows."""
+        oldest_kept = list(self.order_by('-id').values_list('id', flat=True)[limit - 1:limit])
+        if oldest_kept:
+            self.filter(id__lt=oldest_kept[0]).delete()
+
+
+class RequestProfile(models.Model):
+    CPROFILE = 'cprofile'
+    SAMPLING = 'sampling'
+    MODE_CHOICES = [
+        (CPROFILE, 'cProfile'),
+        (SAMPLING, 'Sampling'),
+    ]
+
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    route = models.CharField(max_length=100, blank=True)
+    query_params = models.JSONField(default=dict)
+    status_code = models.PositiveSmallIntegerField()
+    duration_ms = models.FloatField()
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES)
+    sql = models.JSONField(default=list)
+    # marshalled pstats for cProfile, collapsed stacks for the sampling profiler
+    data = models.BinaryField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = LogQuerySet.as_manager()
+
+
+class BookRelation(models.Model):
+    """
+    One of the top neighbours of a book by checkout co-occurrence: score is the
+    number of readers who borrowed both books.
+    """
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='relations')
+    related_book = models.ForeignKey(Book, on_delete=models.CASCADE, related_name='+')
+    score = models.PositiveIntegerField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['book', 'related_book'], name='unique_book_relation'),
+        ]
+        indexes = [
+            models.Index(fields=['book', '-score'], name='book_relation_rank_idx'),
+        ]
+
+
+class Job(models.Model):
+    """A unit of background work run by the run_jobs worker (see library.jobs)."""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    ]
+
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict)
+    branch = models.CharField(max_length=50, default='main')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    progress = models.PositiveIntegerField(default=0)
+    total = models.PositiveIntegerField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Refreshed by the worker while the job runs, so jobs of a dead worker can be requeued
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # FIFO queue of jobs waiting for a worker
+            models.Index(
+                fields=['created_at', 'id'],
+                condition=models.Q(status='queued'),
+                name='job_queue_idx'
+            ),
+            models.Index(
+                fields=['kind'],
+                condition=models.Q(status='running'),
+                name='job_running_idx'
+            ),
+        ]
+
+
+class SlowQuery(models.Model):
+    """A query that took longer than SLOW_QUERY_THRESHOLD_MS (see library.slow_queries)."""
+    # Hash of the SQL with literals and parameter lists normalized away
+    fingerprint = models.CharField(max_length=16)
+    sql = models.TextField()
+    params = models.JSONField(default=list)
+    database = models.CharField(max_length=50)
+    duration_ms = models.FloatField()
+    method = models.CharField(max_length=10)
+    path = models.TextField()
+    # Viewset and action, e.g. "BookViewSet.list", or the URL name of other views
+    view = models.CharField(max_length=100, blank=True)
+    query_params = models.JSONField(default=dict)
+    # Empty until the explain_slow_query job ran, when the plan of the fingerprint
+    # was captured recently, or when the query cannot be explained
+    plan = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = LogQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['fingerprint', '-created_at'], name='slow_query_fingerprint_idx'),
+        ]
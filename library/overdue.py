@@ -0,0 +1,76 @@
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .branches import get_branch_database, get_current_branch
+from .models import Book, Checkout, Hold
+
+
+def overdue_checkouts(now=None):
+    """Overdue loans of the current branch."""
+    now = now or timezone.now()
+    return Checkout.objects.filter(branch=get_current_branch(), returned_at__isnull=True, due_at__lt=now)
+
+
+def sweep_overdue(now=None, batch_size=1000, dry_run=False, progress=None):
+    """
+    Marks overdue loans of the current branch that have not been processed
+    yet, walking them in (due_at, id) order one batch at a time, so memory stays bounded and every
+    batch is a range scan of the pending loans index, regardless of how many
+    loans are active or were already processed.
+
+    Returns the number of processed loans.
+    """
+    now = now or timezone.now()
+    pending = overdue_checkouts(now).filter(overdue_notified_at__isnull=True)
+    processed = 0
+    last_key = None
+
+    while True:
+        batch = pending
+        if last_key is not None:
+            last_due_at, last_id = last_key
+            batch = batch.filter(Q(due_at__gt=last_due_at) | Q(due_at=last_due_at, id__gt=last_id))
+        keys = list(batch.order_by('due_at', 'id').values_list('due_at', 'id')[:batch_size])
+        if not keys:
+            break
+
+        if not dry_run:
+            Checkout.objects.filter(
+                id__in=[checkout_id for _, checkout_id in keys],
+                overdue_notified_at__isnull=True
+            ).update(overdue_notified_at=now)
+
+        processed += len(keys)
+        last_key = keys[-1]
+        if progress is not None:
+            progress(processed)
+
+    return processed
+
+
+def expire_ready_holds(now=None):
+    """
+    Expires the ready holds of the current branch that were not picked up
+    within HOLD_READY_DAYS and reserves their books for the next hold in the
+    queue. Each hold is expired in its own transaction, with the book and the
+    hold locked like a checkout.
+
+    Returns the number of expired holds.
+    """
+    now = now or timezone.now()
+    branch = get_current_branch()
+    database = get_branch_database(branch)
+    pending = Hold.objects.filter(book__branch=branch, status=Hold.READY, ready_at__lt=Hold.ready_deadline(now))
+    expired = 0
+
+    for hold_id, book_id in list(pending.order_by('ready_at', 'id').values_list('id', 'book_id')):
+        with transaction.atomic(using=database):
+            Book.objects.select_for_update().filter(id=book_id).first()
+            # The hold may have been picked up or cancelled in the meantime
+            hold = pending.select_for_update().filter(id=hold_id).first()
+            if hold is not None:
+                hold.expire(now)
+                expired += 1
+
+    return expired
@@ -0,0 +1,7 @@
+from rest_framework.pagination import CursorPagination
+
+
+class HistoryPagination(CursorPagination):
+    """Keyset pagination of loan history, newest loans first."""
+    page_size = 50
+    ordering = ('-checked_out_at', '-id')
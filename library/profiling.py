@@ -0,0 +1,137 @@
+"""
+On-demand profiling of single requests.
+
+A request is profiled when it carries a valid signed token in the X-Profile
+header (issued by the profile_token command) or when it is picked by
+PROFILING_SAMPLE_RATE. The profile is stored as a RequestProfile together with
+the endpoint, query parameters and the SQL statements the request ran.
+"""
+
+import cProfile
+import marshal
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core import signing
+from django.db import connection
+
+from .models import RequestProfile
+
+PROFILE_HEADER = 'X-Profile'
+SIGNING_SALT = 'library.profiling'
+
+
+class CProfiler:
+    """Deterministic profiler; the result can be loaded with pstats or snakeviz."""
+
+    def start(self):
+        self.profile = cProfile.Profile()
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def dumps(self):
+        self.profile.create_stats()
+        return marshal.dumps(self.profile.stats)
+
+
+class SamplingProfiler:
+    """
+    Samples the stack of the request thread from a background thread; the
+    result is in collapsed stack format for flame graph tools.
+    """
+
+    def __init__(self):
+        self.interval = settings.PROFILING_SAMPLING_INTERVAL
+        self.samples = Counter()
+        self._thread_id = threading.get_ident()
+        self._stop = threading.Event()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def dumps(self):
+        return ''.join(
+            f'{stack} {count}\n' for stack, count in self.samples.most_common()
+        ).encode()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f'{frame.f_code.co_name} ({frame.f_code.co_filename})')
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+
+PROFILERS = {
+    RequestProfile.CPROFILE: CProfiler,
+    RequestProfile.SAMPLING: SamplingProfiler,
+}
+
+
+def make_token(mode=RequestProfile.CPROFILE):
+    return signing.dumps({'mode': mode}, salt=SIGNING_SALT)
+
+
+def get_requested_mode(request):
+    """Returns the profiler mode for the request, or None if it should not be profiled."""
+    token = request.headers.get(PROFILE_HEADER)
+    if token:
+        try:
+            data = signing.loads(token, salt=SIGNING_SALT, max_age=settings.PROFILING_TOKEN_MAX_AGE)
+        except signing.BadSignature:
+            return None
+        return data.get('mode') if data.get('mode') in PROFILERS else None
+    if settings.PROFILING_SAMPLE_RATE and random.random() < settings.PROFILING_SAMPLE_RATE:
+        return settings.PROFILING_SAMPLE_MODE
+    return None
+
+
+def profile_request(request, get_response, mode):
+    queries = []
+
+    def log_query(execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            queries.append({'sql': sql, 'duration_ms': (time.perf_counter() - started) * 1000})
+
+    profiler = PROFILERS[mode]()
+    started = time.perf_counter()
+    with connection.execute_wrapper(log_query):
+        profiler.start()
+        try:
+            response = get_response(request)
+        finally:
+            profiler.stop()
+    duration_ms = (time.perf_counter() - started) * 1000
+
+    resolver_match = getattr(request, 'resolver_match', None)
+    profile = RequestProfile.objects.create(
+        method=request.method,
+        path=request.path,
+        route=(resolver_match and resolver_match.url_name) or '',
+        query_params={key: request.GET.getlist(key) for key in request.GET},
+        status_code=response.status_code,
+        duration_ms=duration_ms,
+        mode=mode,
+        sql=queries,
+        data=profiler.dumps(),
+    )
+    RequestProfile.objects.keep_latest(settings.PROFILING_MAX_PROFILES)
+    response['X-Profile-Id'] = str(profile.id)
+    return response
@@ -0,0 +1,158 @@
+"""
+"Readers who borrowed this also borrowed" recommendations.
+
+build_relations() counts, for every pair of books, how many readers borrowed
+both. It works through the books of a branch RECOMMENDATIONS_BOOKS_PER_PASS at
+a time: each pass walks the checkout history of the readers of its books in
+chunks, counts the neighbours of those books only and stores their top
+RECOMMENDATIONS_TOP_K neighbours as BookRelation rows before the next pass, so
+memory is bounded by the neighbours of one pass's books rather than by every
+co-borrowed pair.
+
+record_checkout() keeps the stored relations current between rebuilds: a
+reader's first loan of a book adds one to the score of that book's pairs with
+the reader's RECOMMENDATIONS_MAX_PAIRS_PER_CHECKOUT most recent other books.
+Checkouts queue it as a record_checkout job, so it runs off the request. Pairs that were not in the top neighbours when they
+were trimmed start again from zero, so scores drift from the exact counts
+until the next rebuild.
+"""
+
+import heapq
+from collections import Counter, defaultdict
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, Window
+from django.db.models.functions import RowNumber
+
+from .branches import get_branch_database, get_current_branch
+from .models import Book, BookRelation, Checkout
+
+BATCH_SIZE = 5000
+
+
+def count_cooccurrences(first_book_id, last_book_id, chunk_size=10000, max_books_per_reader=None):
+    """
+    Returns {book_id: Counter({related_book_id: readers who borrowed both})} for
+    the books of the current branch with ids from first_book_id to last_book_id.
+    Only the readers of those books are walked, and only their neighbours are kept.
+    """
+    max_books_per_reader = max_books_per_reader or settings.RECOMMENDATIONS_MAX_BOOKS_PER_READER
+    counts = defaultdict(Counter)
+    checkouts = Checkout.objects.filter(branch=get_current_branch())
+    readers = checkouts.filter(book__gte=first_book_id, book__lte=last_book_id).values('reader_id')
+    rows = (
+        checkouts.filter(reader_id__in=readers)
+        .order_by('reader_id', 'book_id')
+        .values_list('reader_id', 'book_id')
+        .distinct()
+        .iterator(chunk_size=chunk_size)
+    )
+    for _, loans in groupby(rows, key=itemgetter(0)):
+        book_ids = [book_id for _, book_id in loans][:max_books_per_reader]
+        for book_id in book_ids:
+            if first_book_id <= book_id <= last_book_id:
+                neighbours = counts[book_id]
+                for other_book_id in book_ids:
+                    if other_book_id != book_id:
+                        neighbours[other_book_id] += 1
+    return counts
+
+
+def top_neighbours(neighbours, top_k):
+    # Highest score first, ties broken by the lower book id
+    return heapq.nsmallest(top_k, neighbours.items(), key=lambda item: (-item[1], item[0]))
+
+
+def build_relations(top_k=None, chunk_size=10000, books_per_pass=None, progress=None):
+    """
+    Replaces the stored relations of the current branch with the top_k neighbours of every
+    book, books_per_pass books at a time; returns the number stored.
+    progress, if given, is called with the number of books done so far.
+    """
+    top_k = top_k or settings.RECOMMENDATIONS_TOP_K
+    books_per_pass = books_per_pass or settings.RECOMMENDATIONS_BOOKS_PER_PASS
+    branch = get_current_branch()
+    books = Book.objects.filter(branch=branch).order_by('id').values_list('id', flat=True)
+    if progress:
+        progress(0, books.count())
+
+    stored = done = last_book_id = 0
+    while True:
+        book_ids = list(books.filter(id__gt=last_book_id)[:books_per_pass])
+        if not book_ids:
+            break
+        first_book_id, last_book_id = book_ids[0], book_ids[-1]
+        counts = count_cooccurrences(first_book_id, last_book_id, chunk_size)
+        relations = [
+            BookRelation(book_id=book_id, related_book_id=related_book_id, score=score)
+            for book_id, neighbours in counts.items()
+            for related_book_id, score in top_neighbours(neighbours, top_k)
+        ]
+        # Each pass replaces the relations of its books at once
+        with transaction.atomic(using=get_branch_database(branch)):
+            BookRelation.objects.filter(
+                book__branch=branch, book__gte=first_book_id, book__lte=last_book_id
+            ).delete()
+            stored += len(BookRelation.objects.bulk_create(relations, batch_size=BATCH_SIZE))
+        done += len(book_ids)
+        if progress:
+            progress(done)
+    return stored
+
+
+def record_checkout(checkout_id):
+    """Adds a new loan to the stored relations of its book and of the books the reader borrowed before."""
+    checkout = Checkout.objects.filter(id=checkout_id).values('book_id', 'reader_id').first()
+    if checkout is None:
+        return
+    book_id = checkout['book_id']
+    # Loans made after this one are recorded by their own calls
+    history = Checkout.objects.filter(reader_id=checkout['reader_id'], id__lt=checkout_id)
+    if history.filter(book_id=book_id).exists():
+        # The reader borrowed this book before and is already counted
+        return
+
+    # Only the reader's most recent books are paired, which bounds the work per loan
+    other_book_ids = list(
+        history.values('book_id')
+        .annotate(last_checked_out_at=Max('checked_out_at'))
+        .order_by('-last_checked_out_at', 'book_id')
+        .values_list('book_id', flat=True)[:settings.RECOMMENDATIONS_MAX_PAIRS_PER_CHECKOUT]
+    )
+    if not other_book_ids:
+        return
+
+    with transaction.atomic(using=get_branch_database(get_current_branch())):
+        increment(BookRelation.objects.filter(book_id=book_id, related_book_id__in=other_book_ids),
+                  [(book_id, other_book_id) for other_book_id in other_book_ids])
+        increment(BookRelation.objects.filter(book_id__in=other_book_ids, related_book_id=book_id),
+                  [(other_book_id, book_id) for other_book_id in other_book_ids])
+        trim([book_id] + other_book_ids)
+
+
+def increment(existing, pairs):
+    found = set(existing.values_list('book_id', 'related_book_id'))
+    existing.update(score=F('score') + 1)
+    BookRelation.objects.bulk_create(
+        [
+            BookRelation(book_id=book_id, related_book_id=related_book_id, score=1)
+            for book_id, related_book_id in pairs
+            if (book_id, related_book_id) not in found
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def trim(book_ids, top_k=None):
+    """Deletes the relations of the given books that fell out of their top_k."""
+    top_k = top_k or settings.RECOMMENDATIONS_TOP_K
+    ranked = BookRelation.objects.filter(book_id__in=book_ids).annotate(
+        rank=Window(RowNumber(), partition_by=F('book_id'), order_by=[F('score').desc(), F('related_book_id')])
+    )
+    surplus = list(ranked.filter(rank__gt=top_k).values_list('id', flat=True))
+    if surplus:
+        BookRelation.objects.filter(id__in=surplus).delete()
@@ -1,12 +1,25 @@
+from django.conf import settings
 from rest_framework import serializers
-from .models import Book, Reader, Checkout
+from rest_framework.validators import UniqueTogetherValidator
+from .branches import CurrentBranchDefault
+from .jobs import get_public_kinds
+from .models import Book, Reader, Checkout, Hold, Change, RequestProfile, Job
 
 
 class ReaderSerializer(serializers.ModelSerializer):
+    branch = serializers.HiddenField(default=CurrentBranchDefault())
+
     class Meta:
         model = Reader
-        fields = ['card_number', 'name', 'created_at', 'updated_at']
+        fields = ['branch', 'card_number', 'name', 'created_at', 'updated_at']
         read_only_fields = ['created_at', 'updated_at']
+        validators = [
+            UniqueTogetherValidator(
+                queryset=Reader.objects.all(),
+                fields=['branch', 'card_number'],
+                message='A reader with this card number already exists in this branch'
+            )
+        ]
 
     def validate_card_number(self, value):
         if not value.isdigit() or len(value) != 6:
@@ -17,14 +30,22 @@ class ReaderSerializer(serializers.ModelSerializer):
 class BookSerializer(serializers.ModelSerializer):
     is_available = serializers.SerializerMethodField()
     current_reader = serializers.SerializerMethodField()
+    branch = serializers.HiddenField(default=CurrentBranchDefault())
 
     class Meta:
         model = Book
         fields = [
-            'serial_number', 'title', 'author', 'is_available',
+            'branch', 'serial_number', 'title', 'author', 'is_available',
             'current_reader', 'created_at', 'updated_at'
         ]
         read_only_fields = ['created_at', 'updated_at']
+        validators = [
+            UniqueTogetherValidator(
+                queryset=Book.objects.all(),
+                fields=['branch', 'serial_number'],
+                message='A book with this serial number already exists in this branch'
+            )
+        ]
 
     def validate_serial_number(self, value):
         if not value.isdigit() or len(value) != 6:
@@ -32,14 +53,14 @@ class BookSerializer(serializers.ModelSerializer):
         return value
 
     def get_is_available(self, obj):
-        return obj.active_checkout is None
+        return obj.active_checkout_id is None
 
     def get_current_reader(self, obj):
-        if obj.active_checkout:
+        if obj.active_checkout_id:
             return {
-                'card_number': obj.active_checkout.reader.card_number,
-                'name': obj.active_checkout.reader.name,
-                'checked_out_at': obj.active_checkout.checked_out_at
+                'card_number': obj.current_reader_card_number,
+                'name': obj.current_reader_name,
+                'checked_out_at': obj.current_checked_out_at
             }
         return None
 
@@ -48,14 +69,15 @@ class CheckoutSerializer(serializers.ModelSerializer):
     book = BookSerializer(read_only=True)
     reader = ReaderSerializer(read_only=True)
     is_active = serializers.SerializerMethodField()
+    is_overdue = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = Checkout
         fields = [
             'id', 'book', 'reader', 'checked_out_at', 
-            'returned_at', 'is_active'
+            'returned_at', 'due_at', 'is_active', 'is_overdue'
         ]
-        read_only_fields = ['checked_out_at']
+        read_only_fields = ['checked_out_at', 'due_at']
 
     def get_is_active(self, obj):
         return obj.returned_at is None
@@ -73,4 +95,145 @@ class CreateCheckoutSerializer(serializers.Serializer):
     def validate_card_number(self, value):
         if not value.isdigit() or len(value) != 6:
             raise serializers.ValidationError("Card number must be exactly 6 digits")
-        return value
\ No newline at end of file
+        return value
+
+
+class CreateHoldSerializer(CreateCheckoutSerializer):
+    pass
+
+
+class HoldSerializer(serializers.ModelSerializer):
+    book = serializers.SlugRelatedField(slug_field='serial_number', read_only=True)
+    reader = serializers.SlugRelatedField(slug_field='card_number', read_only=True)
+
+    class Meta:
+        model = Hold
+        fields = ['id', 'book', 'reader', 'status', 'created_at', 'ready_at', 'closed_at']
+        read_only_fields = fields
+
+
+class BatchGetBooksSerializer(serializers.Serializer):
+    serial_numbers = serializers.ListField(
+        child=serializers.CharField(max_length=6),
+        allow_empty=False,
+        max_length=500
+    )
+
+    def validate_serial_numbers(self, value):
+        for serial in value:
+            if not serial.isdigit() or len(serial) != 6:
+                raise serializers.ValidationError("Serial number must be exactly 6 digits")
+        return list(dict.fromkeys(value))
+
+
+class BatchGetReadersSerializer(serializers.Serializer):
+    card_numbers = serializers.ListField(
+        child=serializers.CharField(max_length=6),
+        allow_empty=False,
+        max_length=500
+    )
+
+    def validate_card_numbers(self, value):
+        for card_number in value:
+            if not card_number.isdigit() or len(card_number) != 6:
+                raise serializers.ValidationError("Card number must be exactly 6 digits")
+        return list(dict.fromkeys(value))
+
+
+class AvailabilityQuerySerializer(serializers.Serializer):
+    MAX_SERIALS = 500
+
+    serials = serializers.CharField()
+
+    def validate_serials(self, value):
+        serials = [serial.strip() for serial in value.split(',') if serial.strip()]
+        if not serials:
+            raise serializers.ValidationError("At least one serial number is required")
+        if len(serials) > self.MAX_SERIALS:
+            raise serializers.ValidationError(
+                f"At most {self.MAX_SERIALS} serial numbers can be queried at once"
+            )
+        for serial in serials:
+            if not serial.isdigit() or len(serial) != 6:
+                raise serializers.ValidationError("Serial number must be exactly 6 digits")
+        return serials
+
+
+class BookHistorySerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    card_number = serializers.CharField()
+    checked_out_at = serializers.DateTimeField()
+    due_at = serializers.DateTimeField()
+    returned_at = serializers.DateTimeField()
+
+
+class ReaderHistorySerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    serial_number = serializers.CharField()
+    checked_out_at = serializers.DateTimeField()
+    due_at = serializers.DateTimeField()
+    returned_at = serializers.DateTimeField()
+
+
+class RelatedBookSerializer(serializers.Serializer):
+    serial_number = serializers.CharField()
+    title = serializers.CharField()
+    author = serializers.CharField()
+    score = serializers.IntegerField()
+
+
+class RelatedBooksQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+
+class ChangeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Change
+        fields = ['id', 'entity', 'key', 'action', 'created_at']
+        read_only_fields = fields
+
+
+class ChangeFeedQuerySerializer(serializers.Serializer):
+    since = serializers.IntegerField(min_value=0, default=0)
+    limit = serializers.IntegerField(min_value=1, max_value=1000, default=500)
+
+
+class RequestProfileSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = RequestProfile
+        fields = [
+            'id', 'method', 'path', 'route', 'query_params', 'status_code',
+            'duration_ms', 'mode', 'sql', 'created_at'
+        ]
+        read_only_fields = fields
+
+
+class JobSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'params', 'branch', 'status', 'progress', 'total', 'result', 'error',
+            'attempts', 'created_at', 'started_at', 'finished_at'
+        ]
+        read_only_fields = fields
+
+
+class CreateJobSerializer(serializers.Serializer):
+    kind = serializers.ChoiceField(choices=get_public_kinds())
+    params = serializers.DictField(default=dict)
+
+
+class BatchSubRequestSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE'], default='GET')
+    path = serializers.RegexField(r'^/', max_length=2000)
+    headers = serializers.DictField(child=serializers.CharField(), default=dict)
+    body = serializers.JSONField(required=False, allow_null=True)
+
+
+class BatchRequestSerializer(serializers.Serializer):
+    requests = BatchSubRequestSerializer(many=True, allow_empty=False)
+
+    def validate_requests(self, value):
+        if len(value) > settings.BATCH_MAX_REQUESTS:
+            raise serializers.ValidationError(f'At most {settings.BATCH_MAX_REQUESTS} requests can be batched')
+        return value
@@ -0,0 +1,39 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .availability import availability_index
+from .models import Book, Checkout, Reader
+
+
+@receiver(post_save, sender=Book)
+def update_book_availability(sender, instance, using, **kwargs):
+    branch, serial_number = instance.branch, instance.serial_number
+    is_available = instance.active_checkout_id is None
+    transaction.on_commit(lambda: availability_index.update(branch, serial_number, is_available), using=using)
+
+
+@receiver(post_delete, sender=Book)
+def remove_book_availability(sender, instance, using, **kwargs):
+    branch, serial_number = instance.branch, instance.serial_number
+    transaction.on_commit(lambda: availability_index.remove(branch, serial_number), using=using)
+
+
+@receiver(post_delete, sender=Checkout)
+def clear_active_checkout(sender, instance, using, **kwargs):
+    # Deleting an active checkout clears Book.active_checkout through SET_NULL,
+    # which bypasses Book.save(), so the whole index has to be re-warmed and
+    # the current reader columns recomputed.
+    if instance.returned_at is None:
+        transaction.on_commit(availability_index.invalidate, using=using)
+        Book.refresh_current_reader(Book.objects.using(using).filter(id=instance.book_id))
+
+
+@receiver(post_save, sender=Reader)
+def update_current_reader(sender, instance, created, using, **kwargs):
+    # Keeps the card number and name copied onto borrowed books in sync
+    if not created:
+        Book.objects.using(using).filter(current_reader=instance).update(
+            current_reader_card_number=instance.card_number,
+            current_reader_name=instance.name
+        )
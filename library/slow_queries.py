@@ -0,0 +1,183 @@
+"""
+Slow query log.
+
+SlowQueryMiddleware times the queries a request runs on every database.
+Queries slower than SLOW_QUERY_THRESHOLD_MS are logged and, once the view has
+returned, stored as SlowQuery rows with their bound parameters and the
+viewset action that ran them. Queries are grouped by a fingerprint of their
+SQL with literals and parameter lists normalized away, so the same filter
+combination lands in one group whatever values it was called with.
+
+The first slow occurrence of a fingerprint in a process, and then one every
+SLOW_QUERY_EXPLAIN_INTERVAL seconds, also gets its plan captured by an
+explain_slow_query job, off the request: EXPLAIN (ANALYZE, BUFFERS) on
+PostgreSQL, which runs the query again in a read-only transaction under
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS, and EXPLAIN QUERY PLAN on SQLite. Only plain
+SELECT statements are explained, and those calling functions with side
+effects are only planned, not run. The slow_queries command reports them.
+"""
+
+import hashlib
+import logging
+import re
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError, connections, transaction
+
+from .models import SlowQuery
+
+logger = logging.getLogger(__name__)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+VALUE_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)*\s*\)')
+WHITESPACE = re.compile(r'\s+')
+# Functions with side effects, which EXPLAIN ANALYZE would call again
+UNSAFE_FUNCTION = re.compile(
+    r'\b(?:pg_notify|nextval|setval|set_config|pg_(?:try_)?advisory_\w+|pg_sleep\w*|lo_\w+|dblink\w*'
+    r'|pg_cancel_backend|pg_terminate_backend|pg_reload_conf|pg_rotate_logfile)\s*\(',
+    re.IGNORECASE
+)
+
+_explained = {}
+_explained_lock = threading.Lock()
+
+
+def normalize(sql):
+    sql = STRING_LITERAL.sub('?', sql)
+    sql = NUMBER_LITERAL.sub('?', sql)
+    sql = VALUE_LIST.sub('(...)', sql.replace('%s', '?'))
+    return WHITESPACE.sub(' ', sql).strip()
+
+
+def fingerprint(sql):
+    return hashlib.sha1(normalize(sql).encode()).hexdigest()[:16]
+
+
+@contextmanager
+def capture(threshold_ms):
+    """Collects (database, sql, params, duration_ms) of the queries slower than threshold_ms."""
+    captured = []
+
+    def timer(alias):
+        def time_query(execute, sql, params, many, context):
+            started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                duration_ms = (time.perf_counter() - started) * 1000
+                # Bulk statements run once per parameter set and have no single plan
+                if duration_ms >= threshold_ms and not many:
+                    captured.append((alias, sql, params, duration_ms))
+        return time_query
+
+    with ExitStack() as stack:
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(timer(alias)))
+        yield captured
+
+
+def should_explain(query_fingerprint):
+    now = time.monotonic()
+    with _explained_lock:
+        last = _explained.get(query_fingerprint)
+        if last is not None and now - last < settings.SLOW_QUERY_EXPLAIN_INTERVAL:
+            return False
+        if len(_explained) >= 10000:
+            _explained.clear()
+        _explained[query_fingerprint] = now
+        return True
+
+
+def explain(alias, sql, params):
+    """Returns the plan of a SELECT statement, or an empty string if it cannot be explained."""
+    statement = sql.lstrip().upper()
+    # EXPLAIN ANALYZE runs the statement, which must not write or take locks
+    if not statement.startswith('SELECT') or ' FOR UPDATE' in statement or ' FOR SHARE' in statement:
+        return ''
+
+    connection = connections[alias]
+    try:
+        with transaction.atomic(using=alias), connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute('SET TRANSACTION READ ONLY')
+                cursor.execute(f'SET LOCAL statement_timeout = {int(settings.SLOW_QUERY_EXPLAIN_TIMEOUT_MS)}')
+                options = 'COSTS' if UNSAFE_FUNCTION.search(sql) else 'ANALYZE, BUFFERS'
+                cursor.execute(f'EXPLAIN ({options}) {sql}', params)
+                return '\n'.join(line for line, in cursor.fetchall())
+            if connection.vendor == 'sqlite':
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+                depths = {}
+                lines = []
+                for node_id, parent_id, _, detail in cursor.fetchall():
+                    depths[node_id] = depths.get(parent_id, -1) + 1
+                    lines.append(f"{'  ' * depths[node_id]}{detail}")
+                return '\n'.join(lines)
+    except DatabaseError:
+        logger.warning('Could not explain slow query', exc_info=True)
+    return ''
+
+
+def get_view_name(request):
+    """Returns "<ViewSet>.<action>" for viewsets, the URL name for other views."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return ''
+    viewset = getattr(match.func, 'cls', None)
+    actions = getattr(match.func, 'actions', None)
+    if viewset is not None and actions:
+        method = request.method.lower()
+        return f'{viewset.__name__}.{actions.get(method, method)}'[:100]
+    return (match.url_name or match.view_name)[:100]
+
+
+def to_json(value):
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, dict):
+        return {str(key): to_json(item) for key, item in value.items()}
+    return str(value)
+
+
+def record(request, captured):
+    """Logs and stores the slow queries captured during a request; returns those whose plan should be captured."""
+    view = get_view_name(request)
+    query_params = {key: request.GET.getlist(key) for key in request.GET}
+    slow_queries = []
+    to_explain = []
+    for alias, sql, params, duration_ms in captured:
+        query_fingerprint = fingerprint(sql)
+        logger.warning(
+            'Slow query (%.0f ms, %s) in %s %s: %s',
+            duration_ms, query_fingerprint, request.method, view or request.path, sql
+        )
+        slow_query = SlowQuery(
+            fingerprint=query_fingerprint,
+            sql=sql,
+            params=to_json(params) or [],
+            database=alias,
+            duration_ms=duration_ms,
+            method=request.method,
+            path=request.path,
+            view=view,
+            query_params=query_params,
+        )
+        slow_queries.append(slow_query)
+        if should_explain(query_fingerprint):
+            to_explain.append(slow_query)
+    SlowQuery.objects.bulk_create(slow_queries)
+    SlowQuery.objects.keep_latest(settings.SLOW_QUERY_MAX_ROWS)
+    return to_explain
+
+
+def capture_plan(slow_query_id):
+    """Explains a stored slow query again and stores its plan."""
+    slow_query = SlowQuery.objects.filter(id=slow_query_id).first()
+    if slow_query is not None:
+        slow_query.plan = explain(slow_query.database, slow_query.sql, slow_query.params)
+        slow_query.save(update_fields=['plan'])
@@ -0,0 +1,22 @@
+from django.test.runner import DiscoverRunner
+
+
+class LibraryTestRunner(DiscoverRunner):
+    """
+    Test runner that skips tests tagged "large", which build datasets of
+    100k+ rows, unless --large is passed or they are selected with --tag large.
+    """
+
+    def __init__(self, large=False, **kwargs):
+        super().__init__(**kwargs)
+        if not large and 'large' not in self.tags:
+            self.exclude_tags.add('large')
+
+    @classmethod
+    def add_arguments(cls, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            '--large',
+            action='store_true',
+            help='Also run tests tagged "large" against datasets of 100k+ rows'
+        )
@@ -1,10 +1,45 @@
+import marshal
+import tempfile
+import time
+from datetime import timedelta
+import asyncio
+import threading
 from io import StringIO
-from rest_framework.test import APITestCase
+from pathlib import Path
+from rest_framework.test import APITestCase, APITransactionTestCase
 from rest_framework import status
+from rest_framework.parsers import MultiPartParser
+from rest_framework.request import Request
 from django.urls import reverse
 from django.core.management import call_command
-from django.test import TestCase
-from .models import Book, Reader, Checkout
+from django.core.management.base import CommandError
+from django.test.client import encode_multipart
+from django.test import TestCase, SimpleTestCase, RequestFactory, override_settings, tag
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.http import HttpResponse
+from django.utils import timezone
+from unittest import skipUnless
+from unittest.mock import patch
+from django.conf import settings
+from .models import Book, Reader, Checkout, Hold, Change, IdempotencyKey, RequestProfile, BookRelation, Job, SlowQuery
+from .availability import AvailabilityIndex, availability_index
+from .events import InMemoryBroker, PostgresBroker, get_broker, publish_availability
+from .filters import CachedFilterSet, BookFilter
+from .jobs import Worker, claim_jobs, enqueue, requeue_stale_jobs
+from .recommendations import build_relations, record_checkout
+from .middleware import LoadSheddingMiddleware
+from .throttling import SharedMemoryBuckets, get_buckets
+from .pagination import HistoryPagination
+from .profiling import make_token
+from . import batch
+from . import slow_queries
+from . import metrics
+from .factories import create_books, create_readers, create_loans, create_library
+from .branches import BranchRouter, use_branch
+from .views import CheckoutViewSet
+from .idempotency import get_fingerprint
 
 
 class BookAPITest(APITestCase):
@@ -48,13 +83,8 @@ class BookAPITest(APITestCase):
     def test_list_books_with_pagination(self):
         """Test listing books with pagination"""
         # Create more books for pagination
-        for i in range(60):
-            Book.objects.create(
-                serial_number=f'{100000 + i}',
-                title=f'Book {i}',
-                author=f'Author {i}'
-            )
-        
+        create_books(60)
+
         url = reverse('book-list')
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -66,7 +96,7 @@ class BookAPITest(APITestCase):
         # Create a checkout for book1
         reader = Reader.objects.create(card_number='111111', name='Test Reader')
         checkout = Checkout.objects.create(book=self.book1, reader=reader)
-        self.book1.active_checkout = checkout
+        self.book1.set_active_checkout(checkout)
         self.book1.save()
         
         url = reverse('book-list')
@@ -80,6 +110,53 @@ class BookAPITest(APITestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['serial_number'], '123456')
         
+    def test_filter_books_by_serial_numbers(self):
+        """Test filtering books by a list of serial numbers"""
+        url = reverse('book-list')
+        response = self.client.get(url, {'serial_number__in': '123456,999999'})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['serial_number'], '123456')
+
+    def test_batch_get_books(self):
+        """Test batch retrieval with explicit not-found entries"""
+        url = reverse('book-batch-get')
+        data = {'serial_numbers': ['234567', '123456', '999999']}
+        with self.assertNumQueries(1):
+            response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(list(response.data), ['234567', '123456', '999999'])
+        self.assertEqual(response.data['123456']['title'], 'Test Book 1')
+        self.assertIsNone(response.data['999999'])
+
+    def test_batch_get_books_invalid_serial(self):
+        """Test batch retrieval rejects malformed serial numbers"""
+        url = reverse('book-batch-get')
+        response = self.client.post(url, {'serial_numbers': ['12345']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_repeated_filters_use_cached_values(self):
+        """Test that repeated filter parameters reuse validated values"""
+        CachedFilterSet.clear_cache()
+        url = reverse('book-list')
+        response = self.client.get(url, {'title': 'book 1', 'page': 1})
+        self.assertEqual(len(response.data['results']), 1)
+
+        filterset = BookFilter({'title': 'book 1'}, Book.objects.all())
+        self.assertIsNotNone(filterset.get_cached_cleaned_data())
+        response = self.client.get(url, {'title': 'book 1'})
+        self.assertEqual(response.data['results'][0]['serial_number'], '123456')
+
+        response = self.client.get(url, {'title': 'book 2'})
+        self.assertEqual(response.data['results'][0]['serial_number'], '234567')
+
+    def test_invalid_filters_are_not_cached(self):
+        """Test that invalid filter parameters are rejected every time"""
+        CachedFilterSet.clear_cache()
+        url = reverse('book-list')
+        for _ in range(2):
+            response = self.client.get(url, {'current_reader': 'abc'})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
     def test_delete_book_cascades_checkouts(self):
         """Test that deleting a book deletes all its checkouts"""
         reader = Reader.objects.create(card_number='222222', name='Reader')
@@ -95,6 +172,96 @@ class BookAPITest(APITestCase):
         self.assertEqual(Checkout.objects.count(), 0)
 
 
+class BookAvailabilityTest(APITestCase):
+    def setUp(self):
+        availability_index.invalidate()
+        self.book = Book.objects.create(
+            serial_number='123456',
+            title='Test Book',
+            author='Author'
+        )
+        self.reader = Reader.objects.create(card_number='111111', name='Reader')
+
+    def test_availability_batch_lookup(self):
+        """Test batch availability lookup with unknown serials"""
+        Book.objects.create(serial_number='234567', title='Other', author='Author')
+        checkout = Checkout.objects.create(book=self.book, reader=self.reader)
+        self.book.set_active_checkout(checkout)
+        self.book.save()
+
+        url = reverse('book-availability')
+        response = self.client.get(url, {'serials': '123456,234567,999999'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data, {'123456': False, '234567': True, '999999': None})
+
+    def test_availability_follows_checkout_and_return(self):
+        """Test that the warmed index is updated by checkout and return"""
+        url = reverse('book-availability')
+        response = self.client.get(url, {'serials': '123456'})
+        self.assertTrue(response.data['123456'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('checkout-checkout'),
+                {'book_serial': '123456', 'card_number': '111111'},
+                format='json'
+            )
+        with self.assertNumQueries(0):
+            response = self.client.get(url, {'serials': '123456'})
+        self.assertFalse(response.data['123456'])
+
+        checkout_id = Checkout.objects.get().id
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('checkout-return-book', kwargs={'pk': checkout_id}))
+        response = self.client.get(url, {'serials': '123456'})
+        self.assertTrue(response.data['123456'])
+
+    def test_updates_during_warm_are_reapplied(self):
+        """Test that a change committed while the index is warming is not lost"""
+        index = AvailabilityIndex()
+        scan = index._scan
+
+        def scan_then_checkout():
+            branches = scan()
+            index.update('main', '123456', False)
+            return branches
+
+        with patch.object(index, '_scan', side_effect=scan_then_checkout):
+            index.warm()
+        self.assertEqual(index.lookup('main', ['123456']), {'123456': False})
+
+    def test_index_follows_broker_events(self):
+        """Test that availability events of other processes update the index without a re-scan"""
+        index = AvailabilityIndex()
+        index.warm()
+        self.addCleanup(get_broker().remove_listener, index._on_event)
+
+        # A checkout handled by another worker, relayed by the broker
+        get_broker().deliver(
+            {'type': 'availability', 'branch': 'main', 'serial_number': '123456', 'is_available': False}
+        )
+        with self.assertNumQueries(0):
+            self.assertEqual(index.lookup('main', ['123456']), {'123456': False})
+
+    def test_stale_index_is_warmed_in_background(self):
+        """Test that lookups on a stale index do not wait for the warm"""
+        index = AvailabilityIndex()
+        index.warm()
+        with override_settings(AVAILABILITY_INDEX_TTL=-1), \
+                patch.object(index, 'warm_in_background') as warm_in_background, \
+                self.assertNumQueries(0):
+            self.assertEqual(index.lookup('main', ['123456']), {'123456': True})
+        warm_in_background.assert_called_once()
+
+    def test_availability_invalid_serials(self):
+        """Test that malformed serial lists are rejected"""
+        url = reverse('book-availability')
+        response = self.client.get(url, {'serials': '123,abcdef'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
 class ReaderAPITest(APITestCase):
     def setUp(self):
         self.reader1 = Reader.objects.create(
@@ -118,6 +285,15 @@ class ReaderAPITest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(Reader.objects.count(), 2)
         
+    def test_batch_get_readers(self):
+        """Test batch retrieval of readers by card number"""
+        url = reverse('reader-batch-get')
+        data = {'card_numbers': ['111111', '999999']}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['111111']['name'], 'Reader One')
+        self.assertIsNone(response.data['999999'])
+
     def test_delete_reader_cascades_checkouts(self):
         """Test that deleting a reader deletes their checkouts"""
         checkout = Checkout.objects.create(book=self.book, reader=self.reader1)
@@ -133,7 +309,7 @@ class ReaderAPITest(APITestCase):
     def test_delete_reader_clears_book_active_checkout(self):
         """Test that deleting a reader clears the active_checkout in book"""
         checkout = Checkout.objects.create(book=self.book, reader=self.reader1)
-        self.book.active_checkout = checkout
+        self.book.set_active_checkout(checkout)
         self.book.save()
         
         url = reverse('reader-detail', kwargs={'card_number': '111111'})
@@ -178,7 +354,7 @@ class CheckoutAPITest(APITestCase):
         """Test checking out an already borrowed book"""
         # First checkout
         checkout = Checkout.objects.create(book=self.book1, reader=self.reader)
-        self.book1.active_checkout = checkout
+        self.book1.set_active_checkout(checkout)
         self.book1.save()
         
         # Create another reader for the second checkout attempt
@@ -224,7 +400,7 @@ class CheckoutAPITest(APITestCase):
         """Test successful book return"""
         # Create active checkout
         checkout = Checkout.objects.create(book=self.book1, reader=self.reader)
-        self.book1.active_checkout = checkout
+        self.book1.set_active_checkout(checkout)
         self.book1.save()
         
         url = reverse('checkout-return-book', kwargs={'pk': checkout.id})
@@ -256,7 +432,7 @@ class CheckoutAPITest(APITestCase):
         """Test listing checkouts with various filters"""
         # Create checkouts
         checkout1 = Checkout.objects.create(book=self.book1, reader=self.reader)
-        self.book1.active_checkout = checkout1
+        self.book1.set_active_checkout(checkout1)
         self.book1.save()
         
         from django.utils import timezone
@@ -277,6 +453,737 @@ class CheckoutAPITest(APITestCase):
         response = self.client.get(url, {'reader': '111111'})
         self.assertEqual(len(response.data['results']), 2)
 
+    def test_filter_overdue_checkouts(self):
+        """Test filtering active loans past their due date"""
+        from django.utils import timezone
+        overdue = Checkout.objects.create(
+            book=self.book1,
+            reader=self.reader,
+            due_at=timezone.now() - timedelta(days=1)
+        )
+        Checkout.objects.create(book=self.book2, reader=self.reader)
+        Checkout.objects.create(
+            book=self.book2,
+            reader=self.reader,
+            due_at=timezone.now() - timedelta(days=1),
+            returned_at=timezone.now()
+        )
+
+        url = reverse('checkout-list')
+        response = self.client.get(url, {'overdue': 'true'})
+        self.assertEqual(len(response.data['results']), 1)
+        self.assertEqual(response.data['results'][0]['id'], overdue.id)
+        self.assertTrue(response.data['results'][0]['is_overdue'])
+
+        response = self.client.get(url, {'overdue': 'false'})
+        self.assertEqual(len(response.data['results']), 2)
+
+
+class CurrentReaderTest(APITestCase):
+    def setUp(self):
+        self.book = Book.objects.create(serial_number='123456', title='Book', author='Author')
+        self.reader = Reader.objects.create(card_number='111111', name='Reader')
+        response = self.client.post(
+            reverse('checkout-checkout'),
+            {'book_serial': '123456', 'card_number': '111111'},
+            format='json'
+        )
+        self.checkout_id = response.data['id']
+
+    def test_book_list_reads_a_single_table(self):
+        """Test that book lists show the current reader without joining checkouts"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('book-list'), {'current_reader': self.reader.id})
+        self.assertEqual(response.data['count'], 1)
+        self.assertEqual(response.data['results'][0]['current_reader']['card_number'], '111111')
+        self.assertEqual(response.data['results'][0]['current_reader']['name'], 'Reader')
+        self.assertTrue(all('JOIN' not in query['sql'] for query in queries))
+
+    def test_columns_follow_returns_and_reader_changes(self):
+        """Test that the copied reader columns are updated on rename, return and delete"""
+        self.reader.name = 'Renamed'
+        self.reader.save()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.current_reader_name, 'Renamed')
+
+        self.client.post(reverse('checkout-return-book', args=[self.checkout_id]))
+        self.book.refresh_from_db()
+        self.assertIsNone(self.book.current_reader)
+        self.assertEqual(self.book.current_reader_card_number, '')
+
+        Checkout.objects.filter(id=self.checkout_id).update(returned_at=None)
+        Book.objects.filter(id=self.book.id).update(active_checkout=self.checkout_id)
+        Book.refresh_current_reader(Book.objects.all())
+        self.client.delete(reverse('reader-detail', args=['111111']))
+        self.book.refresh_from_db()
+        self.assertIsNone(self.book.active_checkout)
+        self.assertEqual(self.book.current_reader_name, '')
+        self.assertIsNone(self.book.current_checked_out_at)
+
+    def test_consistency_check_command(self):
+        """Test that check_current_reader reports and fixes stale columns"""
+        call_command('check_current_reader', stdout=StringIO())
+        Book.objects.update(current_reader_name='Stale')
+
+        with self.assertRaises(CommandError):
+            call_command('check_current_reader', stdout=StringIO())
+        out = StringIO()
+        call_command('check_current_reader', fix=True, stdout=out)
+        self.assertIn('Fixed 1 books', out.getvalue())
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.current_reader_name, 'Reader')
+
+
+class RecommendationsTest(APITestCase):
+    def setUp(self):
+        self.books = create_books(4)
+        self.readers = create_readers(4)
+        history = {0: [0, 1, 2], 1: [0, 1], 2: [0, 3], 3: [2]}
+        for reader, books in history.items():
+            for book in books:
+                Checkout.objects.create(
+                    book=self.books[book], reader=self.readers[reader], returned_at=timezone.now()
+                )
+
+    def related(self, book, **params):
+        response = self.client.get(reverse('book-related', args=[self.books[book].serial_number]), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [(row['serial_number'], row['score']) for row in response.data]
+
+    def test_build_recommendations(self):
+        """Test that related books are ranked by the number of readers who borrowed both"""
+        call_command('build_recommendations', stdout=StringIO())
+        self.assertEqual(self.related(0), [('100001', 2), ('100002', 1), ('100003', 1)])
+        self.assertEqual(self.related(0, limit=1), [('100001', 2)])
+        self.assertEqual(self.related(3), [('100000', 1)])
+
+        call_command('build_recommendations', top_k=1, stdout=StringIO())
+        self.assertEqual(BookRelation.objects.filter(book=self.books[0]).count(), 1)
+
+    def test_relations_are_built_in_passes(self):
+        """Test that building a few books per pass stores the same relations"""
+        with use_branch('main'):
+            build_relations()
+            expected = set(BookRelation.objects.values_list('book_id', 'related_book_id', 'score'))
+            done = []
+            self.assertEqual(build_relations(books_per_pass=3, progress=lambda *args: done.append(args)), len(expected))
+        self.assertEqual(set(BookRelation.objects.values_list('book_id', 'related_book_id', 'score')), expected)
+        self.assertEqual(done, [(0, 4), (3,), (4,)])
+
+    def test_checkouts_update_relations(self):
+        """Test that a reader's first loan of a book updates the stored relations"""
+        call_command('build_recommendations', stdout=StringIO())
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post(
+                    reverse('checkout-checkout'),
+                    {'book_serial': '100000', 'card_number': '100003'},
+                    format='json'
+                )
+            self.client.post(reverse('checkout-return-book', args=[response.data['id']]))
+
+        # The relations are updated by the worker, which leaves no finished jobs behind
+        self.assertEqual(self.related(0), [('100001', 2), ('100002', 1), ('100003', 1)])
+        self.assertEqual(Job.objects.filter(kind='record_checkout').count(), 2)
+        call_command('run_jobs', '--once', '--processes', '0', stdout=StringIO())
+        self.assertFalse(Job.objects.exists())
+
+        self.assertEqual(self.related(0), [('100001', 2), ('100002', 2), ('100003', 1)])
+        self.assertEqual(self.related(2), [('100000', 2), ('100001', 1)])
+
+    @override_settings(RECOMMENDATIONS_MAX_PAIRS_PER_CHECKOUT=1)
+    def test_checkout_pairs_are_capped(self):
+        """Test that a new loan is only paired with the reader's most recent books"""
+        # Reader 100000 borrowed books 0, 1 and 2, the last of them most recently
+        Checkout.objects.filter(reader=self.readers[0], book=self.books[2]).update(
+            checked_out_at=timezone.now() + timedelta(minutes=1)
+        )
+        checkout = Checkout.objects.create(book=self.books[3], reader=self.readers[0], returned_at=timezone.now())
+        record_checkout(checkout.id)
+        self.assertEqual(
+            set(BookRelation.objects.filter(book=self.books[3]).values_list('related_book_id', 'score')),
+            {(self.books[2].id, 1)}
+        )
+
+    def test_related_unknown_book(self):
+        """Test that related books of a missing book return 404"""
+        response = self.client.get(reverse('book-related', args=['999999']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class BranchRouterTest(SimpleTestCase):
+    @override_settings(BRANCH_DATABASES={'north': 'branch_north'})
+    def test_routes_branch_data_to_branch_database(self):
+        """Test that branch data follows the current branch and loaded rows stay in their database"""
+        router = BranchRouter()
+        self.assertEqual(router.db_for_read(Book), 'default')
+        with use_branch('north'):
+            self.assertEqual(router.db_for_read(Book), 'branch_north')
+            self.assertEqual(router.db_for_write(Hold), 'branch_north')
+            self.assertEqual(router.db_for_write(Change), 'branch_north')
+            self.assertIsNone(router.db_for_write(IdempotencyKey))
+
+            book = Book(branch='main')
+            self.assertEqual(router.db_for_write(Book, instance=book), 'default')
+            book._state.db = 'other'
+            self.assertEqual(router.db_for_read(Checkout, instance=book), 'other')
+        self.assertEqual(router.db_for_write(Book, instance=Book(branch='north')), 'branch_north')
+
+
+@override_settings(LIBRARY_BRANCHES=['main', 'north'])
+class BranchAPITest(APITestCase):
+    def setUp(self):
+        create_books(1, start=100000)
+        create_readers(1, start=100000)
+        create_books(1, start=200000, branch='north')
+        create_readers(1, start=200000, branch='north')
+
+    def test_resources_are_scoped_to_branch(self):
+        """Test that lists, lookups and new rows belong to the requested branch"""
+        response = self.client.get(reverse('book-list'))
+        self.assertEqual([book['serial_number'] for book in response.data['results']], ['100000'])
+        response = self.client.get(reverse('book-list'), {'branch': 'north'})
+        self.assertEqual([book['serial_number'] for book in response.data['results']], ['200000'])
+        response = self.client.get(reverse('reader-detail', args=['200000']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.post(
+            reverse('book-list'),
+            {'serial_number': '200001', 'title': 'Book', 'author': 'Author'},
+            format='json',
+            HTTP_X_BRANCH='north'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Book.objects.get(serial_number='200001').branch, 'north')
+
+    def test_checkout_within_branch(self):
+        """Test that a branch can only lend its own books to its own readers"""
+        url = reverse('checkout-checkout')
+        response = self.client.post(url, {'book_serial': '200000', 'card_number': '100000'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        response = self.client.post(
+            url, {'book_serial': '200000', 'card_number': '200000'}, format='json', HTTP_X_BRANCH='north'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Checkout.objects.get().branch, 'north')
+        self.assertEqual(self.client.get(reverse('checkout-list')).data['count'], 0)
+
+    @override_settings(CHANGE_FEED_VISIBILITY_LAG=0)
+    def test_serial_and_card_numbers_are_unique_per_branch(self):
+        """Test that branches may reuse serial numbers and keep separate change feeds and availability"""
+        data = {'serial_number': '100000', 'title': 'Book', 'author': 'Author'}
+        response = self.client.post(reverse('book-list'), data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(reverse('book-list'), data, format='json', HTTP_X_BRANCH='north')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(
+            reverse('reader-list'), {'card_number': '100000', 'name': 'Reader'}, format='json', HTTP_X_BRANCH='north'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('checkout-checkout'), {'book_serial': '100000', 'card_number': '100000'},
+                format='json', HTTP_X_BRANCH='north'
+            )
+
+        response = self.client.get(reverse('change-list'))
+        self.assertEqual(response.data['results'], [])
+        response = self.client.get(reverse('change-list'), HTTP_X_BRANCH='north')
+        self.assertEqual(
+            [(change['entity'], change['key'], change['action']) for change in response.data['results']],
+            [('book', '100000', 'created'), ('reader', '100000', 'created'), ('book', '100000', 'checked_out')]
+        )
+        self.assertEqual(set(Change.objects.values_list('branch', flat=True)), {'north'})
+
+        url = reverse('book-availability')
+        self.assertEqual(self.client.get(url, {'serials': '100000'}).data, {'100000': True})
+        self.assertEqual(self.client.get(url, {'serials': '100000'}, HTTP_X_BRANCH='north').data, {'100000': False})
+
+    def test_sweep_overdue_covers_every_branch(self):
+        """Test that the overdue sweep marks the loans of every branch, or only the chosen one"""
+        for branch in ['main', 'north']:
+            Checkout.objects.create(
+                branch=branch, book=Book.objects.get(branch=branch), reader=Reader.objects.get(branch=branch),
+                due_at=timezone.now() - timedelta(days=1)
+            )
+
+        out = StringIO()
+        call_command('sweep_overdue', branch='north', stdout=out)
+        self.assertIn('Marked 1 overdue loans in branch north', out.getvalue())
+        self.assertEqual(Checkout.objects.get(branch='main').overdue_notified_at, None)
+
+        call_command('sweep_overdue', stdout=out)
+        self.assertIn('Marked 1 overdue loans in branch main', out.getvalue())
+        self.assertIn('Marked 0 overdue loans in branch north', out.getvalue())
+        self.assertFalse(Checkout.objects.filter(overdue_notified_at__isnull=True).exists())
+
+    def test_unknown_branch(self):
+        """Test that requests for an unknown branch are rejected"""
+        response = self.client.get(reverse('book-list'), HTTP_X_BRANCH='south')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.json(), {'error': 'Unknown branch: south'})
+
+
+@skipUnless(
+    'north' in settings.BRANCH_DATABASES,
+    'Run alone with BRANCH_DATABASES="north=sqlite:////tmp/north.db" LIBRARY_BRANCHES=main,north'
+)
+class BranchDatabaseTest(APITestCase):
+    databases = {'default', *settings.BRANCH_DATABASES.values()}
+
+    def test_branch_rows_are_stored_in_branch_database(self):
+        """Test that a branch placed on its own database keeps its books, readers and loans there"""
+        headers = {'HTTP_X_BRANCH': 'north'}
+        self.client.post(
+            reverse('book-list'), {'serial_number': '200000', 'title': 'Book', 'author': 'Author'},
+            format='json', **headers
+        )
+        self.client.post(reverse('reader-list'), {'card_number': '200000', 'name': 'Reader'}, format='json', **headers)
+        response = self.client.post(
+            reverse('checkout-checkout'), {'book_serial': '200000', 'card_number': '200000'},
+            format='json', **headers
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertFalse(Book.objects.using('default').exists())
+        self.assertFalse(Change.objects.using('default').exists())
+        self.assertEqual(Checkout.objects.using('branch_north').get().book.serial_number, '200000')
+        self.assertEqual(Change.objects.using('branch_north').count(), 3)
+        response = self.client.get(reverse('book-detail', args=['200000']), **headers)
+        self.assertFalse(response.data['is_available'])
+        self.assertEqual(response.data['current_reader']['card_number'], '200000')
+
+    def test_sweep_overdue_covers_branch_database(self):
+        """Test that the overdue sweep also marks loans stored in a branch database"""
+        with use_branch('north'):
+            book = Book.objects.create(branch='north', serial_number='200000', title='Book', author='Author')
+            reader = Reader.objects.create(branch='north', card_number='200000', name='Reader')
+            Checkout.objects.create(branch='north', book=book, reader=reader, due_at=timezone.now() - timedelta(days=1))
+
+        call_command('sweep_overdue', stdout=StringIO())
+        self.assertIsNotNone(Checkout.objects.using('branch_north').get().overdue_notified_at)
+
+
+class HistoryAPITest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = Book.objects.create(serial_number='123456', title='Book', author='Author')
+        cls.other_book = Book.objects.create(serial_number='234567', title='Other', author='Author')
+        cls.reader = Reader.objects.create(card_number='111111', name='Reader')
+        cls.other_reader = Reader.objects.create(card_number='222222', name='Other')
+        now = timezone.now()
+        for days, book, reader in [
+            (3, cls.book, cls.reader),
+            (2, cls.book, cls.other_reader),
+            (1, cls.other_book, cls.reader),
+        ]:
+            checkout = Checkout.objects.create(book=book, reader=reader, returned_at=now)
+            Checkout.objects.filter(pk=checkout.pk).update(checked_out_at=now - timedelta(days=days))
+
+    def test_book_history(self):
+        """Test that book history lists compact loan rows, newest first"""
+        response = self.client.get(reverse('book-history', args=['123456']))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['card_number'] for row in response.data['results']], ['222222', '111111'])
+        self.assertEqual(
+            set(response.data['results'][0]),
+            {'id', 'card_number', 'checked_out_at', 'due_at', 'returned_at'}
+        )
+
+    def test_reader_history_is_keyset_paginated(self):
+        """Test that reader history pages are linked by cursors"""
+        with patch.object(HistoryPagination, 'page_size', 1):
+            response = self.client.get(reverse('reader-history', args=['111111']))
+            self.assertEqual([row['serial_number'] for row in response.data['results']], ['234567'])
+            self.assertNotIn('count', response.data)
+
+            # The reader, the page from the history index and the serial numbers of its books
+            with self.assertNumQueries(3):
+                response = self.client.get(response.data['next'])
+            self.assertEqual([row['serial_number'] for row in response.data['results']], ['123456'])
+            self.assertIsNone(response.data['next'])
+
+    def test_history_unknown_book(self):
+        """Test that history of a missing book returns 404"""
+        response = self.client.get(reverse('book-history', args=['999999']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class IdempotencyTest(APITestCase):
+    def setUp(self):
+        self.book = Book.objects.create(serial_number='123456', title='Book', author='Author')
+        self.reader = Reader.objects.create(card_number='111111', name='Reader')
+        self.url = reverse('checkout-checkout')
+        self.data = {'book_serial': '123456', 'card_number': '111111'}
+
+    def test_retried_checkout_is_replayed(self):
+        """Test that a retry with the same key replays the first response"""
+        first = self.client.post(self.url, self.data, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        with self.assertNumQueries(1):
+            retry = self.client.post(self.url, self.data, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Checkout.objects.count(), 1)
+
+    def test_retried_return_is_replayed(self):
+        """Test that a retried return does not fail as already returned"""
+        checkout_id = self.client.post(self.url, self.data, format='json').data['id']
+        url = reverse('checkout-return-book', kwargs={'pk': checkout_id})
+        first = self.client.post(url, HTTP_IDEMPOTENCY_KEY='ret')
+        retry = self.client.post(url, HTTP_IDEMPOTENCY_KEY='ret')
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+    def test_key_reused_for_different_request(self):
+        """Test that a key cannot be reused with a different body"""
+        Reader.objects.create(card_number='222222', name='Other')
+        self.client.post(self.url, self.data, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        data = {'book_serial': '123456', 'card_number': '222222'}
+        response = self.client.post(self.url, data, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+    def test_form_fingerprint_ignores_encoding(self):
+        """Test that form requests are fingerprinted by their data, even once it was read"""
+        fingerprints = set()
+        for boundary in ['first', 'second']:
+            request = Request(
+                RequestFactory().post(
+                    self.url, encode_multipart(boundary, self.data),
+                    content_type=f'multipart/form-data; boundary={boundary}'
+                ),
+                parsers=[MultiPartParser()]
+            )
+            self.assertEqual(request.data['card_number'], '111111')
+            fingerprints.add(get_fingerprint(request))
+        self.assertEqual(len(fingerprints), 1)
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0)
+    def test_in_flight_key_conflicts(self):
+        """Test that a duplicate of an unfinished request is not executed"""
+        from django.utils import timezone
+        self.client.post(self.url, self.data, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        IdempotencyKey.objects.update(status_code=None, response_body=None)
+
+        response = self.client.post(self.url, self.data, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        out = StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('Deleted 1 expired', out.getvalue())
+
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0)
+    def test_expired_claim_is_taken_over(self):
+        """Test that a retry takes over a key whose request stopped without answering"""
+        self.client.post(self.url, self.data, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        # The first request died before committing or storing its response
+        Checkout.objects.all().delete()
+        IdempotencyKey.objects.update(
+            status_code=None, response_body=None, claimed_at=timezone.now() - timedelta(seconds=59)
+        )
+        response = self.client.post(self.url, self.data, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        IdempotencyKey.objects.update(claimed_at=timezone.now() - timedelta(seconds=61))
+        response = self.client.post(self.url, self.data, format='json', HTTP_IDEMPOTENCY_KEY='abc')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(IdempotencyKey.objects.get().status_code, status.HTTP_201_CREATED)
+
+    def test_keys_are_scoped_per_client(self):
+        """Test that clients choosing the same key do not see each other's responses"""
+        Reader.objects.create(card_number='222222', name='Other')
+        Book.objects.create(serial_number='234567', title='Other', author='Author')
+        first = self.client.post(
+            self.url, self.data, format='json', HTTP_IDEMPOTENCY_KEY='1', REMOTE_ADDR='10.0.0.1'
+        )
+        second = self.client.post(
+            self.url, {'book_serial': '234567', 'card_number': '222222'}, format='json',
+            HTTP_IDEMPOTENCY_KEY='1', REMOTE_ADDR='10.0.0.2'
+        )
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(second.status_code, status.HTTP_201_CREATED)
+        self.assertNotEqual(first.data['id'], second.data['id'])
+        self.assertEqual(
+            set(IdempotencyKey.objects.values_list('client', flat=True)), {'address:10.0.0.1', 'address:10.0.0.2'}
+        )
+
+
+class HoldAPITest(APITestCase):
+    def setUp(self):
+        self.book = Book.objects.create(
+            serial_number='123456',
+            title='Popular Book',
+            author='Author'
+        )
+        self.borrower = Reader.objects.create(card_number='111111', name='Borrower')
+        self.first = Reader.objects.create(card_number='222222', name='First')
+        self.second = Reader.objects.create(card_number='333333', name='Second')
+        self.checkout = Checkout.objects.create(book=self.book, reader=self.borrower)
+        self.book.set_active_checkout(self.checkout)
+        self.book.save()
+
+    def place_hold(self, card_number):
+        url = reverse('hold-list')
+        data = {'book_serial': '123456', 'card_number': card_number}
+        return self.client.post(url, data, format='json')
+
+    def test_place_hold_on_checked_out_book(self):
+        """Test placing a hold and rejecting a duplicate one"""
+        response = self.place_hold('222222')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['status'], Hold.WAITING)
+
+        response = self.place_hold('222222')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('already has a hold', response.data['error'])
+
+    def test_place_hold_on_available_book(self):
+        """Test that holds cannot be placed on available books"""
+        Book.objects.create(serial_number='234567', title='Free', author='Author')
+        url = reverse('hold-list')
+        data = {'book_serial': '234567', 'card_number': '222222'}
+        response = self.client.post(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('available', response.data['error'])
+
+    def test_return_promotes_holds_in_order(self):
+        """Test that returning a book reserves it for the oldest hold"""
+        self.place_hold('222222')
+        self.place_hold('333333')
+
+        url = reverse('checkout-return-book', kwargs={'pk': self.checkout.id})
+        self.client.post(url)
+        self.assertEqual(Hold.objects.get(reader=self.first).status, Hold.READY)
+        self.assertEqual(Hold.objects.get(reader=self.second).status, Hold.WAITING)
+
+        url = reverse('checkout-checkout')
+        response = self.client.post(url, {'book_serial': '123456', 'card_number': '333333'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('reserved for another reader', response.data['error'])
+
+        response = self.client.post(url, {'book_serial': '123456', 'card_number': '222222'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Hold.objects.get(reader=self.first).status, Hold.FULFILLED)
+
+    def test_cancel_ready_hold_promotes_next(self):
+        """Test that cancelling a ready hold passes the book to the next hold"""
+        first_hold = self.place_hold('222222').data
+        self.place_hold('333333')
+        self.client.post(reverse('checkout-return-book', kwargs={'pk': self.checkout.id}))
+
+        url = reverse('hold-cancel', kwargs={'pk': first_hold['id']})
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], Hold.CANCELLED)
+        self.assertEqual(Hold.objects.get(reader=self.second).status, Hold.READY)
+
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_double_return_promotes_one_hold(self):
+        """Test that a return racing another return of the same loan is refused"""
+        self.place_hold('222222')
+        self.place_hold('333333')
+        # Loaded before the first return, as by a concurrent request
+        stale = Checkout.objects.get(pk=self.checkout.id)
+        url = reverse('checkout-return-book', kwargs={'pk': self.checkout.id})
+        self.assertEqual(self.client.post(url).status_code, status.HTTP_200_OK)
+
+        with patch.object(CheckoutViewSet, 'get_object', return_value=stale):
+            response = self.client.post(url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('already been returned', response.data['error'])
+        self.assertEqual(Hold.objects.filter(status=Hold.READY).count(), 1)
+        self.assertEqual(Hold.objects.get(reader=self.second).status, Hold.WAITING)
+
+    def test_checkout_expires_uncollected_hold(self):
+        """Test that a ready hold past HOLD_READY_DAYS no longer blocks the book"""
+        self.place_hold('222222')
+        self.place_hold('333333')
+        self.client.post(reverse('checkout-return-book', kwargs={'pk': self.checkout.id}))
+        Hold.objects.filter(reader=self.first).update(
+            ready_at=timezone.now() - timedelta(days=settings.HOLD_READY_DAYS, hours=1)
+        )
+
+        url = reverse('checkout-checkout')
+        response = self.client.post(url, {'book_serial': '123456', 'card_number': '333333'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Hold.objects.get(reader=self.first).status, Hold.EXPIRED)
+        self.assertEqual(Hold.objects.get(reader=self.second).status, Hold.FULFILLED)
+
+    def test_sweep_expires_uncollected_holds(self):
+        """Test that the overdue sweep expires uncollected holds and promotes the next one"""
+        self.place_hold('222222')
+        self.place_hold('333333')
+        self.client.post(reverse('checkout-return-book', kwargs={'pk': self.checkout.id}))
+        Hold.objects.filter(reader=self.first).update(
+            ready_at=timezone.now() - timedelta(days=settings.HOLD_READY_DAYS, hours=1)
+        )
+
+        out = StringIO()
+        call_command('sweep_overdue', stdout=out)
+        self.assertIn('Expired 1 uncollected holds', out.getvalue())
+        self.assertEqual(Hold.objects.get(reader=self.first).status, Hold.EXPIRED)
+        self.assertEqual(Hold.objects.get(reader=self.second).status, Hold.READY)
+
+        call_command('sweep_overdue', stdout=out)
+        self.assertIn('Expired 0 uncollected holds', out.getvalue())
+
+
+@override_settings(CHANGE_FEED_VISIBILITY_LAG=0)
+class ChangeFeedTest(APITestCase):
+    def test_change_feed_is_ordered_and_resumable(self):
+        """Test that writes are logged and the feed resumes from a cursor"""
+        self.client.post(reverse('book-list'), {
+            'serial_number': '123456', 'title': 'Book', 'author': 'Author'
+        }, format='json')
+        self.client.post(reverse('reader-list'), {
+            'card_number': '111111', 'name': 'Reader'
+        }, format='json')
+        response = self.client.post(reverse('checkout-checkout'), {
+            'book_serial': '123456', 'card_number': '111111'
+        }, format='json')
+        self.client.post(reverse('checkout-return-book', kwargs={'pk': response.data['id']}))
+        self.client.delete(reverse('book-detail', kwargs={'serial_number': '123456'}))
+
+        url = reverse('change-list')
+        response = self.client.get(url, {'limit': 3})
+        self.assertEqual(
+            [(change['entity'], change['action']) for change in response.data['results']],
+            [('book', 'created'), ('reader', 'created'), ('book', 'checked_out')]
+        )
+        self.assertTrue(response.data['has_more'])
+
+        response = self.client.get(url, {'since': response.data['cursor']})
+        self.assertEqual(
+            [change['action'] for change in response.data['results']],
+            ['returned', 'deleted']
+        )
+        self.assertEqual(response.data['results'][1]['key'], '123456')
+        self.assertFalse(response.data['has_more'])
+
+        cursor = response.data['cursor']
+        response = self.client.get(url, {'since': cursor})
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['cursor'], cursor)
+
+    @override_settings(CHANGE_FEED_VISIBILITY_LAG=5)
+    def test_feed_waits_for_changes_committed_out_of_order(self):
+        """Test that the cursor does not pass a change whose transaction commits after a later one"""
+        url = reverse('change-list')
+        # Transaction A takes id 1, transaction B takes id 2 and commits first
+        Change.objects.create(id=2, entity=Change.BOOK, key='222222', action=Change.CREATED)
+        response = self.client.get(url)
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['cursor'], 0)
+
+        # Transaction A commits, and both changes become older than the lag
+        Change.objects.create(id=1, entity=Change.BOOK, key='111111', action=Change.CREATED)
+        Change.objects.update(created_at=timezone.now() - timedelta(seconds=5))
+        response = self.client.get(url)
+        self.assertEqual([change['key'] for change in response.data['results']], ['111111', '222222'])
+        self.assertEqual(response.data['cursor'], 2)
+
+        # A change inside the lag holds back the changes after it
+        Change.objects.create(id=3, entity=Change.BOOK, key='333333', action=Change.DELETED)
+        change = Change.objects.create(id=4, entity=Change.BOOK, key='444444', action=Change.DELETED)
+        Change.objects.filter(pk=change.pk).update(created_at=timezone.now() - timedelta(seconds=5))
+        response = self.client.get(url, {'since': 2})
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(response.data['cursor'], 2)
+
+    def test_reader_deletion_logs_released_books(self):
+        """Test that books freed by deleting a reader show up in the feed"""
+        book = Book.objects.create(serial_number='123456', title='Book', author='Author')
+        reader = Reader.objects.create(card_number='111111', name='Reader')
+        book.set_active_checkout(Checkout.objects.create(book=book, reader=reader))
+        book.save()
+
+        self.client.delete(reverse('reader-detail', kwargs={'card_number': '111111'}))
+        self.assertEqual(
+            list(Change.objects.order_by('id').values_list('entity', 'key', 'action')),
+            [('reader', '111111', 'deleted'), ('book', '123456', 'updated')]
+        )
+
+
+class AvailabilityEventsTest(SimpleTestCase):
+    def test_broker_fans_out_to_many_subscribers(self):
+        """Test that an event published from another thread reaches every idle subscriber"""
+        broker = InMemoryBroker()
+
+        async def run():
+            subscriptions = [broker.subscribe() for _ in range(2000)]
+            event = {'type': 'availability', 'serial_number': '123456', 'is_available': False}
+            threading.Thread(target=broker.publish, args=(event,)).start()
+            received = await asyncio.wait_for(
+                asyncio.gather(*(subscription.get() for subscription in subscriptions)),
+                timeout=5
+            )
+            for subscription in subscriptions:
+                broker.unsubscribe(subscription)
+            return received
+
+        received = asyncio.run(run())
+        self.assertEqual(len(received), 2000)
+        self.assertTrue(all(event['serial_number'] == '123456' for event in received))
+        self.assertEqual(broker.subscriber_count(), 0)
+
+    def test_event_stream_over_asgi(self):
+        """Test that the ASGI event stream forwards published availability changes"""
+        async def run():
+            response = await self.async_client.get(reverse('availability-events'))
+            self.assertEqual(response['Content-Type'], 'text/event-stream')
+            stream = aiter(response.streaming_content)
+            self.assertEqual(await anext(stream), b'retry: 5000\n\n')
+            next_chunk = asyncio.ensure_future(anext(stream))
+            while get_broker().subscriber_count() == 0:
+                await asyncio.sleep(0.01)
+            publish_availability('main', '123456', True)
+            chunk = await asyncio.wait_for(next_chunk, timeout=5)
+            await stream.aclose()
+            return chunk
+
+        chunk = asyncio.run(run())
+        self.assertIn(b'event: availability', chunk)
+        self.assertIn(b'"serial_number": "123456"', chunk)
+
+    def test_event_stream_subscribes_when_iterated(self):
+        """Test that a stream that is never iterated does not keep a subscription"""
+        async def run():
+            response = await self.async_client.get(reverse('availability-events'))
+            count = get_broker().subscriber_count()
+            await response.streaming_content.aclose()
+            return count
+
+        self.assertEqual(asyncio.run(run()), 0)
+        self.assertEqual(get_broker().subscriber_count(), 0)
+
+    def test_postgres_listener_reconnects(self):
+        """Test that the Postgres listener backs off and reconnects after failures"""
+        class StopListening(BaseException):
+            pass
+
+        broker = PostgresBroker()
+        with patch.object(PostgresBroker, '_connect', side_effect=OSError('connection lost')) as connect, \
+                patch('library.events.time.sleep', side_effect=[None, None, StopListening]) as sleep, \
+                self.assertLogs('library.events', 'ERROR'):
+            with self.assertRaises(StopListening):
+                broker._listen()
+        self.assertEqual(connect.call_count, 3)
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [1, 2, 4])
+
+    def test_event_stream_requires_asgi(self):
+        """Test that WSGI requests are refused instead of holding a worker"""
+        response = self.client.get(reverse('availability-events'))
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
 
 class ManagementCommandsTest(TestCase):
     def test_add_fake_data_command_with_defaults(self):
@@ -300,6 +1207,9 @@ class ManagementCommandsTest(TestCase):
         self.assertEqual(Reader.objects.count(), 5)
         self.assertEqual(Book.objects.count(), 10)
         self.assertEqual(Checkout.objects.count(), 8)
+        # Loans are due a loan period after their stored checkout date
+        for checked_out_at, due_at in Checkout.objects.values_list('checked_out_at', 'due_at'):
+            self.assertEqual(due_at - checked_out_at, timedelta(days=settings.LOAN_PERIOD_DAYS))
     
     def test_clear_data_command(self):
         """Test clear_data command removes all data"""
@@ -323,6 +1233,29 @@ class ManagementCommandsTest(TestCase):
         self.assertEqual(Reader.objects.count(), 0)
         self.assertEqual(Checkout.objects.count(), 0)
     
+    def test_sweep_overdue_command(self):
+        """Test that sweep_overdue marks overdue loans in batches exactly once"""
+        from django.utils import timezone
+        reader = Reader.objects.create(card_number='111111', name='Reader')
+        for i in range(5):
+            book = Book.objects.create(serial_number=f'{100000 + i}', title='Book', author='Author')
+            Checkout.objects.create(book=book, reader=reader, due_at=timezone.now() - timedelta(days=i + 1))
+        Checkout.objects.create(book=book, reader=reader)
+
+        out = StringIO()
+        call_command('sweep_overdue', batch_size=2, stdout=out)
+        self.assertIn('Marked 5 overdue loans', out.getvalue())
+        self.assertEqual(Checkout.objects.filter(overdue_notified_at__isnull=False).count(), 5)
+
+        call_command('sweep_overdue', stdout=out)
+        self.assertIn('Marked 0 overdue loans', out.getvalue())
+
+    def test_benchmark_startup_command(self):
+        """Test that worker startup does not import lazily loaded modules"""
+        out = StringIO()
+        call_command('benchmark_startup', repeat=1, stdout=out)
+        self.assertIn('Cold start:', out.getvalue())
+
     def test_commands_integration(self):
         """Test that commands work together correctly"""
         out = StringIO()
@@ -337,3 +1270,690 @@ class ManagementCommandsTest(TestCase):
         call_command('add_fake_data', readers=2, books=4, checkouts=2, stdout=out)
         self.assertEqual(Book.objects.count(), 4)
         self.assertEqual(Reader.objects.count(), 2)
+
+
+class AdminTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(user)
+        self.next_number = 100000
+
+    def add_loans(self, count):
+        books = create_books(count, start=self.next_number)
+        readers = create_readers(count, start=self.next_number)
+        create_loans(books, readers)
+        Hold.objects.bulk_create(Hold(book=book, reader=reader) for book, reader in zip(books, readers))
+        self.next_number += count
+
+    def count_queries(self, url):
+        # The first request of a session also loads content types and the session
+        self.client.get(url)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelist_queries_do_not_grow_with_rows(self):
+        """Test that admin changelists run a fixed number of queries"""
+        urls = [
+            reverse(f'admin:library_{model}_changelist')
+            for model in ('book', 'reader', 'checkout', 'hold')
+        ]
+        self.add_loans(2)
+        counts = [self.count_queries(url) for url in urls]
+        self.add_loans(10)
+        self.assertEqual([self.count_queries(url) for url in urls], counts)
+
+    def test_change_form_does_not_load_choices(self):
+        """Test that foreign key widgets do not list every book, reader or checkout"""
+        self.add_loans(2)
+        book = Book.objects.first()
+        urls = [
+            reverse('admin:library_book_change', args=[book.pk]),
+            reverse('admin:library_checkout_add'),
+            reverse('admin:library_hold_add'),
+        ]
+        counts = [self.count_queries(url) for url in urls]
+        self.add_loans(10)
+        self.assertEqual([self.count_queries(url) for url in urls], counts)
+
+    def test_search_by_exact_serial_number(self):
+        """Test that the checkout changelist searches by exact serial number"""
+        self.add_loans(2)
+        url = reverse('admin:library_checkout_changelist')
+        response = self.client.get(url, {'q': '100000'})
+        self.assertEqual(response.context['cl'].result_count, 1)
+        response = self.client.get(url, {'q': '10000'})
+        self.assertEqual(response.context['cl'].result_count, 0)
+
+
+@override_settings(PROFILING_ENABLED=True)
+class ProfilingTest(APITestCase):
+    def setUp(self):
+        Book.objects.create(serial_number='123456', title='Book', author='Author')
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+
+    def test_signed_header_captures_cprofile(self):
+        """Test that a request with a signed header is profiled and downloadable"""
+        response = self.client.get(
+            reverse('book-list'), {'title': 'Book'}, HTTP_X_PROFILE=make_token(RequestProfile.CPROFILE)
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        profile = RequestProfile.objects.get(id=response['X-Profile-Id'])
+        self.assertEqual(profile.route, 'book-list')
+        self.assertEqual(profile.query_params, {'title': ['Book']})
+        self.assertTrue(any('library_book' in query['sql'] for query in profile.sql))
+
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('profile-download', args=[profile.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        stats = marshal.loads(response.content)
+        self.assertTrue(any(function == 'list' for _, _, function in stats))
+
+    @override_settings(PROFILING_SAMPLE_RATE=1.0, PROFILING_SAMPLING_INTERVAL=0.0001)
+    def test_sample_rate_captures_sampling_profile(self):
+        """Test that sampled requests are profiled with the sampling profiler"""
+        # Keeps the request running long enough for the sampler to be scheduled on a busy machine
+        with patch('library.views.BookViewSet.filter_queryset', autospec=True,
+                   side_effect=lambda view, queryset: time.sleep(0.05) or queryset):
+            response = self.client.get(reverse('book-list'))
+        profile = RequestProfile.objects.get(id=response['X-Profile-Id'])
+        self.assertEqual(profile.mode, RequestProfile.SAMPLING)
+        self.assertTrue(bytes(profile.data))
+        for line in bytes(profile.data).decode().splitlines():
+            stack, count = line.rsplit(' ', 1)
+            self.assertGreater(int(count), 0)
+
+    def test_invalid_token_is_ignored(self):
+        """Test that requests with a forged header are not profiled"""
+        response = self.client.get(reverse('book-list'), HTTP_X_PROFILE='forged')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertFalse(RequestProfile.objects.exists())
+
+    @override_settings(PROFILING_ENABLED=False)
+    def test_disabled_profiling(self):
+        """Test that nothing is profiled when profiling is disabled"""
+        self.client.get(reverse('book-list'), HTTP_X_PROFILE=make_token())
+        self.assertFalse(RequestProfile.objects.exists())
+
+    def test_profiles_require_staff(self):
+        """Test that profiles are only visible to staff users"""
+        response = self.client.get(reverse('profile-list'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class JobsTest(APITestCase):
+    def setUp(self):
+        create_books(5)
+        self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(self.admin)
+        output_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(output_dir.cleanup)
+        settings_override = override_settings(JOBS_OUTPUT_DIR=output_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def run_worker(self):
+        call_command('run_jobs', '--once', '--processes', '0', stdout=StringIO())
+
+    def test_export_job(self):
+        """Test that a queued export runs in the worker and its file can be downloaded"""
+        response = self.client.post(
+            reverse('job-list'), {'kind': 'export_books', 'params': {'is_available': True}}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(response.data['status'], Job.QUEUED)
+        self.assertEqual(response['Location'], f"http://testserver{reverse('job-detail', args=[response.data['id']])}")
+
+        self.run_worker()
+
+        response = self.client.get(reverse('job-detail', args=[response.data['id']]))
+        self.assertEqual(response.data['status'], Job.SUCCEEDED)
+        self.assertEqual(response.data['result'], {'rows': 5})
+        self.assertEqual((response.data['progress'], response.data['total']), (5, 5))
+
+        response = self.client.get(reverse('job-download', args=[response.data['id']]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        rows = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1], '100000,History volume 0,Author 0,True,')
+
+    def test_invalid_job(self):
+        """Test that unknown kinds and invalid params are rejected"""
+        response = self.client.post(reverse('job-list'), {'kind': 'drop_tables'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post(
+            reverse('job-list'), {'kind': 'record_checkout', 'params': {'checkout_id': 1}}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(
+            reverse('job-list'), {'kind': 'sweep_overdue', 'params': {'batch_size': 0}}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(JOBS_MAX_QUEUED=1)
+    def test_queue_limit(self):
+        """Test that new jobs are refused while the queue is full"""
+        self.assertEqual(
+            self.client.post(reverse('job-list'), {'kind': 'sweep_overdue'}, format='json').status_code,
+            status.HTTP_202_ACCEPTED
+        )
+        response = self.client.post(reverse('job-list'), {'kind': 'sweep_overdue'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    def test_jobs_require_staff(self):
+        """Test that jobs are only visible to staff users"""
+        self.client.logout()
+        response = self.client.post(reverse('job-list'), {'kind': 'sweep_overdue'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_cancel_job(self):
+        """Test that only queued jobs can be cancelled"""
+        job = enqueue('sweep_overdue')
+        response = self.client.post(reverse('job-cancel', args=[job.id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], Job.CANCELLED)
+
+        response = self.client.post(reverse('job-cancel', args=[job.id]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_concurrency_limit(self):
+        """Test that jobs of a kind at its concurrency limit are left in the queue"""
+        first = enqueue('build_recommendations')
+        second = enqueue('build_recommendations')
+        export = enqueue('export_books')
+
+        self.assertEqual(claim_jobs(3, 'worker'), [first.id, export.id])
+        self.assertEqual(claim_jobs(3, 'worker'), [])
+
+        Job.objects.filter(id=first.id).update(status=Job.SUCCEEDED)
+        self.assertEqual(claim_jobs(3, 'worker'), [second.id])
+
+    def test_failed_job(self):
+        """Test that a failing handler marks its job as failed with the error"""
+        job = enqueue('build_recommendations')
+        with patch('library.jobs.build_relations', side_effect=RuntimeError('boom')), \
+                self.assertLogs('library.jobs', level='ERROR'):
+            self.run_worker()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertIn('RuntimeError: boom', job.error)
+
+    @override_settings(JOBS_HEARTBEAT_INTERVAL=0.02)
+    def test_inline_worker_sends_heartbeats(self):
+        """Test that a job running in the worker's own thread is kept alive by heartbeats"""
+        job = enqueue('build_recommendations')
+        with patch('library.jobs.build_relations', side_effect=lambda **kwargs: time.sleep(0.2) or 0), \
+                patch('library.jobs.heartbeat') as heartbeat:
+            self.run_worker()
+        self.assertIn(([job.id],), [call.args for call in heartbeat.call_args_list])
+        self.assertEqual(Job.objects.get(id=job.id).status, Job.SUCCEEDED)
+
+    def test_handlers_report_progress(self):
+        """Test that every job kind reports its total and progress"""
+        reader = create_readers(1)[0]
+        Checkout.objects.create(book=Book.objects.first(), reader=reader, returned_at=timezone.now())
+        recommendations = enqueue('build_recommendations')
+        fake_data = enqueue('add_fake_data', {'readers': 2, 'books': 2, 'checkouts': 1})
+        self.run_worker()
+
+        recommendations.refresh_from_db()
+        self.assertEqual((recommendations.progress, recommendations.total), (5, 5))
+        fake_data.refresh_from_db()
+        self.assertEqual((fake_data.status, fake_data.total), (Job.SUCCEEDED, 5))
+
+    def test_stale_jobs_are_requeued(self):
+        """Test that jobs of a worker without heartbeats are retried up to the attempt limit"""
+        stale = timezone.now() - timedelta(seconds=settings.JOBS_STALE_AFTER + 1)
+        retried = Job.objects.create(kind='sweep_overdue', status=Job.RUNNING, attempts=1, heartbeat_at=stale)
+        exhausted = Job.objects.create(
+            kind='sweep_overdue', status=Job.RUNNING, attempts=settings.JOBS_MAX_ATTEMPTS, heartbeat_at=stale
+        )
+        alive = Job.objects.create(kind='sweep_overdue', status=Job.RUNNING, attempts=1, heartbeat_at=timezone.now())
+
+        self.assertEqual(requeue_stale_jobs(), 1)
+        self.assertEqual(Job.objects.get(id=retried.id).status, Job.QUEUED)
+        self.assertEqual(Job.objects.get(id=exhausted.id).status, Job.FAILED)
+        self.assertEqual(Job.objects.get(id=alive.id).status, Job.RUNNING)
+
+    def test_executor_recycles_processes_when_supported(self):
+        """Test that the pool is only asked to recycle processes on Python 3.11 and later"""
+        for version, recycles in [((3, 10, 14), False), ((3, 11, 0), True)]:
+            with patch('library.jobs.sys', version_info=version), \
+                    patch('library.jobs.ProcessPoolExecutor') as executor:
+                Worker(processes=1).start_executor()
+            self.assertEqual('max_tasks_per_child' in executor.call_args.kwargs, recycles)
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=1e-6)
+class SlowQueryTest(APITestCase):
+    def setUp(self):
+        create_books(5)
+        slow_queries._explained.clear()
+
+    def test_fingerprint_ignores_literals(self):
+        """Test that queries differing only in their values share a fingerprint"""
+        self.assertEqual(
+            slow_queries.fingerprint('SELECT * FROM "library_book" WHERE "id" IN (%s, %s) LIMIT 20'),
+            slow_queries.fingerprint('SELECT *  FROM "library_book" WHERE "id" IN (%s) LIMIT 40')
+        )
+        self.assertEqual(
+            slow_queries.fingerprint("SELECT 1 FROM \"library_book\" WHERE \"title\" = 'a''b'"),
+            slow_queries.fingerprint("SELECT 2 FROM \"library_book\" WHERE \"title\" = 'c'")
+        )
+        self.assertNotEqual(
+            slow_queries.fingerprint('SELECT * FROM "library_book"'),
+            slow_queries.fingerprint('SELECT * FROM "library_reader"')
+        )
+
+    def test_slow_queries_are_stored_with_plan(self):
+        """Test that slow queries are stored with their view, parameters and plan"""
+        with self.assertLogs('library.slow_queries', level='WARNING'):
+            response = self.client.get(reverse('book-list'), {'title': 'history', 'is_available': 'false'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        query = SlowQuery.objects.filter(view='BookViewSet.list', sql__contains='"library_book"').first()
+        self.assertIsNotNone(query)
+        self.assertEqual(query.query_params, {'title': ['history'], 'is_available': ['false']})
+        self.assertEqual(query.database, 'default')
+        self.assertIn('%history%', query.params)
+        # Plans are captured by a job, off the request
+        self.assertEqual(query.plan, '')
+        self.assertTrue(Job.objects.filter(kind='explain_slow_query', params={'slow_query_id': query.id}).exists())
+        call_command('run_jobs', '--once', '--processes', '0', stdout=StringIO())
+        query.refresh_from_db()
+        self.assertIn('library_book', query.plan)
+
+        # Plans of fingerprints explained recently are not captured again
+        with self.assertLogs('library.slow_queries', level='WARNING'):
+            self.client.get(reverse('book-list'), {'title': 'science', 'is_available': 'false'})
+        repeated = SlowQuery.objects.filter(fingerprint=query.fingerprint).order_by('-id').first()
+        self.assertNotEqual(repeated.id, query.id)
+        self.assertFalse(
+            Job.objects.filter(kind='explain_slow_query', params={'slow_query_id': repeated.id}).exists()
+        )
+
+    def test_writes_are_not_explained(self):
+        """Test that statements other than plain SELECTs are never run again by EXPLAIN"""
+        self.assertEqual(slow_queries.explain('default', 'DELETE FROM "library_book"', []), '')
+        self.assertEqual(
+            slow_queries.explain('default', 'SELECT "id" FROM "library_book" FOR UPDATE', []), ''
+        )
+        self.assertEqual(Book.objects.count(), 5)
+        self.assertTrue(slow_queries.UNSAFE_FUNCTION.search("SELECT pg_notify('library_events', %s)"))
+        self.assertTrue(slow_queries.UNSAFE_FUNCTION.search('SELECT NEXTVAL (%s)'))
+        self.assertFalse(slow_queries.UNSAFE_FUNCTION.search('SELECT "next_value" FROM "library_book"'))
+
+    @override_settings(SLOW_QUERY_THRESHOLD_MS=None)
+    def test_disabled_log(self):
+        """Test that nothing is stored when no threshold is set"""
+        self.client.get(reverse('book-list'))
+        self.assertFalse(SlowQuery.objects.exists())
+
+    def test_report(self):
+        """Test that the report groups slow queries by fingerprint and shows plans"""
+        with self.assertLogs('library.slow_queries', level='WARNING'):
+            self.client.get(reverse('book-list'), {'title': 'history'})
+            self.client.get(reverse('book-list'), {'title': 'science'})
+        query = SlowQuery.objects.filter(view='BookViewSet.list', sql__contains='"library_book"').first()
+
+        out = StringIO()
+        call_command('slow_queries', stdout=out)
+        self.assertIn(query.fingerprint, out.getvalue())
+        call_command('run_jobs', '--once', '--processes', '0', stdout=StringIO())
+        query.refresh_from_db()
+        self.assertIn('BookViewSet.list (2)', out.getvalue())
+
+        out = StringIO()
+        call_command('slow_queries', '--fingerprint', query.fingerprint, stdout=out)
+        self.assertIn('Occurrences: 2', out.getvalue())
+        self.assertIn(query.plan, out.getvalue())
+
+        with self.assertRaises(CommandError):
+            call_command('slow_queries', '--fingerprint', 'unknown', stdout=StringIO())
+
+
+class BatchAPITest(APITestCase):
+    def setUp(self):
+        self.books = create_books(2)
+        self.reader = Reader.objects.create(card_number='111111', name='Test Reader')
+
+    def batch(self, *requests):
+        return self.client.post(reverse('batch-list'), {'requests': list(requests)}, format='json')
+
+    def test_batch_of_reads(self):
+        """Test that reads are answered together in the order they were sent"""
+        response = self.batch(
+            {'path': '/readers/111111/'},
+            {'path': f'/books/{self.books[0].serial_number}/'},
+            {'path': '/checkouts/?reader=111111&is_active=true'},
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        reader, book, checkouts = response.data['responses']
+        self.assertEqual((reader['status'], reader['body']['name']), (200, 'Test Reader'))
+        self.assertEqual((book['status'], book['body']['serial_number']), (200, '100000'))
+        self.assertEqual((checkouts['status'], checkouts['body']['count']), (200, 0))
+
+    def test_reads_see_earlier_writes(self):
+        """Test that a write runs between the reads before and after it"""
+        serial_number = self.books[0].serial_number
+        response = self.batch(
+            {'path': f'/books/{serial_number}/'},
+            {
+                'method': 'POST',
+                'path': '/checkouts/checkout/',
+                'body': {'book_serial': serial_number, 'card_number': '111111'},
+                'headers': {'Idempotency-Key': 'batch-checkout'},
+            },
+            {'path': f'/books/{serial_number}/'},
+        )
+        before, checkout, after = response.data['responses']
+        self.assertTrue(before['body']['is_available'])
+        self.assertEqual(checkout['status'], status.HTTP_201_CREATED)
+        self.assertFalse(after['body']['is_available'])
+        self.assertTrue(IdempotencyKey.objects.filter(key='batch-checkout').exists())
+
+    def test_failures_are_reported_per_request(self):
+        """Test that failing requests do not fail the rest of the batch"""
+        response = self.batch(
+            {'path': '/readers/999999/'},
+            {'path': '/no-such-resource/'},
+            {'path': '/metrics'},
+            {'method': 'POST', 'path': '/batch/', 'body': {'requests': []}},
+            {'path': '/readers/', 'headers': {'X-Branch': 'atlantis'}},
+            {'path': '/jobs/'},
+            {'path': '/readers/111111/'},
+        )
+        self.assertEqual(
+            [sub_response['status'] for sub_response in response.data['responses']],
+            [404, 404, 400, 400, 400, 403, 200]
+        )
+        self.assertEqual(response.data['responses'][3]['body'], {'error': 'Batch requests cannot be nested'})
+
+    @override_settings(BATCH_MAX_REQUESTS=2)
+    def test_batch_size_limit(self):
+        """Test that batches over the size limit are rejected"""
+        response = self.batch(*[{'path': '/readers/'}] * 3)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(reverse('batch-list'), {'requests': []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BatchConcurrencyTest(APITransactionTestCase):
+    def test_reads_run_concurrently(self):
+        """Test that consecutive reads outside a transaction are spread over pool threads"""
+        create_books(6)
+        threads = set()
+        dispatch = batch.dispatch
+
+        def record_thread(*args):
+            threads.add(threading.get_ident())
+            return dispatch(*args)
+
+        with patch('library.batch.dispatch', side_effect=record_thread):
+            response = self.client.post(
+                reverse('batch-list'),
+                {'requests': [{'path': f'/books/{100000 + i}/'} for i in range(6)]},
+                format='json'
+            )
+
+        self.assertEqual(
+            [sub_response['body']['serial_number'] for sub_response in response.data['responses']],
+            [f'{100000 + i}' for i in range(6)]
+        )
+        # Idle pool threads are reused, so some may have taken more than one share
+        self.assertGreater(len(threads), 1)
+        self.assertIn(threading.get_ident(), threads)
+
+
+class SchemaTest(TestCase):
+    def test_swagger_json_is_cached_with_etag(self):
+        """Test that the schema is served with an ETag and revalidated with 304"""
+        response = self.client.get('/swagger.json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('/books/', response.json()['paths'])
+        etag = response['ETag']
+
+        response = self.client.get('/swagger.json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_generate_schema_command(self):
+        """Test that generate_schema writes the same document as the view serves"""
+        with tempfile.TemporaryDirectory() as output_dir:
+            call_command('generate_schema', output_dir=output_dir, stdout=StringIO())
+            content = (Path(output_dir) / 'swagger.json').read_bytes()
+            self.assertTrue((Path(output_dir) / 'swagger.yaml').exists())
+
+        response = self.client.get('/swagger.json')
+        self.assertEqual(response.content, content)
+
+
+class MetricsTest(APITestCase):
+    @override_settings(METRICS_ACTIVE_LOANS_TTL=0)
+    def test_metrics_endpoint_reports_requests_and_loans(self):
+        """Test that /metrics exposes per-route latency and business metrics"""
+        book = Book.objects.create(serial_number='123456', title='Book', author='Author')
+        Reader.objects.create(card_number='111111', name='Reader')
+        self.client.get(reverse('book-list'), {'page': 1})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse('checkout-checkout'),
+                {'book_serial': '123456', 'card_number': '111111'},
+                format='json'
+            )
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = response.content.decode()
+        self.assertIn('libapi_request_duration_seconds_count{method="GET",route="book-list"}', content)
+        self.assertIn('libapi_db_queries_per_request_count{route="checkout-checkout"}', content)
+        self.assertIn('libapi_page_number_count{route="book-list"}', content)
+        self.assertIn('libapi_checkouts_total', content)
+        self.assertIn('libapi_active_loans 1.0', content)
+
+    def test_metrics_are_restricted_to_allowed_addresses(self):
+        """Test that other addresses cannot scrape the metrics"""
+        response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.5')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        with override_settings(METRICS_ALLOWED_IPS=['203.0.113.0/24']):
+            response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.5')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_active_loans_are_not_counted_on_every_scrape(self):
+        """Test that scrapes within METRICS_ACTIVE_LOANS_TTL reuse the active loans count"""
+        collector = metrics.ActiveLoansCollector()
+        collector.count()
+        with self.assertNumQueries(0):
+            collector.count()
+
+
+class ThrottlingTest(APITestCase):
+    def setUp(self):
+        get_buckets().clear()
+
+    def tearDown(self):
+        get_buckets().clear()
+
+    @override_settings(THROTTLE_BUCKETS={
+        'list': {'capacity': 2, 'refill_rate': 0.1},
+        'write': {'capacity': 100, 'refill_rate': 10},
+    })
+    def test_list_budget_exhausted(self):
+        """Test that a client over its list budget gets 429 with Retry-After"""
+        for _ in range(2):
+            self.assertEqual(self.client.get(reverse('book-list')).status_code, status.HTTP_200_OK)
+
+        response = self.client.get(reverse('book-list'))
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+
+        # Other actions and viewsets have their own buckets
+        response = self.client.post(
+            reverse('reader-list'), {'card_number': '111111', 'name': 'Reader'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.client.get(reverse('reader-list')).status_code, status.HTTP_200_OK)
+
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertIn('libapi_rejected_requests_total{reason="throttled",scope="book.list"}', metrics)
+
+    @override_settings(THROTTLE_BUCKETS={
+        'list': {'capacity': 1, 'refill_rate': 0.1},
+        'checkout.list': {'capacity': 1, 'refill_rate': 0.1},
+    })
+    def test_buckets_are_per_client(self):
+        """Test that clients are throttled independently of each other"""
+        self.client.get(reverse('checkout-list'), REMOTE_ADDR='10.0.0.1')
+        response = self.client.get(reverse('checkout-list'), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+        response = self.client.get(reverse('checkout-list'), REMOTE_ADDR='10.0.0.2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class SharedMemoryBucketsTest(SimpleTestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.buckets = SharedMemoryBuckets(directory.name)
+
+    def test_concurrent_requests_spend_each_token_once(self):
+        """Test that requests racing on one bucket are granted exactly its capacity"""
+        granted = []
+
+        def spend():
+            for _ in range(50):
+                if self.buckets.take('book.list:10.0.0.1', 100, 0.001, time.time()) == 0:
+                    granted.append(1)
+
+        threads = [threading.Thread(target=spend) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(granted), 100)
+        self.assertGreater(self.buckets.take('book.list:10.0.0.1', 100, 0.001, time.time()), 0)
+
+    def test_only_full_buckets_are_pruned(self):
+        """Test that pruning keeps buckets that still hold spent tokens"""
+        now = time.time()
+        self.buckets.take('idle', 10, 10, now - 10)
+        self.buckets.take('busy', 10, 1, now)
+        self.buckets.prune(now)
+        self.assertEqual(len(list(self.buckets.directory.iterdir())), 1)
+        # The remaining bucket kept its state
+        for _ in range(9):
+            self.assertEqual(self.buckets.take('busy', 10, 1, now), 0)
+        self.assertGreater(self.buckets.take('busy', 10, 1, now), 0)
+
+
+class LoadSheddingTest(SimpleTestCase):
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    @override_settings(LOAD_SHEDDING_MAX_QUEUE_MS=500, LOAD_SHEDDING_MAX_IN_FLIGHT=None)
+    def test_sheds_requests_queued_too_long(self):
+        """Test that requests that waited too long in the proxy queue get 503"""
+        middleware = LoadSheddingMiddleware(lambda request: HttpResponse())
+
+        now = time.time()
+        request = self.factory.get('/books/', HTTP_X_REQUEST_START=f't={now - 2:.3f}')
+        response = middleware(request)
+        self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(response['Retry-After'], '5')
+
+        request = self.factory.get('/books/', HTTP_X_REQUEST_START=f't={int(now * 1e6)}')
+        self.assertEqual(middleware(request).status_code, status.HTTP_200_OK)
+        self.assertEqual(middleware(self.factory.get('/books/')).status_code, status.HTTP_200_OK)
+
+    @override_settings(LOAD_SHEDDING_MAX_QUEUE_MS=None, LOAD_SHEDDING_MAX_IN_FLIGHT=1)
+    def test_sheds_requests_over_in_flight_limit(self):
+        """Test that requests beyond the in-flight limit get 503"""
+        responses = []
+
+        def view(request):
+            responses.append(middleware(self.factory.get('/books/')))
+            return HttpResponse()
+
+        middleware = LoadSheddingMiddleware(view)
+        self.assertEqual(middleware(self.factory.get('/books/')).status_code, status.HTTP_200_OK)
+        self.assertEqual(responses[0].status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(middleware.in_flight, 0)
+
+
+class FactoriesTest(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.library = create_library(books=20, readers=5, active_loans=8, returned_loans=4)
+
+    def test_library_dataset(self):
+        """Test that the bulk factories create consistent loans"""
+        self.assertEqual(Book.objects.count(), 20)
+        self.assertEqual(Checkout.objects.filter(returned_at__isnull=True).count(), 8)
+        self.assertEqual(Checkout.objects.filter(returned_at__isnull=False).count(), 4)
+
+        response = self.client.get(reverse('book-list'), {'is_available': 'false'})
+        self.assertEqual(response.data['count'], 8)
+        response = self.client.get(reverse('book-list'), {'title': 'history'})
+        self.assertEqual(response.data['count'], 2)
+        response = self.client.get(reverse('book-availability'), {'serials': '100000,100019'})
+        self.assertEqual(response.data, {'100000': False, '100019': True})
+
+
+@tag('large')
+class LargeDatasetTest(APITestCase):
+    """
+    Filters and pagination against 100k books. Run with "manage.py test --large";
+    every request must stay within a fixed number of queries and the time budget.
+    """
+    BUDGET_MS = 1000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.library = create_library(
+            books=100000, readers=20000, active_loans=30000, returned_loans=30000
+        )
+
+    def setUp(self):
+        get_buckets().clear()
+
+    def assertFast(self, url, params=None, max_queries=4):
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = self.client.get(url, params)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(len(queries), max_queries)
+        self.assertLess(elapsed_ms, self.BUDGET_MS, f'{url} {params} took {elapsed_ms:.0f} ms')
+        return response
+
+    def test_book_filters(self):
+        """Test that book filters stay fast on a large catalogue"""
+        url = reverse('book-list')
+        response = self.assertFast(url, {'is_available': 'false'})
+        self.assertEqual(response.data['count'], 30000)
+        response = self.assertFast(url, {'title': 'history', 'is_available': 'true'})
+        self.assertEqual(response.data['count'], 7000)
+        self.assertFast(url, {'current_reader': self.library.readers[0].id})
+        serials = ','.join(book.serial_number for book in self.library.books[:500:10])
+        response = self.assertFast(url, {'serial_number__in': serials})
+        self.assertEqual(response.data['count'], 50)
+
+    def test_deep_pagination(self):
+        """Test that late pages of books and checkouts stay fast"""
+        self.assertFast(reverse('book-list'), {'page': 1999})
+        self.assertFast(reverse('checkout-list'), {'is_active': 'true', 'page': 599})
+        self.assertFast(reverse('checkout-list'), {'overdue': 'false'})
+
+    def test_history_and_availability(self):
+        """Test that history pages and availability lookups stay fast"""
+        self.assertFast(reverse('reader-history', args=[self.library.readers[0].card_number]))
+        serials = ','.join(book.serial_number for book in self.library.books[::200])
+        response = self.assertFast(reverse('book-availability'), {'serials': serials})
+        self.assertEqual(len(response.data), 500)
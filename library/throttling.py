@@ -0,0 +1,166 @@
+import fcntl
+import hashlib
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django.conf import settings
+from rest_framework.permissions import SAFE_METHODS
+from rest_framework.throttling import BaseThrottle
+
+from . import metrics
+
+# Tokens left, time of the last update and time at which the bucket is full again
+BUCKET_STATE = struct.Struct('<ddd')
+
+
+def take_token(state, capacity, refill_rate, now):
+    """Refills a bucket state and takes a token; returns the new state and the seconds to wait, 0 if taken."""
+    tokens, updated_at, _ = state or (capacity, now, now)
+    tokens = min(capacity, tokens + max(now - updated_at, 0) * refill_rate)
+    if tokens < 1:
+        return (tokens, now, now + (capacity - tokens) / refill_rate), (1 - tokens) / refill_rate
+    tokens -= 1
+    return (tokens, now, now + (capacity - tokens) / refill_rate), 0
+
+
+@contextmanager
+def locked_file(path, create):
+    """Opens a file and holds an exclusive lock on it."""
+    flags = os.O_RDWR | (os.O_CREAT if create else 0)
+    while True:
+        fd = os.open(path, flags, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        # The file was pruned while waiting for the lock, so lock its replacement
+        if os.fstat(fd).st_nlink > 0:
+            break
+        os.close(fd)
+    try:
+        yield fd
+    finally:
+        os.close(fd)
+
+
+class LocalBuckets:
+    """Token buckets of the current process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key, capacity, refill_rate, now):
+        with self._lock:
+            if len(self._buckets) >= 100000:
+                self.prune(now)
+            self._buckets[key], wait = take_token(self._buckets.get(key), capacity, refill_rate, now)
+        return wait
+
+    def prune(self, now):
+        """Drops the buckets that are full again, which are the same as missing ones."""
+        self._buckets = {key: state for key, state in self._buckets.items() if state[2] > now}
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class SharedMemoryBuckets:
+    """
+    Token buckets shared by all processes of a host, one file per bucket in a
+    tmpfs directory. Each update holds an exclusive lock on the bucket's file,
+    so concurrent requests of a client cannot spend the same token twice.
+    Buckets that are full again are pruned every THROTTLE_PRUNE_INTERVAL
+    seconds; live buckets are never dropped.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.last_prune = time.monotonic()
+
+    def take(self, key, capacity, refill_rate, now):
+        if time.monotonic() - self.last_prune >= settings.THROTTLE_PRUNE_INTERVAL:
+            self.last_prune = time.monotonic()
+            self.prune(now)
+
+        path = self.directory / hashlib.sha1(key.encode()).hexdigest()
+        with locked_file(path, create=True) as fd:
+            data = os.pread(fd, BUCKET_STATE.size, 0)
+            state = BUCKET_STATE.unpack(data) if len(data) == BUCKET_STATE.size else None
+            state, wait = take_token(state, capacity, refill_rate, now)
+            os.pwrite(fd, BUCKET_STATE.pack(*state), 0)
+        return wait
+
+    def prune(self, now):
+        for path in self.directory.iterdir():
+            try:
+                with locked_file(path, create=False) as fd:
+                    data = os.pread(fd, BUCKET_STATE.size, 0)
+                    if len(data) == BUCKET_STATE.size and BUCKET_STATE.unpack(data)[2] <= now:
+                        path.unlink()
+            except FileNotFoundError:
+                continue
+
+    def clear(self):
+        for path in self.directory.iterdir():
+            path.unlink(missing_ok=True)
+
+
+_buckets = None
+_buckets_lock = threading.Lock()
+
+
+def get_buckets():
+    global _buckets
+    with _buckets_lock:
+        if _buckets is None:
+            if settings.THROTTLE_BUCKET_DIR:
+                _buckets = SharedMemoryBuckets(settings.THROTTLE_BUCKET_DIR)
+            else:
+                _buckets = LocalBuckets()
+        return _buckets
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Per-client token bucket with separate budgets for list, retrieve and write
+    actions of every viewset.
+
+    Buckets are configured in THROTTLE_BUCKETS, where '<basename>.<kind>' entries
+    override the defaults of '<kind>'. Bucket state is kept in shared memory
+    when THROTTLE_BUCKET_DIR is set, so all workers of a host share the budget.
+    """
+
+    def allow_request(self, request, view):
+        scope = self.get_scope(request, view)
+        bucket = self.get_bucket(scope)
+        if bucket is None:
+            return True
+
+        self.retry_after = get_buckets().take(
+            f'{scope}:{self.get_ident(request)}', bucket['capacity'], bucket['refill_rate'], time.time()
+        )
+        if self.retry_after:
+            metrics.REJECTED_REQUESTS.labels('throttled', scope).inc()
+            return False
+        return True
+
+    def wait(self):
+        return self.retry_after
+
+    def get_scope(self, request, view):
+        basename = getattr(view, 'basename', None) or type(view).__name__
+        if request.method not in SAFE_METHODS:
+            kind = 'write'
+        elif getattr(view, 'detail', False):
+            kind = 'retrieve'
+        else:
+            kind = 'list'
+        return f'{basename}.{kind}'
+
+    def get_bucket(self, scope):
+        buckets = settings.THROTTLE_BUCKETS
+        return buckets.get(scope, buckets.get(scope.split('.')[-1]))
@@ -1,9 +1,20 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
-from .views import BookViewSet, ReaderViewSet, CheckoutViewSet
+from .views import (
+    BookViewSet, ReaderViewSet, CheckoutViewSet, HoldViewSet, ChangeViewSet,
+    RequestProfileViewSet, JobViewSet, BatchViewSet, availability_events
+)
 
 router = DefaultRouter()
 router.register('books', BookViewSet, basename='book')
 router.register('readers', ReaderViewSet, basename='reader')
 router.register('checkouts', CheckoutViewSet, basename='checkout')
+router.register('holds', HoldViewSet, basename='hold')
+router.register('changes', ChangeViewSet, basename='change')
+router.register('profiles', RequestProfileViewSet, basename='profile')
+router.register('jobs', JobViewSet, basename='job')
+router.register('batch', BatchViewSet, basename='batch')
 
-urlpatterns = router.urls
\ No newline at end of file
+urlpatterns = router.urls + [
+    path('events/availability/', availability_events, name='availability-events'),
+]
\ No newline at end of file
@@ -1,26 +1,66 @@
-from django.db import transaction
+import asyncio
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.http import FileResponse, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from rest_framework import viewsets, status, mixins
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from django_filters.rest_framework import DjangoFilterBackend
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
-from .models import Book, Reader, Checkout
+from .models import Book, Reader, Checkout, Hold, Change, RequestProfile, BookRelation, Job
 from .serializers import (
     BookSerializer, ReaderSerializer, CheckoutSerializer,
-    CreateCheckoutSerializer
+    CreateCheckoutSerializer, HoldSerializer, CreateHoldSerializer,
+    ChangeSerializer, ChangeFeedQuerySerializer, AvailabilityQuerySerializer,
+    BatchGetBooksSerializer, BatchGetReadersSerializer,
+    BookHistorySerializer, ReaderHistorySerializer, RequestProfileSerializer,
+    RelatedBookSerializer, RelatedBooksQuerySerializer, JobSerializer, CreateJobSerializer,
+    BatchRequestSerializer
 )
-from .filters import BookFilter, ReaderFilter, CheckoutFilter
+from . import metrics
+from .availability import availability_index
+from .batch import run_batch
+from .branches import BranchScopedMixin, get_current_branch, get_request_branch
+from .events import get_broker, publish_availability
+from .idempotency import IDEMPOTENCY_HEADER, idempotent
+from .jobs import enqueue, export_path, get_public_kinds
+from .filters import BookFilter, ReaderFilter, CheckoutFilter, HoldFilter
+from .pagination import HistoryPagination
+
 
+idempotency_key_parameter = openapi.Parameter(
+    IDEMPOTENCY_HEADER,
+    openapi.IN_HEADER,
+    description='Unique key of the operation; retries with the same key replay the first response',
+    type=openapi.TYPE_STRING
+)
+
+history_cursor_parameter = openapi.Parameter(
+    'cursor',
+    openapi.IN_QUERY,
+    description='Cursor of the page, taken from the next or previous link of the previous page',
+    type=openapi.TYPE_STRING
+)
 
-class BookViewSet(mixins.CreateModelMixin,
+
+class BookViewSet(BranchScopedMixin,
+                  mixins.CreateModelMixin,
                   mixins.RetrieveModelMixin,
                   mixins.DestroyModelMixin,
                   mixins.ListModelMixin,
                   viewsets.GenericViewSet):
-    queryset = Book.objects.select_related('active_checkout__reader').order_by('-created_at')
+    queryset = Book.objects.order_by('-created_at')
     serializer_class = BookSerializer
     lookup_field = 'serial_number'
     filter_backends = [DjangoFilterBackend]
@@ -34,6 +74,12 @@ class BookViewSet(mixins.CreateModelMixin,
                 description='Page number',
                 type=openapi.TYPE_INTEGER
             ),
+            openapi.Parameter(
+                'serial_number__in',
+                openapi.IN_QUERY,
+                description='Filter by comma-separated serial numbers',
+                type=openapi.TYPE_STRING
+            ),
             openapi.Parameter(
                 'title',
                 openapi.IN_QUERY,
@@ -63,8 +109,121 @@ class BookViewSet(mixins.CreateModelMixin,
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'serials',
+                openapi.IN_QUERY,
+                description='Comma-separated book serial numbers',
+                type=openapi.TYPE_STRING,
+                required=True
+            ),
+        ],
+        responses={
+            200: 'Availability keyed by serial number (null for unknown books)',
+            400: 'Bad Request - Missing or invalid serial numbers'
+        }
+    )
+    @action(detail=False, methods=['get'])
+    def availability(self, request):
+        serializer = AvailabilityQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return Response(availability_index.lookup(self.branch, serializer.validated_data['serials']))
+
+    @swagger_auto_schema(
+        method='post',
+        request_body=BatchGetBooksSerializer,
+        responses={
+            200: 'Books keyed by serial number (null for books that were not found)',
+            400: 'Bad Request - Invalid serial numbers'
+        }
+    )
+    @action(detail=False, methods=['post'], url_path='batch-get')
+    def batch_get(self, request):
+        serializer = BatchGetBooksSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serial_numbers = serializer.validated_data['serial_numbers']
+
+        books = {
+            book.serial_number: book
+            for book in self.get_queryset().filter(serial_number__in=serial_numbers)
+        }
+        return Response({
+            serial: BookSerializer(books[serial]).data if serial in books else None
+            for serial in serial_numbers
+        })
+
+    @swagger_auto_schema(
+        method='get',
+        manual_parameters=[history_cursor_parameter],
+        responses={
+            200: 'Loans of the book, newest first, with links to the next and previous pages',
+            404: 'Book not found'
+        }
+    )
+    @action(detail=True, methods=['get'], pagination_class=HistoryPagination)
+    def history(self, request, serial_number=None):
+        book_id = get_object_or_404(self.get_queryset().values_list('id', flat=True), serial_number=serial_number)
+        rows = Checkout.objects.filter(book_id=book_id).values(
+            'id', 'reader_id', 'checked_out_at', 'due_at', 'returned_at'
+        )
+        page = self.paginate_queryset(rows)
+        # Card numbers are looked up for the page only, so the page itself is read from the history index
+        card_numbers = dict(
+            Reader.objects.filter(id__in={row['reader_id'] for row in page}).values_list('id', 'card_number')
+        )
+        for row in page:
+            row['card_number'] = card_numbers[row['reader_id']]
+        return self.get_paginated_response(BookHistorySerializer(page, many=True).data)
+
+    @swagger_auto_schema(
+        method='get',
+        manual_parameters=[
+            openapi.Parameter(
+                'limit',
+                openapi.IN_QUERY,
+                description='Maximum number of related books (default: 10, max: 100)',
+                type=openapi.TYPE_INTEGER
+            ),
+        ],
+        responses={
+            200: RelatedBookSerializer(many=True),
+            400: 'Bad Request - Invalid limit',
+            404: 'Book not found'
+        }
+    )
+    @action(detail=True, methods=['get'])
+    def related(self, request, serial_number=None):
+        serializer = RelatedBooksQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        book_id = get_object_or_404(self.get_queryset().values_list('id', flat=True), serial_number=serial_number)
 
-class ReaderViewSet(mixins.CreateModelMixin,
+        # Precomputed by the build_recommendations command
+        related = BookRelation.objects.filter(book_id=book_id).order_by('-score', 'related_book_id').values(
+            'score',
+            serial_number=F('related_book__serial_number'),
+            title=F('related_book__title'),
+            author=F('related_book__author')
+        )[:serializer.validated_data['limit']]
+        return Response(RelatedBookSerializer(related, many=True).data)
+
+    def perform_create(self, serializer):
+        with transaction.atomic(using=self.branch_db):
+            book = serializer.save()
+            Change.objects.create(
+                branch=self.branch, entity=Change.BOOK, key=book.serial_number, action=Change.CREATED
+            )
+
+    def perform_destroy(self, instance):
+        with transaction.atomic(using=self.branch_db):
+            Change.objects.create(
+                branch=self.branch, entity=Change.BOOK, key=instance.serial_number, action=Change.DELETED
+            )
+            instance.delete()
+
+
+class ReaderViewSet(BranchScopedMixin,
+                    mixins.CreateModelMixin,
                     mixins.RetrieveModelMixin,
                     mixins.DestroyModelMixin,
                     mixins.ListModelMixin,
@@ -83,6 +242,12 @@ class ReaderViewSet(mixins.CreateModelMixin,
                 description='Page number',
                 type=openapi.TYPE_INTEGER
             ),
+            openapi.Parameter(
+                'card_number__in',
+                openapi.IN_QUERY,
+                description='Filter by comma-separated card numbers',
+                type=openapi.TYPE_STRING
+            ),
             openapi.Parameter(
                 'name',
                 openapi.IN_QUERY,
@@ -94,8 +259,85 @@ class ReaderViewSet(mixins.CreateModelMixin,
     def list(self, request, *args, **kwargs):
         return super().list(request, *args, **kwargs)
 
+    @swagger_auto_schema(
+        method='post',
+        request_body=BatchGetReadersSerializer,
+        responses={
+            200: 'Readers keyed by card number (null for readers that were not found)',
+            400: 'Bad Request - Invalid card numbers'
+        }
+    )
+    @action(detail=False, methods=['post'], url_path='batch-get')
+    def batch_get(self, request):
+        serializer = BatchGetReadersSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        card_numbers = serializer.validated_data['card_numbers']
+
+        readers = {
+            reader.card_number: reader
+            for reader in self.get_queryset().filter(card_number__in=card_numbers)
+        }
+        return Response({
+            card_number: ReaderSerializer(readers[card_number]).data if card_number in readers else None
+            for card_number in card_numbers
+        })
+
+    @swagger_auto_schema(
+        method='get',
+        manual_parameters=[history_cursor_parameter],
+        responses={
+            200: 'Loans of the reader, newest first, with links to the next and previous pages',
+            404: 'Reader not found'
+        }
+    )
+    @action(detail=True, methods=['get'], pagination_class=HistoryPagination)
+    def history(self, request, card_number=None):
+        reader_id = get_object_or_404(self.get_queryset().values_list('id', flat=True), card_number=card_number)
+        rows = Checkout.objects.filter(reader_id=reader_id).values(
+            'id', 'book_id', 'checked_out_at', 'due_at', 'returned_at'
+        )
+        page = self.paginate_queryset(rows)
+        # Serial numbers are looked up for the page only, so the page itself is read from the history index
+        serial_numbers = dict(
+            Book.objects.filter(id__in={row['book_id'] for row in page}).values_list('id', 'serial_number')
+        )
+        for row in page:
+            row['serial_number'] = serial_numbers[row['book_id']]
+        return self.get_paginated_response(ReaderHistorySerializer(page, many=True).data)
+
+    def perform_create(self, serializer):
+        with transaction.atomic(using=self.branch_db):
+            reader = serializer.save()
+            Change.objects.create(
+                branch=self.branch, entity=Change.READER, key=reader.card_number, action=Change.CREATED
+            )
+
+    def perform_destroy(self, instance):
+        with transaction.atomic(using=self.branch_db):
+            # Books borrowed or reserved by the reader become free for the next hold
+            released_books = list(Book.objects.filter(
+                Q(current_reader=instance)
+                | Q(holds__reader=instance, holds__status=Hold.READY)
+            ).distinct())
+            Change.objects.create(
+                branch=self.branch, entity=Change.READER, key=instance.card_number, action=Change.DELETED
+            )
+            instance.delete()
+            for book in released_books:
+                Hold.promote_next(book)
+                Change.objects.create(
+                    branch=self.branch, entity=Change.BOOK, key=book.serial_number, action=Change.UPDATED
+                )
+                if book.active_checkout_id:
+                    transaction.on_commit(
+                        lambda serial_number=book.serial_number: publish_availability(
+                            self.branch, serial_number, True
+                        ),
+                        using=self.branch_db
+                    )
 
-class CheckoutViewSet(viewsets.ReadOnlyModelViewSet):
+
+class CheckoutViewSet(BranchScopedMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Checkout.objects.select_related('book', 'reader').order_by('-checked_out_at')
     serializer_class = CheckoutSerializer
     filter_backends = [DjangoFilterBackend]
@@ -127,6 +369,12 @@ class CheckoutViewSet(viewsets.ReadOnlyModelViewSet):
                 description='Filter by active status (true/false)',
                 type=openapi.TYPE_BOOLEAN
             ),
+            openapi.Parameter(
+                'overdue',
+                openapi.IN_QUERY,
+                description='Filter by overdue status of active loans (true/false)',
+                type=openapi.TYPE_BOOLEAN
+            ),
         ]
     )
     def list(self, request, *args, **kwargs):
@@ -135,19 +383,21 @@ class CheckoutViewSet(viewsets.ReadOnlyModelViewSet):
     @swagger_auto_schema(
         method='post',
         request_body=CreateCheckoutSerializer,
+        manual_parameters=[idempotency_key_parameter],
         responses={
             201: CheckoutSerializer,
-            400: 'Bad Request - Book already checked out or invalid data',
+            400: 'Bad Request - Book already checked out, reserved for another reader or invalid data',
             404: 'Book or Reader not found'
         }
     )
     @action(detail=False, methods=['post'])
+    @idempotent
     def checkout(self, request):
         serializer = CreateCheckoutSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
         try:
-            book = Book.objects.get(serial_number=serializer.validated_data['book_serial'])
+            book = Book.objects.filter(branch=self.branch).get(serial_number=serializer.validated_data['book_serial'])
         except Book.DoesNotExist:
             return Response(
                 {'error': 'Book not found'},
@@ -155,29 +405,62 @@ class CheckoutViewSet(viewsets.ReadOnlyModelViewSet):
             )
         
         try:
-            reader = Reader.objects.get(card_number=serializer.validated_data['card_number'])
+            reader = Reader.objects.filter(branch=self.branch).get(card_number=serializer.validated_data['card_number'])
         except Reader.DoesNotExist:
             return Response(
                 {'error': 'Reader not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        if book.active_checkout:
-            return Response(
-                {'error': 'Book is already checked out'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        with transaction.atomic():
+        with transaction.atomic(using=self.branch_db):
+            # The book and its ready hold are locked, so concurrent checkouts, returns
+            # and hold changes of the book run one after the other
+            book = Book.objects.select_for_update().get(pk=book.pk)
+            if book.active_checkout_id:
+                return Response(
+                    {'error': 'Book is already checked out'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            ready_hold = Hold.objects.select_for_update().filter(book=book, status=Hold.READY).first()
+            # A hold that was not picked up in time passes the book to the next reader
+            if ready_hold and ready_hold.is_expired():
+                ready_hold = ready_hold.expire()
+            if ready_hold and ready_hold.reader_id != reader.id:
+                return Response(
+                    {'error': 'Book is reserved for another reader'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
             # Create checkout
             checkout = Checkout.objects.create(
+                branch=self.branch,
                 book=book,
                 reader=reader
             )
             
             # Update book's active checkout
-            book.active_checkout = checkout
+            book.set_active_checkout(checkout)
             book.save()
+            Change.objects.create(
+                branch=self.branch, entity=Change.BOOK, key=book.serial_number, action=Change.CHECKED_OUT
+            )
+            transaction.on_commit(
+                lambda: publish_availability(self.branch, book.serial_number, False), using=self.branch_db
+            )
+
+            # The reader picks up the book they were holding
+            if ready_hold:
+                ready_hold.status = Hold.FULFILLED
+                ready_hold.closed_at = timezone.now()
+                ready_hold.save(update_fields=['status', 'closed_at'])
+            transaction.on_commit(metrics.CHECKOUTS.inc, using=self.branch_db)
+            # Updating the related books takes a dozen queries, which the worker runs
+            transaction.on_commit(
+                lambda: enqueue('record_checkout', {'checkout_id': checkout.id}, branch=self.branch),
+                robust=True,
+                using=self.branch_db
+            )
         
         return Response(
             CheckoutSerializer(checkout).data,
@@ -187,6 +470,7 @@ class CheckoutViewSet(viewsets.ReadOnlyModelViewSet):
     @swagger_auto_schema(
         method='post',
         request_body=openapi.Schema(type=openapi.TYPE_OBJECT),
+        manual_parameters=[idempotency_key_parameter],
         responses={
             200: CheckoutSerializer,
             400: 'Bad Request - Book is not checked out or already returned',
@@ -194,26 +478,386 @@ class CheckoutViewSet(viewsets.ReadOnlyModelViewSet):
         }
     )
     @action(detail=True, methods=['post'], url_path='return')
+    @idempotent
     def return_book(self, request, pk=None):
         checkout = self.get_object()
         
-        if checkout.returned_at:
-            return Response(
-                {'error': 'Book has already been returned'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        with transaction.atomic():
+        with transaction.atomic(using=self.branch_db):
+            # Locked in the same order as a checkout: the book, then the loan, so that
+            # concurrent returns of a loan cannot both pass the check below
+            book = Book.objects.select_for_update().get(pk=checkout.book_id)
+            checkout = Checkout.objects.select_for_update().get(pk=checkout.pk)
+            if checkout.returned_at:
+                return Response(
+                    {'error': 'Book has already been returned'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
             checkout.returned_at = timezone.now()
             checkout.save()
             
             # Clear book's active checkout
-            book = checkout.book
             if book.active_checkout_id == checkout.id:
-                book.active_checkout = None
+                book.set_active_checkout(None)
                 book.save()
+                Change.objects.create(
+                    branch=self.branch, entity=Change.BOOK, key=book.serial_number, action=Change.RETURNED
+                )
+                transaction.on_commit(
+                    lambda: publish_availability(self.branch, book.serial_number, True), using=self.branch_db
+                )
+
+                # Reserve the book for the next reader in the queue
+                Hold.promote_next(book)
+            transaction.on_commit(metrics.RETURNS.inc, using=self.branch_db)
         
         return Response(
             CheckoutSerializer(checkout).data,
             status=status.HTTP_200_OK
         )
+
+
+class HoldViewSet(BranchScopedMixin,
+                  mixins.RetrieveModelMixin,
+                  mixins.ListModelMixin,
+                  viewsets.GenericViewSet):
+    queryset = Hold.objects.select_related('book', 'reader').order_by('-created_at')
+    branch_lookup = 'book__branch'
+    serializer_class = HoldSerializer
+    filter_backends = [DjangoFilterBackend]
+    filterset_class = HoldFilter
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'page',
+                openapi.IN_QUERY,
+                description='Page number',
+                type=openapi.TYPE_INTEGER
+            ),
+            openapi.Parameter(
+                'book',
+                openapi.IN_QUERY,
+                description='Filter by book serial number',
+                type=openapi.TYPE_STRING
+            ),
+            openapi.Parameter(
+                'reader',
+                openapi.IN_QUERY,
+                description='Filter by reader card number',
+                type=openapi.TYPE_STRING
+            ),
+            openapi.Parameter(
+                'status',
+                openapi.IN_QUERY,
+                description='Filter by status (waiting/ready/fulfilled/cancelled/expired)',
+                type=openapi.TYPE_STRING
+            ),
+        ]
+    )
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @swagger_auto_schema(
+        request_body=CreateHoldSerializer,
+        responses={
+            201: HoldSerializer,
+            400: 'Bad Request - Book is available, already held or borrowed by the reader',
+            404: 'Book or Reader not found'
+        }
+    )
+    def create(self, request):
+        serializer = CreateHoldSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        try:
+            book = Book.objects.filter(branch=self.branch).get(serial_number=serializer.validated_data['book_serial'])
+        except Book.DoesNotExist:
+            return Response(
+                {'error': 'Book not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        try:
+            reader = Reader.objects.filter(branch=self.branch).get(card_number=serializer.validated_data['card_number'])
+        except Reader.DoesNotExist:
+            return Response(
+                {'error': 'Reader not found'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+
+        if book.active_checkout_id is None and not book.holds.filter(status=Hold.READY).exists():
+            return Response(
+                {'error': 'Book is available for checkout'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if book.current_reader_id == reader.id:
+            return Response(
+                {'error': 'Book is already checked out by this reader'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            with transaction.atomic(using=self.branch_db):
+                hold = Hold.objects.create(book=book, reader=reader)
+        except IntegrityError:
+            return Response(
+                {'error': 'Reader already has a hold on this book'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(
+            HoldSerializer(hold).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    @swagger_auto_schema(
+        method='post',
+        request_body=openapi.Schema(type=openapi.TYPE_OBJECT),
+        responses={
+            200: HoldSerializer,
+            400: 'Bad Request - Hold is already fulfilled or cancelled',
+            404: 'Hold not found'
+        }
+    )
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        hold = self.get_object()
+
+        if hold.status not in Hold.OPEN_STATUSES:
+            return Response(
+                {'error': 'Hold is already fulfilled or cancelled'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with transaction.atomic(using=self.branch_db):
+            # Locked in the same order as a checkout: the book, then the hold
+            Book.objects.select_for_update().filter(pk=hold.book_id).first()
+            hold = Hold.objects.select_for_update().get(pk=hold.pk)
+            if hold.status not in Hold.OPEN_STATUSES:
+                return Response(
+                    {'error': 'Hold is already fulfilled or cancelled'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            was_ready = hold.status == Hold.READY
+            hold.status = Hold.CANCELLED
+            hold.closed_at = timezone.now()
+            hold.save(update_fields=['status', 'closed_at'])
+
+            # A cancelled reservation passes the book to the next reader
+            if was_ready:
+                Hold.promote_next(hold.book)
+
+        return Response(
+            HoldSerializer(hold).data,
+            status=status.HTTP_200_OK
+        )
+
+
+class ChangeViewSet(BranchScopedMixin, viewsets.GenericViewSet):
+    queryset = Change.objects.order_by('id')
+    serializer_class = ChangeSerializer
+    pagination_class = None
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            openapi.Parameter(
+                'since',
+                openapi.IN_QUERY,
+                description='Cursor returned by the previous call (0 to start from the beginning)',
+                type=openapi.TYPE_INTEGER
+            ),
+            openapi.Parameter(
+                'limit',
+                openapi.IN_QUERY,
+                description='Maximum number of changes to return (default: 500, max: 1000)',
+                type=openapi.TYPE_INTEGER
+            ),
+        ],
+        responses={
+            200: 'Changes after the cursor, the cursor to resume from and whether more changes are pending',
+            400: 'Bad Request - Invalid cursor or limit'
+        }
+    )
+    def list(self, request):
+        serializer = ChangeFeedQuerySerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        since = serializer.validated_data['since']
+        limit = serializer.validated_data['limit']
+
+        changes = list(self.get_queryset().filter(id__gt=since)[:limit + 1])
+        # Ids are taken at insert but become visible at commit, so a transaction still
+        # running may hold a lower id than a committed change. Changes younger than the
+        # visibility lag, and everything after them, are left for the next call.
+        visible_before = timezone.now() - timedelta(seconds=settings.CHANGE_FEED_VISIBILITY_LAG)
+        for position, change in enumerate(changes):
+            if change.created_at >= visible_before:
+                changes = changes[:position]
+                break
+        has_more = len(changes) > limit
+        changes = changes[:limit]
+
+        return Response({
+            'results': ChangeSerializer(changes, many=True).data,
+            'cursor': changes[-1].id if changes else since,
+            'has_more': has_more
+        })
+
+
+class RequestProfileViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = RequestProfile.objects.defer('data').order_by('-id')
+    serializer_class = RequestProfileSerializer
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        method='get',
+        responses={
+            200: 'Profile file: marshalled pstats for cProfile, collapsed stacks for sampling',
+            404: 'Profile not found'
+        }
+    )
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        profile = get_object_or_404(RequestProfile, pk=pk)
+        extension = 'prof' if profile.mode == RequestProfile.CPROFILE else 'txt'
+        response = HttpResponse(bytes(profile.data), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="profile-{profile.id}.{extension}"'
+        return response
+
+
+class JobViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Job.objects.order_by('-id')
+    serializer_class = JobSerializer
+    permission_classes = [IsAdminUser]
+
+    @swagger_auto_schema(
+        request_body=CreateJobSerializer,
+        responses={
+            202: JobSerializer,
+            400: 'Bad Request - Unknown job kind or invalid params',
+            503: 'Service Unavailable - Too many queued jobs'
+        }
+    )
+    def create(self, request):
+        serializer = CreateJobSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        queued = Job.objects.filter(status=Job.QUEUED, kind__in=get_public_kinds())
+        if queued.count() >= settings.JOBS_MAX_QUEUED:
+            return Response(
+                {'error': 'Too many queued jobs'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+
+        job = enqueue(
+            serializer.validated_data['kind'],
+            serializer.validated_data['params'],
+            branch=get_current_branch()
+        )
+        return Response(
+            JobSerializer(job).data,
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': reverse('job-detail', args=[job.id], request=request)}
+        )
+
+    @swagger_auto_schema(
+        method='post',
+        request_body=openapi.Schema(type=openapi.TYPE_OBJECT),
+        responses={
+            200: JobSerializer,
+            400: 'Bad Request - Job is already running or finished',
+            404: 'Job not found'
+        }
+    )
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        job = self.get_object()
+
+        # Only a job no worker has claimed yet can be cancelled
+        cancelled = Job.objects.filter(id=job.id, status=Job.QUEUED).update(
+            status=Job.CANCELLED,
+            finished_at=timezone.now()
+        )
+        if not cancelled:
+            return Response(
+                {'error': 'Job is already running or finished'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        job.refresh_from_db()
+        return Response(JobSerializer(job).data, status=status.HTTP_200_OK)
+
+    @swagger_auto_schema(
+        method='get',
+        responses={
+            200: 'CSV file written by an export job',
+            404: 'Job not found or it has no file'
+        }
+    )
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        path = export_path(job)
+        if job.status != Job.SUCCEEDED or not path.exists():
+            return Response(
+                {'error': 'Job has no file to download'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name, content_type='text/csv')
+
+
+class BatchViewSet(viewsets.ViewSet):
+    # Sub-requests are throttled by their own viewsets
+    throttle_classes = []
+
+    @swagger_auto_schema(
+        request_body=BatchRequestSerializer,
+        responses={
+            200: 'Status, headers and body of every request, in the order they were sent',
+            400: 'Bad Request - Invalid or too many requests'
+        }
+    )
+    def create(self, request):
+        serializer = BatchRequestSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'responses': run_batch(request, serializer.validated_data['requests'])})
+
+
+async def availability_events(request):
+    """Streams book availability changes of the requested branch as server-sent events."""
+    if not isinstance(request, ASGIRequest):
+        # A WSGI worker would be held by the stream for as long as the client listens
+        return JsonResponse(
+            {'error': 'Event stream is only available when served through ASGI'},
+            status=status.HTTP_501_NOT_IMPLEMENTED
+        )
+
+    branch = get_request_branch(request)
+    broker = get_broker()
+
+    async def stream():
+        # Subscribed once the stream is iterated, so a response that is never sent does not leak a subscription
+        subscription = broker.subscribe()
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.get(),
+                        timeout=settings.EVENTS_KEEPALIVE_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                if event['branch'] != branch:
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            broker.unsubscribe(subscription)
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response